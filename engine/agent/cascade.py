@@ -0,0 +1,96 @@
+import os
+import time
+from collections import Counter
+from .prompts import estimate_tokens
+
+# Cheapest first; a tier's answer is only used if it passes the caller's checks,
+# otherwise the next tier is asked (the last tier's answer is always returned).
+# Opt-in: a single qwen-max tier by default, see .env.example
+L1_MODEL_CASCADE = os.getenv("L1_MODEL_CASCADE", "qwen-max")
+PLANNER_MODEL_CASCADE = os.getenv("PLANNER_MODEL_CASCADE", "qwen-max")
+
+# DashScope list prices, CNY per 1k tokens (input, output); unknown models report no cost
+MODEL_PRICES = {
+    "qwen-turbo": (0.0003, 0.0006),
+    "qwen-plus": (0.0008, 0.002),
+    "qwen-max": (0.0024, 0.0096),
+    "qwen-vl-plus": (0.0015, 0.0045),
+    "qwen-vl-max": (0.003, 0.009),
+}
+
+
+def parse_models(value):
+    return [m.strip() for m in (value or "").split(",") if m.strip()]
+
+
+def call_cost(model, input_tokens, output_tokens):
+    price = MODEL_PRICES.get(model)
+    if price is None:
+        return None
+    return (input_tokens * price[0] + output_tokens * price[1]) / 1000
+
+
+class ModelCascade:
+    """Ordered model tiers for one caller, with per-tier latency, cost and acceptance counts."""
+    def __init__(self, name, models):
+        self.name = name
+        self.models = parse_models(models) if isinstance(models, str) else list(models)
+        if not self.models:
+            raise ValueError(f"Empty model cascade for {name}")
+        self.counts = {m: Counter() for m in self.models} # calls / accepted / escalated / rejected / estimated_usage
+        self.latency_ms = {m: [] for m in self.models}
+        self.tokens = {m: Counter() for m in self.models}
+        self.cost = {m: 0.0 for m in self.models}
+
+    def is_last(self, model):
+        return model == self.models[-1]
+
+    def record(self, model, started, accepted, usage=None, messages=None, output=""):
+        """
+        Count one call of a tier. Without usage from the API (a stream stopped
+        early), tokens are estimated from the prompt and the text received.
+        """
+        self.latency_ms[model].append((time.monotonic() - started) * 1000)
+        del self.latency_ms[model][:-200]
+        counts = self.counts[model]
+        counts["calls"] += 1
+        if accepted:
+            counts["accepted"] += 1
+        elif not self.is_last(model):
+            counts["escalated"] += 1
+        else:
+            counts["rejected"] += 1
+
+        if usage:
+            input_tokens, output_tokens = usage.get("input_tokens") or 0, usage.get("output_tokens") or 0
+        else:
+            counts["estimated_usage"] += 1
+            input_tokens = sum(estimate_tokens(m.get("content") or "") for m in messages or [] if isinstance(m.get("content"), str))
+            output_tokens = estimate_tokens(output or "")
+        self.tokens[model]["input"] += input_tokens
+        self.tokens[model]["output"] += output_tokens
+        cost = call_cost(model, input_tokens, output_tokens)
+        if cost is not None:
+            self.cost[model] += cost
+
+    def stats(self):
+        tiers = []
+        for model in self.models:
+            counts = self.counts[model]
+            latencies = sorted(self.latency_ms[model])
+            calls = counts["calls"]
+            tiers.append({
+                "model": model,
+                "calls": calls,
+                "accepted": counts["accepted"],
+                "escalated": counts["escalated"],
+                "rejected": counts["rejected"],
+                "acceptance_rate": round(counts["accepted"] / calls, 3) if calls else None,
+                "latency_p50_ms": int(latencies[len(latencies) // 2]) if latencies else None,
+                "latency_p95_ms": int(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]) if latencies else None,
+                "input_tokens": self.tokens[model]["input"],
+                "output_tokens": self.tokens[model]["output"],
+                "estimated_usage_calls": counts["estimated_usage"],
+                "cost_cny": round(self.cost[model], 4) if model in MODEL_PRICES else None,
+            })
+        return {"name": self.name, "tiers": tiers}
@@ -0,0 +1,147 @@
+import os
+import re
+import json
+import time
+import hashlib
+import tempfile
+import urllib.request
+import urllib.error
+
+# live:   call DashScope
+# record: call DashScope and save every exchange as a cassette
+# replay: answer from cassettes only (local files, or the stub server when DIANDIAN_MODEL_STUB_URL is set)
+MODEL_MODE = os.getenv("DIANDIAN_MODEL_MODE", "live").lower()
+CASSETTE_DIR = os.getenv(
+    "DIANDIAN_CASSETTE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cassettes")
+)
+STUB_URL = os.getenv("DIANDIAN_MODEL_STUB_URL", "").rstrip("/")
+
+_WS_RE = re.compile(r"\s+")
+
+
+class CassetteMiss(Exception):
+    """Replay mode got a request that was never recorded."""
+
+
+def _file_digest(uri):
+    path = uri[len("file://"):] if uri.startswith("file://") else uri
+    try:
+        with open(path, "rb") as f:
+            return "sha256:" + hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return uri
+
+
+def normalize_messages(messages):
+    """
+    Messages with whitespace collapsed and images replaced by their content hash,
+    so temp file names and prompt indentation do not change the key.
+    """
+    normalized = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            parts = []
+            for part in content:
+                if "image" in part:
+                    parts.append({"image": _file_digest(part["image"])})
+                elif "text" in part:
+                    parts.append({"text": _WS_RE.sub(" ", part["text"]).strip()})
+                else:
+                    parts.append(part)
+            content = parts
+        elif isinstance(content, str):
+            content = _WS_RE.sub(" ", content).strip()
+        normalized.append({"role": message.get("role"), "content": content})
+    return normalized
+
+
+def request_key(model, messages):
+    """Returns (key, normalized messages)."""
+    normalized = normalize_messages(messages)
+    raw = json.dumps({"model": model, "messages": normalized}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest(), normalized
+
+
+def cassette_path(key, root=None):
+    return os.path.join(root or CASSETTE_DIR, key[:2], f"{key}.json")
+
+
+def load(key, root=None):
+    path = cassette_path(key, root)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save(key, model, normalized, chunks, usage, latency_ms, root=None):
+    path = cassette_path(key, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = {
+        "key": key,
+        "model": model,
+        "messages": normalized,
+        "chunks": chunks,
+        "usage": usage,
+        "latency_ms": latency_ms,
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def record(model, messages, source):
+    """Pass (kind, value) chunks through from `source` and save them once it is exhausted."""
+    key, normalized = request_key(model, messages)
+    start = time.monotonic()
+    chunks, usage = [], None
+    for kind, value in source:
+        if kind == "delta":
+            chunks.append(value)
+        elif kind == "usage":
+            usage = value
+        yield kind, value
+    save(key, model, normalized, chunks, usage, int((time.monotonic() - start) * 1000))
+    print(f"[Cassette] Recorded {key[:12]} ({model}, {len(chunks)} chunks)")
+
+
+def replay(model, messages, stream=True):
+    """Yield recorded (kind, value) chunks for this request; raises CassetteMiss."""
+    key, _ = request_key(model, messages)
+    if STUB_URL:
+        yield from _replay_from_stub(key, stream)
+        return
+    data = load(key)
+    if data is None:
+        raise CassetteMiss(f"No cassette for {model} request {key[:12]} in {CASSETTE_DIR}")
+    chunks = data["chunks"] if stream else ["".join(data["chunks"])]
+    for chunk in chunks:
+        yield "delta", chunk
+    yield "usage", data.get("usage")
+
+
+def _replay_from_stub(key, stream):
+    body = json.dumps({"key": key, "stream": stream}).encode("utf-8")
+    request = urllib.request.Request(
+        f"{STUB_URL}/v1/replay", data=body, headers={"Content-Type": "application/json"}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=120) as response:
+            # NDJSON: {"delta": "..."} lines, then {"usage": {...}}
+            for line in response:
+                line = line.strip()
+                if not line:
+                    continue
+                item = json.loads(line)
+                if "delta" in item:
+                    yield "delta", item["delta"]
+                elif "usage" in item:
+                    yield "usage", item["usage"]
+    except urllib.error.HTTPError as e:
+        if e.code == 404:
+            raise CassetteMiss(f"Stub server has no cassette {key[:12]}")
+        raise
@@ -1,11 +1,30 @@
 import asyncio
 import json
 import os
+import time
+from collections import Counter
 from browser.driver import BrowserController
 from agent.planner import QwenPlanner
 from agent.executor import HybridExecutor
-from agent.som import SetOfMark
+from agent.som import SetOfMark, SELECTOR_ENGINE, SELECTOR_ENGINE_JS
+from agent import locator_memory
+from agent.metrics import PhaseMetrics
 from reporter import Reporter
+from run_history import RunRecorder
+from database import run_db
+
+# Start executing steps while the planner is still streaming the rest of the plan
+PLANNER_STREAMING = os.getenv("PLANNER_STREAMING", "1") != "0"
+
+
+async def _queued_steps(first_step, step_queue):
+    """Yield (index, step) from the planning queue until the None sentinel."""
+    i, step = 0, first_step
+    while step is not None:
+        yield i, step
+        i += 1
+        step = await step_queue.get()
+
 
 class DiandianAgent:
 
@@ -14,8 +33,14 @@ class DiandianAgent:
         self.executor = HybridExecutor()
         self.browser = BrowserController()
         self.som = SetOfMark(None)
+        # Marker IDs resolve through Locators ("ddsom=<id>"), never long-lived ElementHandles
+        self.browser.selector_engines[SELECTOR_ENGINE] = SELECTOR_ENGINE_JS
         self.history = []
         self.reporter = None # initialized per task
+        self.taught_selector = None # last Point & Teach selector, for the current (or next) command
+        self.metrics = PhaseMetrics() # step-loop phase timings (benchmarks)
+        self.last_failure = None # kind of the last failed action (see _failure_kind)
+        self.retry_stats = Counter() # per command: retries by kind and the time they cost
         
         # Load Environment Config
         self.env_config = {
@@ -87,6 +112,7 @@ class DiandianAgent:
                     "content": f"[User Hint] I am pointing at the element '{selector}'. Please interact with it in the next step."
                 }
                 self.history.append(hint)
+                self.taught_selector = selector
                 print("[Agent] Hint injected into history.")
                 return selector
                 
@@ -95,9 +121,245 @@ class DiandianAgent:
             
         return None
 
-    async def process_command(self, user_input: str, emit_func=None):
+    async def _full_fidelity_screenshot(self):
+        """Before a vision call on a lean network profile: reload skipped images and recapture."""
+        if not await self.browser.network.restore_for_vision(self.browser.page):
+            return None
+        await self.som.add_markers()
+        screenshot = await self.browser.capture_screenshot()
+        if screenshot and not self.som.draws_in_page:
+            screenshot = await asyncio.to_thread(self.som.annotate, screenshot)
+        return screenshot
+
+    async def _mark(self):
+        """SoM marking pass; returns {id: box} (empty if marking failed)."""
+        try:
+            with self.metrics.phase("som_mark"):
+                markers = await self.som.add_markers()
+            self.metrics.add_size("som_markers", len(markers))
+            return markers
+        except Exception as e:
+            print(f"SoM Error (ignoring): {e}")
+            return {}
+
+    async def _targets_taught(self, item):
+        """True if `item` acts on the element the user pointed at (Point & Teach)."""
+        if item.get("selector") == self.taught_selector:
+            return True
+        if item.get("selector"):
+            target = self.browser.page.locator(item["selector"])
+        elif item.get("target_id") is not None:
+            try:
+                target = self.som.locator(item["target_id"])
+            except (TypeError, ValueError):
+                return False
+        else:
+            return False
+        try:
+            return await target.evaluate(
+                """(el, selector) => {
+                    const taught = document.querySelectorAll(selector);
+                    return taught.length === 1 && taught[0] === el;
+                }""",
+                self.taught_selector,
+                timeout=1000
+            )
+        except Exception:
+            return False
+
+    @staticmethod
+    def _targets_marked(batch, markers):
+        try:
+            return all(int(item["target_id"]) in markers for item in batch if item.get("target_id") is not None)
+        except (TypeError, ValueError):
+            return False
+
+    def _retry_mode(self, action_data):
+        """
+        Cheapest retry for the last failure (used only while the page is unchanged):
+        "vision" - an L1 / memory / rule selector failed: ask vision on the same frame
+        "remark" - a marker no longer resolved: re-mark and repeat the same action
+        None     - recapture and run the full route again
+        """
+        if self.last_failure == "selector" and (action_data or {}).get("strategy") != "vision":
+            return "vision"
+        if self.last_failure == "marker":
+            return "remark"
+        return None
+
+    async def _execute_action(self, action_data, markers):
+        """Run one action against the current page. Returns True on success."""
+        action = action_data.get("action")
+        target_id = action_data.get("target_id")
+        selector = action_data.get("selector") # L1 Selector
+        param = action_data.get("param")
+
+        success = False
+        if action != "navigate":
+            self.browser.forget_prewarm()
+        if action == "navigate":
+            success = await self.browser.navigate(param or target_id) 
+        elif action == "click":
+            # L1: Selector
+            if selector:
+                try:
+                    await self.browser.page.locator(selector).click(timeout=5000)
+                    success = True
+                except Exception as e:
+                    print(f"[Agent] L1 Click Failed: {e}")
+            # L2: Vision ID
+            elif target_id is not None:
+                try:
+                    tid = int(target_id)
+                    if tid in markers:
+                        await self.som.locator(tid).click(timeout=5000)
+                        success = True
+                    else:
+                        print(f"Marker {tid} not found in valid keys")
+                except Exception as e:
+                    print(f"Click failed: {e}")
+        elif action == "type":
+            # L1: Selector
+            if selector:
+                try:
+                    el = self.browser.page.locator(selector)
+                    await el.click()
+                    await el.fill("")
+                    await el.type(str(param), delay=100)
+                    success = True
+                except Exception as e:
+                    print(f"[Agent] L1 Type Failed: {e}")
+            # L2: Vision ID
+            elif target_id is not None:
+                try:
+                    tid = int(target_id)
+                    if tid in markers:
+                        el = self.som.locator(tid)
+                        await el.scroll_into_view_if_needed(timeout=5000)
+                        await el.click(timeout=5000)
+                        await asyncio.sleep(0.2)
+                        try:
+                            await el.fill("", timeout=2000)
+                        except Exception as e:
+                            print(f"[Agent] Clear/Fill failed (non-fatal): {e}")
+
+                        await el.type(str(param), delay=100)
+                        success = True
+                    else:
+                        print(f"[Agent] Type Error: Marker {tid} not found")
+                except Exception as e:
+                    print(f"[Agent] Type failed: {e}")
+        elif action == "scroll":
+            try:
+                # param can be "up", "down", "top", "bottom"
+                direction = param if param in ["up", "down", "top", "bottom"] else "down"
+                if direction == "down":
+                    await self.browser.page.evaluate("window.scrollBy(0, 800)")
+                elif direction == "up":
+                    await self.browser.page.evaluate("window.scrollBy(0, -800)")
+                elif direction == "bottom":
+                    await self.browser.page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
+                elif direction == "top":
+                    await self.browser.page.evaluate("window.scrollTo(0, 0)")
+                success = True
+            except Exception as e:
+                print(f"[Agent] Scroll failed: {e}")
+        elif action == "back":
+            try:
+                await self.browser.page.go_back()
+                success = True
+            except Exception as e:
+                print(f"[Agent] Back failed: {e}")
+        elif action == "hover":
+             # Only support L2 hover for now, or L1 if selector
+            if selector:
+                try:
+                    await self.browser.page.locator(selector).hover()
+                    success = True
+                except Exception as e:
+                    print(f"[Agent] L1 Hover Failed: {e}")
+            elif target_id is not None:
+                try:
+                    tid = int(target_id)
+                    if tid in markers:
+                        await self.som.locator(tid).hover(timeout=5000)
+                        success = True
+                    else:
+                        print(f"Marker {tid} not found for hover")
+                except Exception as e:
+                    print(f"[Agent] Hover failed: {e}")
+        self.last_failure = None if success else await self._failure_kind(action, selector, target_id, markers)
+        return success
+
+    async def _failure_kind(self, action, selector, target_id, markers):
+        """
+        Why an element action failed, to pick the cheapest retry:
+        "selector" (an L1 selector did not work), "marker" (the marker ID does not
+        resolve to an element any more) or "other".
+        """
+        if action not in ("click", "type", "hover"):
+            return "other"
+        if selector:
+            return "selector"
+        try:
+            tid = int(target_id)
+        except (TypeError, ValueError):
+            return "other"
+        if tid not in markers:
+            return "marker"
+        try:
+            return "marker" if await self.som.locator(tid).count() == 0 else "other"
+        except Exception:
+            return "other"
+
+    def _describe_action(self, action_data):
+        target_id = action_data.get("target_id")
+        selector = action_data.get("selector")
+        param = action_data.get("param")
+        param_str = f" {param}" if param is not None else ""
+        target_str = f" #{target_id}" if target_id is not None else ""
+        selector_str = f" [{selector}]" if selector else ""
+        return f'{action_data.get("action")}{target_str}{selector_str}{param_str}'
+
+    async def _batch_can_continue(self, action_data, page_url):
+        """Cheap checks between batched actions: still the same page, and typed text landed."""
+        page = self.browser.page
+        if page.url != page_url:
+            return False
+        if action_data.get("action") == "type" and action_data.get("selector"):
+            try:
+                value = await page.locator(action_data["selector"]).input_value(timeout=1000)
+            except Exception:
+                return True # Not a form control (e.g. contenteditable), nothing to compare
+            return value == str(action_data.get("param"))
+        return True
+
+    async def _produce_plan(self, context_prompt, step_queue, emit_func=None):
+        """Put planned steps on `step_queue` as they become known, then None."""
+        count = 0
+        try:
+            if PLANNER_STREAMING:
+                async for step in self.planner.plan_task_stream(context_prompt):
+                    count += 1
+                    step_queue.put_nowait(step)
+            else:
+                plan = await self.planner.plan_task(context_prompt)
+                for step in plan.get("steps", []):
+                    count += 1
+                    step_queue.put_nowait(step)
+            if emit_func and count:
+                await emit_func('agent_thought', {'step': 'planning', 'detail': f'Plan created: {count} steps'})
+        except Exception as e:
+            print(f"[Agent] Planning failed: {e}")
+        finally:
+            step_queue.put_nowait(None)
+
+    async def process_command(self, user_input: str, emit_func=None, case_id=None, recorder=None):
         """
         Orchestrate the agent loop: Plan -> Execute -> Report
+        case_id: set when the command is part of a saved case replay.
+        recorder: shared RunRecorder when several commands form one run (replay).
+                  If omitted, this command is recorded as its own TestRun.
         """
         if user_input == "/start":
             # Just start browser
@@ -112,241 +374,301 @@ class DiandianAgent:
         
         print(f"\n[Agent] Processing: {user_input} (Env: {env_name})")
         self.history = [] # Reset history for new task
-        self.reporter = Reporter()
+        if self.taught_selector:
+            # A Point & Teach hint given between commands applies to this one
+            self.history.append({
+                "role": "user",
+                "content": f"[User Hint] I am pointing at the element '{self.taught_selector}'. Please interact with it in the next step."
+            })
+        owns_recorder = recorder is None
+        if owns_recorder:
+            recorder = RunRecorder(case_id=case_id, task=user_input)
+        self.reporter = Reporter(case_id=case_id, run_group=recorder.group)
         self.reporter.set_task(user_input)
 
         # 1. Start Browser if needed
         await self.browser.start()
+        if owns_recorder:
+            # Long-lived contexts are swapped out between commands once they grow
+            # past the memory ceiling (replays check before the case, server.py)
+            await self.browser.recycle_if_needed()
         self.som.page = self.browser.page
+        self.browser.network.reset_run()
+        self.retry_stats = Counter()
+
+        # BASE_URL starts loading on a blank page while the plan is generated
+        self.browser.prewarm(base_url)
 
         # 2. Planning Phase
         if emit_func:
             await emit_func('agent_thought', {'step': 'planning', 'detail': 'Analyzing request...'})
         
-        plan = await self.planner.plan_task(context_prompt)
-        steps = plan.get("steps", [])
-        
-        if emit_func:
-            await emit_func('agent_thought', {'step': 'planning', 'detail': f'Plan created: {len(steps)} steps'})
+        # Steps are handed over through a queue as soon as they are planned,
+        # so the first browser actions overlap with the rest of the plan
+        step_queue = asyncio.Queue()
+        planning = asyncio.create_task(self._produce_plan(context_prompt, step_queue, emit_func))
+        try:
+            with self.metrics.phase("plan_first_step"):
+                first_step = await step_queue.get()
+        except asyncio.CancelledError:
+            planning.cancel()
+            raise
 
-        if not steps:
+        if first_step is None:
+            await run_db(self.reporter.finish, status="error")
+            # A shared (replay) recorder must not pass a case whose prompt never ran
+            recorder.mark_failed()
+            if owns_recorder:
+                await run_db(recorder.finish, status="FAIL")
             return {"error": "Failed to generate plan"}
 
         # 3. Execution Phase
         try:
-            for i, step in enumerate(steps):
+            async for i, step in _queued_steps(first_step, step_queue):
                 print(f"--- Executing Step {i+1}: {step} ---")
                 if emit_func:
                     await emit_func('agent_thought', {'step': 'executing', 'detail': f'Current Step: {step}'})
 
-                # Retry loop
+                # Retry loop: each failure is retried as cheaply as it allows (_retry_mode)
+                # and the captured frame is reused while the page has not changed
                 max_retries = 3
+                step_start = time.monotonic()
+                attempt_start = step_start
+                attempts = 0
+                action_data = None
+                batch = [] # actions of the last decision; a "remark" retry repeats them
+                time_to_action_ms = None
+                success = False
+                screenshot = None
+                post_screenshot = None
+                retry = None # "vision" / "remark": how the next attempt reuses the frame
+                frame = None # fingerprint of the page the screenshot / aria snapshot show
                 for attempt in range(max_retries):
-                    try:
-                        markers = await self.som.add_markers()
-                    except Exception as e:
-                        print(f"SoM Error (ignoring): {e}")
-                        markers = {}
+                    attempts = attempt + 1
+                    attempt_start = time.monotonic()
+                    await self.browser.wait_prewarm()
+                    if retry and (frame is None or await self.som.fingerprint() != frame):
+                        print("[Agent] Page changed since it was captured, recapturing")
+                        retry = None
+                    if retry == "remark":
+                        # Only the marker map was stale: re-mark and repeat the same action
+                        markers = await self._mark()
+                        if not self._targets_marked(batch, markers):
+                            print("[Agent] Target not marked after re-marking, recapturing")
+                            retry = None
+                    if attempt > 0:
+                        self.retry_stats[retry or "recapture"] += 1
 
-                    await asyncio.sleep(0.5)
-                    screenshot = await self.browser.capture_screenshot()
+                    if retry is None:
+                        markers = await self._mark()
+                        frame = await self.som.fingerprint()
+                        if self.som.draws_in_page:
+                            # Let the page render the DOM markers before capturing
+                            await asyncio.sleep(0.5)
+                        with self.metrics.phase("screenshot"):
+                            screenshot = await self.browser.capture_screenshot()
+                        if screenshot:
+                            self.metrics.add_size("screenshot_bytes", len(screenshot) * 3 // 4)
                     
-                    # Capture Aria Snapshot (L1)
-                    aria_snapshot = ""
-                    try:
-                        aria_snapshot = await self.browser.page.locator("body").aria_snapshot()
-                    except Exception as e:
-                        print(f"[Agent] Aria Snapshot failed: {e}")
+                        # Capture Aria Snapshot (L1)
+                        aria_snapshot = ""
+                        try:
+                            with self.metrics.phase("aria_snapshot"):
+                                aria_snapshot = await self.browser.page.locator("body").aria_snapshot()
+                            self.metrics.add_size("aria_snapshot_chars", len(aria_snapshot))
+                        except Exception as e:
+                            print(f"[Agent] Aria Snapshot failed: {e}")
                     
-                    if not screenshot:
-                         print("[Agent] Failed to capture screenshot. Retrying...")
-                         # Try to start browser if it might have crashed or not started
-                         if not self.browser.page:
-                             print("[Agent] Browser page is None. Restarting browser...")
-                             await self.browser.start()
+                        if not screenshot:
+                             print("[Agent] Failed to capture screenshot. Retrying...")
+                             # Try to start browser if it might have crashed or not started
+                             if not self.browser.page:
+                                 print("[Agent] Browser page is None. Restarting browser...")
+                                 await self.browser.start()
                          
-                         if attempt < max_retries - 1:
-                             continue
-                         else:
-                             print("[Agent] Max retries reached for screenshot. Skipping step.")
-                             break
-
-                    if emit_func and screenshot:
-                         await emit_func('browser_snapshot', {'image': screenshot})
-                    
-                    history_str = json.dumps(self.history[-3:])
+                             if attempt < max_retries - 1:
+                                 continue
+                             else:
+                                 print("[Agent] Max retries reached for screenshot. Skipping step.")
+                                 break
+
+                        if emit_func and screenshot:
+                             await emit_func('browser_snapshot', {'image': screenshot})
+
+                        # Overlay mode: the preview above stays clean, labels are
+                        # drawn onto a copy for the vision model and the report
+                        if not self.som.draws_in_page:
+                            try:
+                                with self.metrics.phase("som_overlay"):
+                                    # Boxes as of the screenshot: anything that moved since
+                                    # marking is re-measured (incremental, usually nothing)
+                                    markers = await self.som.add_markers()
+                                    screenshot = await asyncio.to_thread(self.som.annotate, screenshot)
+                            except Exception as e:
+                                print(f"[Agent] SoM overlay failed (using clean screenshot): {e}")
                     
-                    # Call Hybrid Executor
-                    action_data = await self.executor.decide_action(
-                        screenshot_base64=screenshot,
-                        aria_snapshot=aria_snapshot,
-                        current_step=step,
-                        goal=user_input,
-                        history_str=history_str
-                    )
+                    if retry == "remark":
+                        print("[Agent] Re-marked, repeating the same action")
+                    else:
+                        history_str = json.dumps(self.history[-3:])
+                        page_url = self.browser.page.url
+                        perceive_start = time.monotonic()
                     
-                    action = action_data.get("action")
-                    target_id = action_data.get("target_id")
-                    selector = action_data.get("selector") # L1 Selector
-                    param = action_data.get("param")
-                    thought = action_data.get("thought", "")
-                    strategy = action_data.get("strategy", "vision") # text or vision
-
-                    param_str = f" {param}" if param is not None else ""
-                    target_str = f" #{target_id}" if target_id is not None else ""
-                    selector_str = f" [{selector}]" if selector else ""
+                        # Call Hybrid Executor (rules / locator memory only on the first attempt)
+                        action_data = await self.executor.decide_action(
+                            screenshot_base64=screenshot,
+                            aria_snapshot=aria_snapshot,
+                            current_step=step,
+                            goal=user_input,
+                            history_str=history_str,
+                            page=self.browser.page,
+                            allow_shortcuts=attempt == 0,
+                            vision_only=retry == "vision",
+                            before_vision=self._full_fidelity_screenshot
+                        )
                     
+                        time_to_action_ms = int((time.monotonic() - perceive_start) * 1000)
+                        self.metrics.add_timing("perceive", time_to_action_ms)
+                        action = action_data.get("action")
+                        thought = action_data.get("thought", "")
+                        strategy = action_data.get("strategy", "vision") # text or vision
+                        batch = action_data.get("actions") or [action_data]
+                        batch_str = f" (1/{len(batch)})" if len(batch) > 1 else ""
 
-                    if emit_func:
-                        await emit_func('agent_thought', {
-                            'step': 'action', 
-                            'detail': f'{thought} -> {action}{target_str}{selector_str}{param_str}',
-                            'strategy': strategy
-                        })
+                        if emit_func:
+                            await emit_func('agent_thought', {
+                                'step': 'action', 
+                                'detail': f'{thought} -> {self._describe_action(action_data)}{batch_str}',
+                                'strategy': strategy
+                            })
 
-                    success = False
-                    if action == "navigate":
-                        success = await self.browser.navigate(param or target_id) 
-                    elif action == "click":
-                        # L1: Selector
-                        if selector:
-                            try:
-                                await self.browser.page.locator(selector).click(timeout=5000)
-                                success = True
-                            except Exception as e:
-                                print(f"[Agent] L1 Click Failed: {e}")
-                        # L2: Vision ID
-                        elif target_id is not None:
-                            try:
-                                tid = int(target_id)
-                                if tid in markers:
-                                    await markers[tid].click()
-                                    success = True
-                                else:
-                                    print(f"Marker {tid} not found in valid keys")
-                            except Exception as e:
-                                print(f"Click failed: {e}")
-                    elif action == "type":
-                        # L1: Selector
-                        if selector:
-                            try:
-                                el = self.browser.page.locator(selector)
-                                await el.click()
-                                await el.fill("")
-                                await el.type(str(param), delay=100)
-                                success = True
-                            except Exception as e:
-                                print(f"[Agent] L1 Type Failed: {e}")
-                        # L2: Vision ID
-                        elif target_id is not None:
-                            try:
-                                tid = int(target_id)
-                                if tid in markers:
-                                    el = markers[tid]
-                                    await el.scroll_into_view_if_needed()
-                                    await el.click()
-                                    await asyncio.sleep(0.2)
-                                    try:
-                                        await el.fill("") 
-                                    except Exception as e:
-                                        print(f"[Agent] Clear/Fill failed (non-fatal): {e}")
-
-                                    await el.type(str(param), delay=100)
-                                    success = True
-                                else:
-                                    print(f"[Agent] Type Error: Marker {tid} not found")
-                            except Exception as e:
-                                print(f"[Agent] Type failed: {e}")
-                    elif action == "scroll":
-                        try:
-                            # param can be "up", "down", "top", "bottom"
-                            direction = param if param in ["up", "down", "top", "bottom"] else "down"
-                            if direction == "down":
-                                await self.browser.page.evaluate("window.scrollBy(0, 800)")
-                            elif direction == "up":
-                                await self.browser.page.evaluate("window.scrollBy(0, -800)")
-                            elif direction == "bottom":
-                                await self.browser.page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-                            elif direction == "top":
-                                await self.browser.page.evaluate("window.scrollTo(0, 0)")
-                            success = True
-                        except Exception as e:
-                            print(f"[Agent] Scroll failed: {e}")
-                    elif action == "back":
-                        try:
-                            await self.browser.page.go_back()
+                        if action == "done":
                             success = True
-                        except Exception as e:
-                            print(f"[Agent] Back failed: {e}")
-                    elif action == "hover":
-                         # Only support L2 hover for now, or L1 if selector
-                        if selector:
-                            try:
-                                await self.browser.page.locator(selector).hover()
-                                success = True
-                            except Exception as e:
-                                print(f"[Agent] L1 Hover Failed: {e}")
-                        elif target_id is not None:
-                            try:
-                                tid = int(target_id)
-                                if tid in markers:
-                                    await markers[tid].hover()
-                                    success = True
-                                else:
-                                    print(f"Marker {tid} not found for hover")
-                            except Exception as e:
-                                print(f"[Agent] Hover failed: {e}")
+                            break
+                        elif action == "fail":
+                            print("Agent gave up on this step.")
+                            break
 
-                    elif action == "done":
-                        success = True
-                        break 
-                    elif action == "fail":
-                        print("Agent gave up on this step.")
-                        break
-                    
-                    # Clean markers 
+                    # A batch is several element actions planned against this same frame:
+                    # run them in order and only re-perceive once it finishes or a check fails
+                    success = False
+                    for n, item in enumerate(batch):
+                        if n > 0 and emit_func:
+                            await emit_func('agent_thought', {
+                                'step': 'action',
+                                'detail': f'[{n+1}/{len(batch)}] {self._describe_action(item)}',
+                                'strategy': strategy
+                            })
+                        # Checked before acting: a click can take the element away
+                        teach = bool(self.taught_selector) and item.get("action") in locator_memory.MEMORABLE_ACTIONS \
+                            and await self._targets_taught(item)
+                        with self.metrics.phase("action"):
+                            success = await self._execute_action(item, markers)
+                        if len(batch) == 1:
+                            # Locator memory holds single actions only
+                            await self.executor.record_outcome(page_url, step, action_data, success)
+                        if success and teach:
+                            # The action hit the element the user pointed at: remember it for the page
+                            taught = {**action_data, **item, "selector": self.taught_selector}
+                            await self.executor.record_outcome(page_url, step, taught, True, source="teach")
+                            self.taught_selector = None
+                        if not success:
+                            break
+                        if n < len(batch) - 1 and not await self._batch_can_continue(item, page_url):
+                            print(f"[Agent] Batch check failed after action {n+1}/{len(batch)}, re-perceiving")
+                            success = False
+                            self.last_failure = "other"
+                            break
+                    await self.executor.record_route_outcome(page_url, action_data, success)
+
+                    # Clean markers
                     await self.som.clear_markers()
                     
                     # Post screenshot
                     if success:
                         await asyncio.sleep(1) 
-                        post_screenshot = await self.browser.capture_screenshot()
+                        with self.metrics.phase("post_screenshot"):
+                            post_screenshot = await self.browser.capture_screenshot()
                         if emit_func and post_screenshot:
                              await emit_func('browser_snapshot', {'image': post_screenshot})
 
                     if success:
                         break
-                    else:
-                        print(f"Action failed, retrying ({attempt+1}/{max_retries})...")
-                        await asyncio.sleep(2)
-            
-            # --- Log Step to Reporter ---
-            # Use the last captured action data
-            if 'action_data' in locals():
-                self.reporter.log_step(
-                   step_name=step,
-                   thought=action_data.get("thought", ""),
-                   action=action_data.get("action", ""),
-                   param=str(action_data.get("param", "") or action_data.get("target_id", "")),
-                   status=success,
-                   screenshot_before=screenshot, # The one with markers
-                   screenshot_after=post_screenshot if success else None
+                    retry = self._retry_mode(action_data)
+                    print(f"Action failed ({self.last_failure}), retrying ({attempt+1}/{max_retries})"
+                          f"{' with vision on the same frame' if retry == 'vision' else ' after re-marking' if retry == 'remark' else ''}...")
+                    # Instead of a fixed pause: let a navigation started by the action settle
+                    try:
+                        await self.browser.page.wait_for_load_state("domcontentloaded", timeout=2000)
+                    except Exception:
+                        pass
+
+                # Time spent on attempts that had to be retried
+                retry_ms = (attempt_start - step_start) * 1000 if attempts > 1 else 0
+                if attempts > 1:
+                    self.metrics.add_timing("retry", retry_ms)
+                    self.retry_stats["retried_steps"] += 1
+                    self.retry_stats["lost_ms"] += int(retry_ms)
+                self.browser.network.end_step()
+                step_ms = (time.monotonic() - step_start) * 1000
+                self.metrics.add_timing("step", step_ms)
+                recorder.record_step(
+                    name=step,
+                    action=(action_data or {}).get("action", ""),
+                    strategy=(action_data or {}).get("strategy", ""),
+                    success=success,
+                    attempts=attempts,
+                    duration_ms=step_ms,
+                    time_to_action_ms=time_to_action_ms,
+                    retry_ms=retry_ms
                 )
 
+                # --- Log Step to Reporter ---
+                # Streamed to disk per step, using the last captured action data
+                if action_data:
+                    with self.metrics.phase("report"):
+                        self.reporter.log_step(
+                           step_name=step,
+                           thought=action_data.get("thought", ""),
+                           action=action_data.get("action", ""),
+                           param="; ".join(self._describe_action(a) for a in action_data["actions"]) if action_data.get("actions")
+                                 else str(action_data.get("param", "") or action_data.get("target_id", "")),
+                           status=success,
+                           screenshot_before=screenshot, # The one with markers
+                           screenshot_after=post_screenshot if success else None,
+                           time_to_action_ms=time_to_action_ms
+                        )
+
             # Generate Report
-            report_path = self.reporter.finish(status="completed")
+            self.reporter.set_network(self.browser.network.summary())
+            self.reporter.set_retries(dict(self.retry_stats))
+            report_path = await run_db(self.reporter.finish, status="completed")
+            recorder.add_report(report_path)
+            if owns_recorder:
+                await run_db(recorder.finish)
             if report_path and emit_func:
                 await emit_func('report_generated', {'path': report_path})
             
         except asyncio.CancelledError:
             print("[Agent] Task Cancelled")
-            self.reporter.finish(status="cancelled")
+            self.reporter.set_network(self.browser.network.summary())
+            self.reporter.set_retries(dict(self.retry_stats))
+            recorder.add_report(await run_db(self.reporter.finish, status="cancelled"))
+            if owns_recorder:
+                await run_db(recorder.finish, status="CANCELLED")
             raise
         except Exception as e:
             print(f"[Agent] Execution Error: {e}")
-            self.reporter.finish(status="error")
+            self.reporter.set_network(self.browser.network.summary())
+            self.reporter.set_retries(dict(self.retry_stats))
+            recorder.add_report(await run_db(self.reporter.finish, status="error"))
+            if owns_recorder:
+                await run_db(recorder.finish, status="FAIL")
             raise
         finally:
+            planning.cancel()
+            # A Point & Teach hint belongs to the command it was given for (or the next one)
+            self.taught_selector = None
             # Ensure markers are cleared if cancelled/finished
             await self.som.clear_markers()
 
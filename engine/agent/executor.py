@@ -1,67 +1,236 @@
 import os
 import json
-from .strategies.text import TextPerceptionStrategy
-from .strategies.vision import VisionPerceptionStrategy
+import time
+from collections import Counter
+from .strategies.text import TextPerceptionStrategy, PROMPT as TEXT_PROMPT
+from .strategies.vision import VisionPerceptionStrategy, PROMPT as VISION_PROMPT
+from . import locator_memory
+from . import router_thresholds
+from .fast_path import FastPathResolver
+from database import run_db
 
 # Load Env
 from dotenv import load_dotenv
 load_dotenv()
 
+# Starting values of the per-route perception latency averages (ms)
+DEFAULT_LATENCY_MS = {"text": 1500.0, "vision": 4000.0}
+LATENCY_SMOOTHING = 0.2
+
 class HybridExecutor:
     """
     Perception Router:
-    - Step 1: L1 Text Strategy (Fast, Cheap) -> Qwen-Max + Aria Snapshot
+    - Step 0: Fast Path (No model call) -> rules for navigate / scroll / back / exact-text click
+    - Step 0: Locator Memory (No model call) -> selector learned on this page for this step
+    - Step 1: L1 Text Strategy (Fast, Cheap) -> model cascade (L1_MODEL_CASCADE) + Aria Snapshot
+      accepted above a per-domain/action/model threshold learned from outcomes (router_thresholds.py)
+      when its selectors resolve; otherwise the next model tier is asked
     - Step 2: L2 Vision Strategy (Slow, Robust) -> Qwen-VL-Max + Screenshot + SoM
     """
     def __init__(self):
         self.text_strategy = TextPerceptionStrategy()
         self.vision_strategy = VisionPerceptionStrategy()
+        self.fast_path = FastPathResolver()
+        # Which route produced each decision: "rule", "memory", "text", "vision"
+        self.route_counts = Counter()
+        # Moving average of each model route's perception time, prices the threshold trade-off
+        self.latency_ms = dict(DEFAULT_LATENCY_MS)
+        self.explored = 0
+        self.invalid_selectors = 0
 
-    async def decide_action(self, screenshot_base64, aria_snapshot, current_step, goal, history_str):
+    async def decide_action(self, screenshot_base64, aria_snapshot, current_step, goal, history_str, page=None, allow_shortcuts=True, before_vision=None, vision_only=False):
         """
         Routing Logic:
+        0. Trivial steps are resolved by rule; otherwise, if a trusted remembered
+           selector still resolves on `page`, use it. (Skipped with allow_shortcuts=False.)
         1. Try Text Strategy first.
-        2. If Confidence < 0.7 or Action is 'fail', fallback to Vision Strategy.
+        2. If Confidence is below the learned threshold for this domain and action
+           (0.7 until learned), the selector does not resolve or Action is 'fail',
+           escalate to the next model tier, and after the last one to Vision Strategy.
+           `before_vision` (async, optional) may return a fresher screenshot for it.
+        vision_only: go straight to step 2 (an L1 selector just failed on this frame).
         """
-        
+        if allow_shortcuts and not vision_only:
+            resolved = await self.fast_path.resolve(current_step, page)
+            if not resolved and page is not None:
+                resolved = await self._recall(page, current_step)
+            if resolved:
+                self.route_counts[resolved["strategy"]] += 1
+                return resolved
+
         # --- Attempt L1 (Text) ---
-        print("[HybridExecutor] Attempting L1: Text Strategy...")
-        try:
-            l1_result = await self.text_strategy.perceive(
-                step=current_step,
-                goal=goal,
-                history_str=history_str,
-                aria_snapshot=aria_snapshot
-            )
-            
-            confidence = l1_result.get("confidence", 0.0)
-            action = l1_result.get("action")
+        # (skipped on a retry after an L1 selector failed on this same frame)
+        if not vision_only:
+            print("[HybridExecutor] Attempting L1: Text Strategy...")
+            url = page.url if page is not None else ""
+            try:
+                started = time.monotonic()
+                l1_result = await self.text_strategy.perceive(
+                    step=current_step,
+                    goal=goal,
+                    history_str=history_str,
+                    aria_snapshot=aria_snapshot,
+                    accept=lambda result: self._accept_l1(result, url, page)
+                )
+                self._observe_latency("text", started)
             
-            print(f"[HybridExecutor] L1 Result: Action={action}, Confidence={confidence}")
-
-            # Criteria to accept L1:
-            # 1. Action is not 'fail'
-            # 2. Confidence is high enough (e.g. >= 0.7)
-            # 3. Action is not 'pass' (my custom skip signal)
-            if action not in ["fail", "pass"] and confidence >= 0.7:
-                print("[HybridExecutor] L1 Accepted ✅")
-                l1_result["strategy"] = "text"
-                return l1_result
-            else:
-                print(f"[HybridExecutor] L1 Rejected (Conf: {confidence}). Switching to L2...")
+                if l1_result.get("accepted"):
+                    print(f"[HybridExecutor] L1 Accepted ✅ ({l1_result.get('model')})")
+                    l1_result["strategy"] = "text"
+                    self.route_counts["text"] += 1
+                    return l1_result
+                else:
+                    print(f"[HybridExecutor] L1 Rejected (Conf: {l1_result.get('confidence', 0.0)}). Switching to L2...")
 
-        except Exception as e:
-            print(f"[HybridExecutor] L1 Exception: {e}. Switching to L2...")
+            except Exception as e:
+                print(f"[HybridExecutor] L1 Exception: {e}. Switching to L2...")
 
         # --- Attempt L2 (Vision) ---
         print("[HybridExecutor] Attempting L2: Vision Strategy...")
+        if before_vision:
+            try:
+                screenshot_base64 = await before_vision() or screenshot_base64
+            except Exception as e:
+                print(f"[HybridExecutor] Vision preparation failed: {e}")
+        started = time.monotonic()
         l2_result = await self.vision_strategy.perceive(
             step=current_step,
             goal=goal,
             history_str=history_str,
             screenshot=screenshot_base64
         )
+        self._observe_latency("vision", started)
         l2_result["strategy"] = "vision"
+        self.route_counts["vision"] += 1
         print(f"[HybridExecutor] L2 Result: {l2_result.get('action')}")
         
         return l2_result
+
+    async def _recall(self, page, current_step):
+        try:
+            entries = await run_db(locator_memory.lookup, page.url, current_step)
+        except Exception as e:
+            print(f"[HybridExecutor] Locator memory lookup failed: {e}")
+            return None
+
+        for entry in entries:
+            try:
+                # Must still match exactly one element on the current page
+                if await page.locator(entry.selector).count() != 1:
+                    continue
+            except Exception:
+                continue
+            successes, ratio = locator_memory.confidence(entry)
+            print(f"[HybridExecutor] Memory Hit ✅ {entry.action} [{entry.selector}] ({successes} ok, {ratio:.2f})")
+            return {
+                "thought": f"Recalled from locator memory ({entry.source})",
+                "action": entry.action,
+                "selector": entry.selector,
+                "param": entry.param,
+                "confidence": ratio,
+                "strategy": "memory",
+            }
+        return None
+
+    async def _accept_l1(self, result, url, page):
+        """
+        Criteria to accept an L1 answer (checked for every model tier):
+        1. Action is not 'fail' / 'pass' (my custom skip signal)
+        2. Confidence is high enough (>= learned threshold; with exploration
+           enabled, on the last tier also a sampled answer just below it)
+        3. Its selectors resolve to exactly one element on the page
+        """
+        action = result.get("action")
+        if action in ("fail", "pass"):
+            return False
+        confidence = result.get("confidence", 0.0)
+        threshold = await self._threshold(url, action, result.get("model"), confidence)
+        print(f"[HybridExecutor] L1 Result ({result.get('model')}): Action={action}, Confidence={confidence} (threshold {threshold})")
+        if confidence < threshold:
+            if not self.text_strategy.cascade.is_last(result.get("model")) or not router_thresholds.explore(confidence, threshold):
+                return False
+            print("[HybridExecutor] L1 below threshold, accepted to sample it")
+            self.explored += 1
+        return await self._selectors_resolve(result, page)
+
+    async def _selectors_resolve(self, result, page):
+        if page is None:
+            return True
+        for item in result.get("actions") or [result]:
+            selector = item.get("selector")
+            if item.get("action") not in ("click", "type", "hover") or not selector:
+                continue
+            try:
+                count = await page.locator(selector).count()
+            except Exception:
+                count = -1 # invalid selector syntax
+            if count != 1:
+                print(f"[HybridExecutor] L1 selector {selector!r} matches {max(count, 0)} elements")
+                self.invalid_selectors += 1
+                return False
+        return True
+
+    def _observe_latency(self, route, started):
+        elapsed = (time.monotonic() - started) * 1000
+        self.latency_ms[route] += LATENCY_SMOOTHING * (elapsed - self.latency_ms[route])
+
+    def route_costs(self):
+        """(vision_ms, failure_ms): what rejecting an L1 answer costs, and what a failed L1 action costs."""
+        vision_ms = self.latency_ms["vision"]
+        return vision_ms, router_thresholds.FAILED_ACTION_MS + vision_ms
+
+    async def _threshold(self, url, action, model, confidence):
+        """Learned acceptance threshold of `model`; also counts this L1 answer's confidence bucket."""
+        if not url or action not in router_thresholds.LEARNED_ACTIONS:
+            return router_thresholds.DEFAULT_THRESHOLD
+        try:
+            threshold = await run_db(router_thresholds.threshold, url, action, model, *self.route_costs())
+            await run_db(router_thresholds.record_seen, url, action, model, confidence)
+            return threshold
+        except Exception as e:
+            print(f"[HybridExecutor] Router threshold lookup failed: {e}")
+            return router_thresholds.DEFAULT_THRESHOLD
+
+    async def record_route_outcome(self, url, action_data, success):
+        """Feed whether an accepted L1 action (or batch) succeeded back into its domain/model threshold."""
+        if not action_data or not url or action_data.get("strategy") != "text":
+            return
+        try:
+            await run_db(
+                router_thresholds.record_outcome, url,
+                action_data.get("action"), action_data.get("model"), action_data.get("confidence", 0.0), success
+            )
+        except Exception as e:
+            print(f"[HybridExecutor] Router outcome update failed: {e}")
+
+    async def record_outcome(self, url, current_step, action_data, success, source=None):
+        """Feed the result of an executed action back into locator memory."""
+        if not action_data or not url:
+            return
+        strategy = action_data.get("strategy")
+        if source is None and strategy not in ("text", "memory"):
+            return
+        try:
+            await run_db(
+                locator_memory.record, url, current_step,
+                action_data.get("action"), action_data.get("selector"), action_data.get("param"),
+                success=success, source=source or "text"
+            )
+        except Exception as e:
+            print(f"[HybridExecutor] Locator memory update failed: {e}")
+
+    def stats(self):
+        """Decision counts per route and how many of them needed no model call."""
+        total = sum(self.route_counts.values())
+        without_model = self.route_counts["rule"] + self.route_counts["memory"]
+        return {
+            "decisions": total,
+            "routes": dict(self.route_counts),
+            "model_calls_saved": without_model,
+            "saved_rate": round(without_model / total, 4) if total else None,
+            "fast_path": self.fast_path.stats(),
+            "l1_explored": self.explored,
+            "l1_invalid_selectors": self.invalid_selectors,
+            "latency_ms": {route: round(ms) for route, ms in self.latency_ms.items()},
+            "prompts": {"text": TEXT_PROMPT.stats(), "vision": VISION_PROMPT.stats()},
+        }
@@ -0,0 +1,102 @@
+import re
+from collections import Counter
+
+# Steps that chain several things ("open X and log in") are left to the models
+_COMPOUND_RE = re.compile(r"\b(and|then|after|before|if)\b|并且|然后|之后|并|再|如果|[,，;；]", re.IGNORECASE)
+
+_URL = r"(?P<url>https?://\S+|(?:[a-z0-9-]+\.)+[a-z]{2,}(?:/\S*)?)"
+_NAVIGATE_RE = re.compile(
+    r"^(?:(?:please\s+)?(?:open|go to|visit|navigate to|load|browse to)\s+(?:the\s+)?(?:url|page|site|website)?\s*:?\s*"
+    r"|(?:请)?(?:打开|访问|进入|前往|跳转到)\s*(?:网址|网站|页面)?\s*[:：]?\s*)?"
+    + _URL + r"\s*[.。]?$",
+    re.IGNORECASE,
+)
+
+_SCROLL_PATTERNS = [
+    ("bottom", re.compile(r"^(?:scroll|go|jump)\s+(?:down\s+)?to\s+(?:the\s+)?(?:bottom|end)(?:\s+of\s+(?:the\s+)?page)?$|^(?:滚动|滑动|下拉)?到(?:页面)?(?:底部|最底部|页尾|最下方)$", re.IGNORECASE)),
+    ("top", re.compile(r"^(?:scroll|go|jump)\s+(?:up\s+)?(?:back\s+)?to\s+(?:the\s+)?top(?:\s+of\s+(?:the\s+)?page)?$|^(?:滚动|滑动)?(?:回)?到(?:页面)?(?:顶部|最顶部|页首|最上方)$", re.IGNORECASE)),
+    ("down", re.compile(r"^scroll(?:\s+the\s+page)?\s+down$|^(?:向下滚动|下滑|往下滚动|向下滑动)(?:页面)?$", re.IGNORECASE)),
+    ("up", re.compile(r"^scroll(?:\s+the\s+page)?\s+up$|^(?:向上滚动|上滑|往上滚动|向上滑动)(?:页面)?$", re.IGNORECASE)),
+]
+
+_BACK_RE = re.compile(
+    r"^(?:go|navigate)\s+back(?:\s+to\s+(?:the\s+)?previous\s+page)?$|^back$|^(?:返回|回到)上一页$|^(?:浏览器)?后退$",
+    re.IGNORECASE,
+)
+
+# Only quoted text counts as exact: click "Sign in" / 点击“登录”按钮
+_CLICK_RE = re.compile(
+    r"^(?:click|tap|press)\s+(?:on\s+)?(?:the\s+)?[\"'“‘「](?P<text>[^\"'“”‘’「」]+)[\"'”’」](?:\s+(?:button|link|tab|menu item))?$"
+    r"|^(?:点击|单击|点)\s*[\"'“‘「](?P<text_zh>[^\"'“”‘’「」]+)[\"'”’」]\s*(?:按钮|链接|选项卡|菜单)?$",
+    re.IGNORECASE,
+)
+
+
+class FastPathResolver:
+    """
+    Resolves trivial, unambiguous steps (navigate, scroll, back, exact-text click)
+    without any model call. Anything it is not sure about returns None.
+    """
+    def __init__(self):
+        self.hits = Counter()
+        self.misses = 0
+
+    def _match(self, step: str):
+        text = " ".join((step or "").split()).strip()
+        text = re.sub(r"[.。!！]+$", "", text)
+        if not text:
+            return None
+
+        click = _CLICK_RE.match(text)
+        if click:
+            return {"action": "click", "text": click.group("text") or click.group("text_zh")}
+        if _COMPOUND_RE.search(text):
+            return None
+
+        navigate = _NAVIGATE_RE.match(text)
+        if navigate:
+            return {"action": "navigate", "param": navigate.group("url").rstrip(".。")}
+        for direction, pattern in _SCROLL_PATTERNS:
+            if pattern.match(text):
+                return {"action": "scroll", "param": direction}
+        if _BACK_RE.match(text):
+            return {"action": "back"}
+        return None
+
+    async def resolve(self, step: str, page=None):
+        """Returns an action dict (strategy "rule") or None."""
+        match = self._match(step)
+        if match and match["action"] == "click":
+            # The text must identify exactly one element on the current page
+            selector = f'text="{match.pop("text").strip()}"'
+            try:
+                if page is None or await page.locator(selector).count() != 1:
+                    match = None
+                else:
+                    match["selector"] = selector
+            except Exception:
+                match = None
+
+        if not match:
+            self.misses += 1
+            return None
+
+        self.hits[match["action"]] += 1
+        print(f"[FastPath] Resolved '{step}' -> {match}")
+        return {
+            "thought": "Resolved by rule, no model call",
+            "param": None,
+            **match,
+            "confidence": 1.0,
+            "strategy": "rule",
+        }
+
+    def stats(self):
+        hits = sum(self.hits.values())
+        total = hits + self.misses
+        return {
+            "hits": hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / total, 4) if total else None,
+            "by_action": dict(self.hits),
+        }
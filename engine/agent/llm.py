@@ -0,0 +1,168 @@
+import asyncio
+import json
+import threading
+from http import HTTPStatus
+from dashscope import Generation, MultiModalConversation
+from . import cassette
+
+
+def _sdk_chunks(model, messages, multimodal=False, stream=True):
+    """Yield ("delta", text) from a live DashScope call, then ("usage", dict)."""
+    api = MultiModalConversation if multimodal else Generation
+    kwargs = {"model": model, "messages": messages, "result_format": "message"}
+    if stream:
+        kwargs.update(stream=True, incremental_output=True)
+    responses = api.call(**kwargs)
+    usage = None
+    for response in (responses if stream else [responses]):
+        if response.status_code != HTTPStatus.OK:
+            raise RuntimeError(f"API Error: {response.code} - {response.message}")
+        usage = response.usage or usage
+        delta = response.output.choices[0].message.content
+        if isinstance(delta, list): # multimodal: [{"text": ...}]
+            delta = "".join(part.get("text", "") for part in delta)
+        if delta:
+            yield "delta", delta
+    yield "usage", dict(usage) if usage else None
+
+
+# Overrides DIANDIAN_MODEL_MODE when set: fn(model, messages, multimodal, stream) -> (kind, value) chunks
+_chunk_source = None
+
+
+def use_chunk_source(source):
+    """Route every model call through `source` (benchmarks, scripted runs); None restores the default."""
+    global _chunk_source
+    _chunk_source = source
+
+
+def model_chunks(model, messages, multimodal=False, stream=True):
+    """Chunk source for the configured DIANDIAN_MODEL_MODE (live / record / replay)."""
+    if _chunk_source is not None:
+        return _chunk_source(model, messages, multimodal, stream)
+    if cassette.MODEL_MODE == "replay":
+        return cassette.replay(model, messages, stream=stream)
+    source = _sdk_chunks(model, messages, multimodal=multimodal, stream=stream)
+    if cassette.MODEL_MODE == "record":
+        return cassette.record(model, messages, source)
+    return source
+
+
+def complete(model, messages, multimodal=False, usage=None):
+    """
+    Blocking one-shot completion; returns the response text. Run it off the event loop.
+    `usage` (dict, optional) receives the token counts.
+    """
+    text = ""
+    for kind, value in model_chunks(model, messages, multimodal=multimodal, stream=False):
+        if kind == "delta":
+            text += value
+        elif value and usage is not None:
+            usage.update(value)
+    return text
+
+
+async def stream_generation(model, messages, idle_timeout=30.0, multimodal=False, usage=None):
+    """
+    Async generator of text deltas from a streamed Generation call
+    (MultiModalConversation with multimodal=True). `usage` (dict, optional)
+    receives the token counts once the stream ends.
+    The blocking SDK iterator runs on a worker thread and keeps reading while
+    the consumer is busy; closing the generator stops it at the next chunk
+    (when recording, the rest is still read so the cassette is complete).
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+    drain = cassette.MODEL_MODE == "record"
+
+    def push(kind, value):
+        if not stop.is_set():
+            loop.call_soon_threadsafe(queue.put_nowait, (kind, value))
+
+    def worker():
+        usage = None
+        try:
+            for kind, value in model_chunks(model, messages, multimodal=multimodal):
+                if stop.is_set() and not drain:
+                    return
+                if kind == "delta":
+                    push("delta", value)
+                else:
+                    usage = value
+            push("end", usage)
+        except Exception as e:
+            push("error", e)
+
+    reader = asyncio.create_task(asyncio.to_thread(worker))
+    try:
+        while True:
+            kind, value = await asyncio.wait_for(queue.get(), idle_timeout)
+            if kind == "delta":
+                yield value
+            elif kind == "error":
+                raise value
+            else:
+                if value:
+                    print(f"[LLM] {model} usage: in={value.get('input_tokens')} out={value.get('output_tokens')}")
+                    if usage is not None:
+                        usage.update(value)
+                break
+    finally:
+        stop.set()
+        if reader.done():
+            reader.result()
+
+
+class JSONObjectStream:
+    """
+    Incremental parser for a flat JSON object arriving in chunks (code fences
+    or text before the opening brace are skipped). A field is only accepted
+    once the next ',' or '}' shows its value is complete, so a number like
+    0.9 is never read as 0 mid-stream.
+    """
+    def __init__(self):
+        self.buffer = ""
+        self.pos = None
+        self.fields = {}
+        self.closed = False
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, chunk):
+        """Add text; returns all fields completed so far."""
+        self.buffer += chunk
+        if self.closed:
+            return self.fields
+        if self.pos is None:
+            start = self.buffer.find("{")
+            if start == -1:
+                return self.fields
+            self.pos = start + 1
+
+        buf = self.buffer
+        while True:
+            pos = self._skip(buf, self.pos, " \t\r\n,")
+            if pos >= len(buf):
+                return self.fields
+            if buf[pos] == "}":
+                self.closed = True
+                return self.fields
+            try:
+                key, end = self._decoder.raw_decode(buf, pos)
+                end = self._skip(buf, end, " \t\r\n")
+                if end >= len(buf) or buf[end] != ":":
+                    return self.fields
+                value, end = self._decoder.raw_decode(buf, self._skip(buf, end + 1, " \t\r\n"))
+            except json.JSONDecodeError:
+                return self.fields # Value still arriving
+            after = self._skip(buf, end, " \t\r\n")
+            if after >= len(buf) or buf[after] not in ",}":
+                return self.fields
+            self.fields[key] = value
+            self.pos = after
+
+    @staticmethod
+    def _skip(buf, pos, chars):
+        while pos < len(buf) and buf[pos] in chars:
+            pos += 1
+        return pos
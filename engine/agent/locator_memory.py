@@ -0,0 +1,99 @@
+import re
+from datetime import datetime
+from urllib.parse import urlsplit
+from sqlmodel import Session, select
+from database import engine, LocatorMemory
+
+# Only element actions are worth remembering
+MEMORABLE_ACTIONS = ("click", "type", "hover")
+
+# An entry is trusted once it has this many (weighted) successes and this success ratio
+MIN_SUCCESSES = 2
+MIN_CONFIDENCE = 0.8
+# A selector the user pointed at counts as this many successes up front
+TEACH_WEIGHT = 2
+
+_ID_SEGMENT_RE = re.compile(r"^(\d+|[0-9a-f]{8,}|[0-9a-f-]{32,36})$", re.IGNORECASE)
+_PUNCT_RE = re.compile(r"[\s.,;:!?。，；：！？]+$")
+
+
+def normalize_url(url: str):
+    """Returns (domain, url_pattern): numeric / hash-like path segments become '*', query is dropped."""
+    parts = urlsplit(url or "")
+    segments = [("*" if _ID_SEGMENT_RE.match(s) else s) for s in parts.path.split("/") if s]
+    return parts.netloc.lower(), "/" + "/".join(segments)
+
+
+def normalize_intent(step: str) -> str:
+    """Lower-cased, whitespace-collapsed step text without trailing punctuation."""
+    return _PUNCT_RE.sub("", " ".join((step or "").split()).lower())
+
+
+def confidence(entry: LocatorMemory):
+    """Returns (weighted successes, success ratio) for an entry."""
+    successes = entry.success_count + (TEACH_WEIGHT if entry.source == "teach" else 0)
+    total = successes + entry.failure_count
+    return successes, (successes / total if total else 0.0)
+
+
+def lookup(url: str, step: str, limit: int = 3):
+    """Trusted entries for this page and step, best first."""
+    domain, url_pattern = normalize_url(url)
+    intent = normalize_intent(step)
+    if not domain or not intent:
+        return []
+    with Session(engine) as session:
+        entries = session.exec(
+            select(LocatorMemory)
+            .where(LocatorMemory.domain == domain)
+            .where(LocatorMemory.url_pattern == url_pattern)
+            .where(LocatorMemory.intent == intent)
+        ).all()
+
+    trusted = []
+    for entry in entries:
+        successes, ratio = confidence(entry)
+        if successes >= MIN_SUCCESSES and ratio >= MIN_CONFIDENCE:
+            trusted.append((ratio, successes, entry))
+    trusted.sort(key=lambda t: (t[0], t[1]), reverse=True)
+    return [entry for _, _, entry in trusted[:limit]]
+
+
+def record(url: str, step: str, action: str, selector: str, param=None, success=True, source="text"):
+    """
+    Count one outcome for (page, step, selector). A success creates the entry if needed;
+    a failure only updates an existing one.
+    """
+    if action not in MEMORABLE_ACTIONS or not selector:
+        return
+    domain, url_pattern = normalize_url(url)
+    intent = normalize_intent(step)
+    if not domain or not intent:
+        return
+
+    with Session(engine) as session:
+        entry = session.exec(
+            select(LocatorMemory)
+            .where(LocatorMemory.domain == domain)
+            .where(LocatorMemory.url_pattern == url_pattern)
+            .where(LocatorMemory.intent == intent)
+            .where(LocatorMemory.selector == selector)
+        ).first()
+        if entry is None:
+            if not success:
+                return
+            entry = LocatorMemory(
+                domain=domain, url_pattern=url_pattern, intent=intent,
+                action=action, selector=selector, source=source
+            )
+        if success:
+            entry.success_count += 1
+            entry.action = action
+            entry.param = str(param) if param is not None else None
+            if source == "teach":
+                entry.source = "teach"
+        else:
+            entry.failure_count += 1
+        entry.last_used_at = datetime.utcnow()
+        session.add(entry)
+        session.commit()
@@ -0,0 +1,57 @@
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+
+def _percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values) + 0.4999)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class PhaseMetrics:
+    """
+    In-process timings for the step loop (mark, screenshot, perceive, ...)
+    plus size samples such as screenshot bytes. Cheap enough to stay on: only
+    the last `window` samples per name are kept, so a long-running server
+    summarises its recent steps in bounded memory.
+    """
+    def __init__(self, window=2000):
+        self.timings = defaultdict(lambda: deque(maxlen=window)) # phase -> [ms]
+        self.sizes = defaultdict(lambda: deque(maxlen=window))   # name -> [value]
+
+    def reset(self):
+        self.timings.clear()
+        self.sizes.clear()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name].append((time.perf_counter() - start) * 1000)
+
+    def add_timing(self, name, ms):
+        self.timings[name].append(ms)
+
+    def add_size(self, name, value):
+        if value is not None:
+            self.sizes[name].append(value)
+
+    def summary(self):
+        def describe(values):
+            values = sorted(values)
+            return {
+                "count": len(values),
+                "total": round(sum(values), 2),
+                "p50": round(_percentile(values, 50), 2),
+                "p95": round(_percentile(values, 95), 2),
+                "max": round(values[-1], 2),
+            }
+        return {
+            "timings_ms": {k: describe(v) for k, v in self.timings.items() if v},
+            "sizes": {k: describe(v) for k, v in self.sizes.items() if v},
+        }
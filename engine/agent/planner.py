@@ -1,7 +1,10 @@
 import os
 import json
+import time
+import asyncio
 import dashscope
-from dashscope import Generation
+from .llm import stream_generation, complete
+from .cascade import ModelCascade, PLANNER_MODEL_CASCADE
 
 # Load Env
 from dotenv import load_dotenv
@@ -11,9 +14,11 @@ dashscope.api_key = os.getenv("DASHSCOPE_API_KEY")
 
 class QwenPlanner:
     def __init__(self):
-        self.model = "qwen-max"
+        # Cheaper models first (PLANNER_MODEL_CASCADE); the next tier is asked
+        # when a plan does not come back as a non-empty JSON step list
+        self.cascade = ModelCascade("planner", PLANNER_MODEL_CASCADE)
 
-    async def plan_task(self, user_objective):
+    def _build_messages(self, user_objective):
         prompt = f"""
         你是一个QA测试专家。用户想要进行如下测试任务：
         "{user_objective}"
@@ -29,30 +34,80 @@ class QwenPlanner:
         }}
         """
 
-        messages = [
+        return [
             {'role': 'system', 'content': 'You are a helpful assistant.'},
             {'role': 'user', 'content': prompt}
         ]
 
+    async def plan_task(self, user_objective):
+        messages = self._build_messages(user_objective)
+
         print(f"[Planner] Decomposing: {user_objective}")
+        for model in self.cascade.models:
+            started = time.monotonic()
+            usage = {}
+            content = ""
+            try:
+                content = await asyncio.to_thread(complete, model, messages, usage=usage)
+                print(f"[Planner] Response ({model}): {content}")
+            except Exception as e:
+                print(f"[Planner] Exception ({model}): {e}")
+            plan = self._parse_plan(content)
+            self.cascade.record(model, started, plan is not None, usage=usage, messages=messages, output=content)
+            if plan is not None:
+                return plan
+            if self.cascade.is_last(model):
+                return self._parse_json(content) if content else {"steps": []}
+            print(f"[Planner] No valid plan from {model}, escalating")
+
+    async def plan_task_stream(self, user_objective):
+        """
+        Streamed variant of plan_task: yields each step as soon as its JSON string
+        is complete, while the model is still generating the rest of the plan.
+        A tier is only escalated from while it has not produced any step.
+        """
+        messages = self._build_messages(user_objective)
+
+        print(f"[Planner] Decomposing (streaming): {user_objective}")
+        for model in self.cascade.models:
+            started = time.monotonic()
+            usage = {}
+            parser = StepStreamParser()
+            content = ""
+            emitted = 0
+            try:
+                async for delta in stream_generation(model, messages, usage=usage):
+                    content += delta
+                    for step in parser.feed(delta):
+                        emitted += 1
+                        yield step
+            except Exception as e:
+                print(f"[Planner] Stream Exception ({model}): {e}")
+
+            print(f"[Planner] Response ({model}): {content}")
+            self.cascade.record(model, started, emitted > 0, usage=usage, messages=messages, output=content)
+            if emitted:
+                return
+            if self.cascade.is_last(model):
+                if content:
+                    # Not the expected JSON shape: fall back to the whole-response parser
+                    for step in self._parse_json(content).get("steps", []):
+                        yield step
+                return
+            print(f"[Planner] No steps from {model}, escalating")
+
+    def _parse_plan(self, content):
+        """Strict parse: the plan if it is a non-empty list of step strings, else None."""
+        text = (content or "").replace("```json", "").replace("```", "").strip()
+        start, end = text.find("{"), text.rfind("}")
         try:
-            response = Generation.call(
-                model=self.model,
-                messages=messages,
-                result_format='message'
-            )
-
-            if response.status_code == 200:
-                content = response.output.choices[0].message.content
-                print(f"[Planner] Response: {content}")
-                return self._parse_json(content)
-            else:
-                print(f"[Planner] Error: {response.code} - {response.message}")
-                return {"steps": []}
-                
-        except Exception as e:
-            print(f"[Planner] Exception: {e}")
-            return {"steps": []}
+            data = json.loads(text[start:end+1]) if start != -1 and end != -1 else None
+        except json.JSONDecodeError:
+            return None
+        steps = data.get("steps") if isinstance(data, dict) else None
+        if not isinstance(steps, list) or not steps or not all(isinstance(s, str) and s.strip() for s in steps):
+            return None
+        return data
 
     def _parse_json(self, content):
         try:
@@ -69,3 +124,44 @@ class QwenPlanner:
             # Fallback: Try to split by newlines if it looks like a list
             lines = [l.strip() for l in content.split('\n') if l.strip()]
             return {"steps": lines}
+
+
+class StepStreamParser:
+    """
+    Incremental parser for `{"steps": ["...", "..."]}` arriving in chunks.
+    feed() returns the steps whose strings were completed by the new text.
+    """
+    def __init__(self):
+        self.buffer = ""
+        self.pos = None # index inside the steps array, once found
+        self.done = False
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        steps = []
+        if self.done:
+            return steps
+        if self.pos is None:
+            key = self.buffer.find('"steps"')
+            start = self.buffer.find("[", key) if key != -1 else -1
+            if start == -1:
+                return steps
+            self.pos = start + 1
+
+        while True:
+            # Skip separators up to the next value
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n,":
+                self.pos += 1
+            if self.pos >= len(self.buffer):
+                return steps
+            if self.buffer[self.pos] == "]":
+                self.done = True
+                return steps
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                return steps # String not finished yet
+            self.pos = end
+            if isinstance(value, str) and value.strip():
+                steps.append(value.strip())
@@ -0,0 +1,72 @@
+import hashlib
+import re
+
+# A section is flagged when it grows past this multiple of its running average
+REGRESSION_RATIO = 1.5
+# ... and by at least this many tokens (small prompts fluctuate a lot)
+REGRESSION_MIN_TOKENS = 300
+# Weight of the newest sample in the running average
+EMA_ALPHA = 0.1
+
+_CJK_RE = re.compile(r"[㐀-鿿豈-﫿　-〿＀-￯]")
+
+
+def estimate_tokens(text):
+    """Rough token count: one per CJK character, one per ~4 other characters."""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class PromptBuilder:
+    """
+    Assembles prompts from static to dynamic so the provider can reuse a cached prefix:
+    the instructions are a fixed string (byte-identical on every call) and go first;
+    per-call sections follow, ordered from least to most frequently changing.
+    Tracks per-section token counts and logs size regressions.
+    """
+    def __init__(self, name, instructions):
+        self.name = name
+        self.instructions = instructions.strip()
+        self.instructions_tokens = estimate_tokens(self.instructions)
+        self.fingerprint = hashlib.sha1(self.instructions.encode("utf-8")).hexdigest()[:12]
+        self.calls = 0
+        self.averages = {}  # section -> running average tokens
+        self.last = {}      # section -> tokens in the latest prompt
+
+    def build(self, sections):
+        """
+        sections: ordered [(title, text)], static-most first.
+        Returns the dynamic part as one string; use `instructions` as the prefix.
+        """
+        parts = []
+        sizes = {}
+        for title, text in sections:
+            text = "" if text is None else str(text)
+            parts.append(f"# {title}\n{text}")
+            sizes[title] = estimate_tokens(text)
+        self._track(sizes)
+        return "\n\n".join(parts)
+
+    def _track(self, sizes):
+        self.calls += 1
+        self.last = sizes
+        for title, tokens in sizes.items():
+            average = self.averages.get(title)
+            if average is None:
+                self.averages[title] = float(tokens)
+                continue
+            if tokens > average * REGRESSION_RATIO and tokens - average >= REGRESSION_MIN_TOKENS:
+                print(f"[Prompt] {self.name}: section '{title}' is {tokens} tokens (avg {int(average)})")
+            self.averages[title] = average + EMA_ALPHA * (tokens - average)
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "instructions_tokens": self.instructions_tokens,
+            "instructions_fingerprint": self.fingerprint,
+            "avg_section_tokens": {k: int(v) for k, v in self.averages.items()},
+            "last_section_tokens": self.last,
+            "last_total_tokens": self.instructions_tokens + sum(self.last.values()),
+        }
@@ -0,0 +1,198 @@
+import math
+import re
+import time
+from bisect import bisect_right
+from collections import Counter
+
+# Trees smaller than this are sent whole; filtering would not save much
+MIN_LINES = 150
+TOP_K = 40
+# Lines kept below each selected node (its /url, options, cell text, ...)
+SUBTREE_LINES = 12
+# If fewer step words than this are found anywhere in the tree, send the full tree
+MIN_TERM_COVERAGE = 0.5
+GOAL_WEIGHT = 0.3
+# The best few hits also keep this many lines of their parent's subtree
+TOP_CONTEXT = 5
+CONTEXT_LINES = 30
+
+# How often a snapshot was sent whole (small / low coverage) or filtered
+stats = Counter()
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_WORD_RE = re.compile(r"[a-z0-9]+|[㐀-鿿]+")
+_STOPWORDS = {
+    "a", "an", "the", "to", "of", "on", "in", "into", "and", "or", "for", "with", "at", "by",
+    "it", "is", "be", "this", "that", "then", "please", "click", "type", "enter", "input",
+    "url", "text",
+}
+# Chinese has no spaces: runs are cut at these instruction words / particles, so
+# no bigram spans a word boundary ("在搜索框中输入关键词" -> 搜索框, 关键词)
+_CJK_STOPWORDS = (
+    "点击", "单击", "输入", "填写", "选择", "打开", "然后", "按钮", "链接", "页面",
+    "的", "了", "在", "和", "请", "并", "把", "将", "到", "中", "里",
+)
+_CJK_SPLIT_RE = re.compile("|".join(map(re.escape, sorted(_CJK_STOPWORDS, key=len, reverse=True))))
+
+
+def _units(text):
+    """
+    Query terms grouped by the word they come from: a lower-cased word, or the
+    bigrams of one CJK word (a single character stays as-is).
+    """
+    units = []
+    for word in _WORD_RE.findall(text.lower()):
+        if word[0] < "㐀":
+            if word not in _STOPWORDS:
+                units.append([word])
+            continue
+        for piece in _CJK_SPLIT_RE.split(word):
+            if len(piece) == 1:
+                units.append([piece])
+            elif piece:
+                units.append([piece[i:i + 2] for i in range(len(piece) - 1)])
+    return units
+
+
+def tokenize(text):
+    """Lower-cased words; CJK words become bigrams (single characters stay as-is)."""
+    return [t for unit in _units(text) for t in unit]
+
+
+def coverage(units, df):
+    """
+    Share of the step's words found in the tree. A CJK word counts when at
+    least half of its bigrams occur (its exact segmentation in the tree is unknown).
+    """
+    if not units:
+        return 0.0
+    found = sum(1 for unit in units if 2 * sum(1 for t in unit if df[t]) >= len(unit))
+    return found / len(units)
+
+
+def _parse(snapshot):
+    """Returns (lines, depths, parents) for a Playwright aria snapshot (YAML-like list)."""
+    lines = snapshot.split("\n")
+    depths, parents = [], []
+    stack = [] # (depth, line index)
+    for i, line in enumerate(lines):
+        depth = len(line) - len(line.lstrip(" "))
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        parents.append(stack[-1][1] if stack else -1)
+        depths.append(depth)
+        stack.append((depth, i))
+    return lines, depths, parents
+
+
+def select_relevant(snapshot, step, goal="", top_k=TOP_K):
+    """
+    BM25-rank the nodes of an aria snapshot against the step (and, weighted
+    lower, the goal) and return only the top-K nodes with their ancestors and
+    a few lines of their subtrees, in original order. Returns the snapshot
+    unchanged when it is small or the step terms are poorly covered.
+    """
+    if not snapshot:
+        return snapshot
+    start = time.monotonic()
+    lines, depths, parents = _parse(snapshot)
+    if len(lines) < MIN_LINES:
+        stats["small_tree"] += 1
+        return snapshot
+
+    step_units = _units(step)
+    weights = {t: GOAL_WEIGHT for t in tokenize(goal)}
+    weights.update({t: 1.0 for unit in step_units for t in unit})
+    if not step_units:
+        return snapshot
+
+    # Only query terms matter for BM25, so the tree is scanned with one regex
+    # instead of being tokenized; the word count stands in for node length.
+    ascii_terms = sorted((t for t in weights if t[0] < "㐀"), key=len, reverse=True)
+    cjk_terms = sorted((t for t in weights if t[0] >= "㐀"), key=len, reverse=True)
+    patterns = []
+    if ascii_terms:
+        patterns.append(r"(?<![a-z0-9])(?:" + "|".join(map(re.escape, ascii_terms)) + r")(?![a-z0-9])")
+    if cjk_terms:
+        patterns.append("|".join(map(re.escape, cjk_terms)))
+    query_re = re.compile("|".join(patterns))
+
+    # One pass over the whole (lower-cased) text; matches are mapped back to lines
+    starts = [0] * len(lines)
+    offset = 0
+    for i, line in enumerate(lines):
+        starts[i] = offset
+        offset += len(line) + 1
+    own = {} # line -> {term: count}
+    for match in query_re.finditer(snapshot.lower()):
+        i = bisect_right(starts, match.start()) - 1
+        counts = own.setdefault(i, {})
+        term = match.group()
+        counts[term] = counts.get(term, 0) + 1
+
+    # Each node is scored on its own text plus its parent's (ancestor context, half weight)
+    term_freqs = {}
+    doc_lengths = {}
+    for i, parent in enumerate(parents):
+        counts = own.get(i)
+        context = own.get(parent) if parent >= 0 else None
+        if counts is None and context is None:
+            continue
+        tf = dict(counts) if counts else {}
+        length = lines[i].count(" ") + 1
+        if context:
+            for t, c in context.items():
+                tf[t] = tf.get(t, 0) + 0.5 * c
+            length += (lines[parent].count(" ") + 1) // 2
+        term_freqs[i] = tf
+        doc_lengths[i] = length
+    df = Counter()
+    for tf in term_freqs.values():
+        df.update(tf.keys())
+
+    covered = coverage(step_units, df)
+    if covered < MIN_TERM_COVERAGE:
+        print(f"[Retrieval] Low term coverage ({covered:.2f}), sending full tree")
+        stats["low_coverage"] += 1
+        return snapshot
+
+    n = len(lines)
+    # Average over all lines; a space count per line is cheap enough for that
+    avg_len = (snapshot.count(" ") + n) / n
+    idf = {t: math.log(1 + (n - df[t] + 0.5) / (df[t] + 0.5)) for t in weights if df[t]}
+    scores = []
+    for i, tf in term_freqs.items():
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths[i] / avg_len)
+        score = sum(weights[t] * idf[t] * f * (BM25_K1 + 1) / (f + norm) for t, f in tf.items())
+        scores.append((score, i))
+    if not scores:
+        return snapshot
+    scores.sort(reverse=True)
+
+    keep = set()
+    for rank, (_, i) in enumerate(scores[:top_k]):
+        # The best hits also bring their siblings (the rest of the form, row, menu ...)
+        if rank < TOP_CONTEXT and parents[i] >= 0:
+            p = parents[i]
+            j = p + 1
+            while j < n and j - p <= CONTEXT_LINES and depths[j] > depths[p]:
+                keep.add(j)
+                j += 1
+        # The node and its ancestors, for structure
+        p = i
+        while p >= 0:
+            keep.add(p)
+            p = parents[p]
+        # A few lines of the node's own subtree
+        j = i + 1
+        while j < n and j - i <= SUBTREE_LINES and depths[j] > depths[i]:
+            keep.add(j)
+            j += 1
+
+    stats["filtered"] += 1
+    selected = [lines[i] for i in sorted(keep)]
+    elapsed = (time.monotonic() - start) * 1000
+    print(f"[Retrieval] {len(lines)} -> {len(selected)} lines in {elapsed:.1f}ms (coverage {covered:.2f})")
+    return "\n".join(selected)
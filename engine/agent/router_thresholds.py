@@ -0,0 +1,171 @@
+import os
+import random
+from datetime import datetime
+from sqlmodel import Session, select
+from database import engine, RouterOutcome
+from .locator_memory import normalize_url
+
+# The cutoff stays within these bounds; DEFAULT_THRESHOLD until a domain/action/model has data
+DEFAULT_THRESHOLD = 0.7
+MIN_THRESHOLD = float(os.getenv("DIANDIAN_ROUTER_MIN_THRESHOLD", "0.5"))
+MAX_THRESHOLD = float(os.getenv("DIANDIAN_ROUTER_MAX_THRESHOLD", "0.95"))
+# Executed L1 actions needed before the learned threshold replaces the default
+MIN_SAMPLES = int(os.getenv("DIANDIAN_ROUTER_MIN_SAMPLES", "20"))
+# Share of L1 answers just below the threshold that are executed anyway, so the
+# threshold can also move down (outcomes are only known for executed answers).
+# Off by default: it risks wrong actions and false FAILs on real cases, so enable
+# it only for benchmark / cassette runs. Without it the threshold mostly only rises.
+EXPLORE_RATE = float(os.getenv("DIANDIAN_ROUTER_EXPLORE_RATE", "0"))
+
+BUCKET = 5 # hundredths
+# "done" / "fail" / "pass" never reach the page, so they say nothing about accuracy
+LEARNED_ACTIONS = ("navigate", "click", "type", "scroll", "back", "hover")
+
+# A failed L1 action costs the action's locator timeout, then vision on the same frame
+FAILED_ACTION_MS = 5000
+
+
+def bucket_of(confidence):
+    value = max(0.0, min(float(confidence or 0.0), 1.0))
+    return min(int(round(value * 100, 6)) // BUCKET * BUCKET, 100)
+
+
+def _candidates():
+    low = int(round(MIN_THRESHOLD * 100))
+    high = int(round(MAX_THRESHOLD * 100))
+    return list(range(low - low % BUCKET, high + 1, BUCKET))
+
+
+def _rows(session, domain, action, model):
+    return session.exec(
+        select(RouterOutcome)
+        .where(RouterOutcome.domain == domain)
+        .where(RouterOutcome.action == action)
+        .where(RouterOutcome.model == model)
+    ).all()
+
+
+def expected_cost(rows, cutoff, vision_ms, failure_ms):
+    """
+    Extra latency (ms) over all L1 answers seen if everything at or above `cutoff`
+    (hundredths) had been accepted: a rejected answer costs a vision call, an
+    accepted one costs a retry with its (smoothed) failure probability.
+    """
+    cost = 0.0
+    for row in rows:
+        executed = row.success_count + row.failure_count
+        n = max(row.seen, executed)
+        if row.bucket >= cutoff:
+            cost += n * (row.failure_count + 1) / (executed + 2) * failure_ms
+        else:
+            cost += n * vision_ms
+    return cost
+
+
+def learn(rows, vision_ms, failure_ms):
+    """(threshold, executed samples) for one domain/action/model."""
+    executed = sum(r.success_count + r.failure_count for r in rows)
+    if executed < MIN_SAMPLES:
+        return DEFAULT_THRESHOLD, executed
+    # Ties go to the higher (safer) threshold; unexplored buckets cost the same either way
+    best = min(reversed(_candidates()), key=lambda c: expected_cost(rows, c, vision_ms, failure_ms))
+    return best / 100, executed
+
+
+def threshold(url, action, model, vision_ms, failure_ms):
+    """Acceptance threshold for an L1 `action` answered by `model` on this page's domain."""
+    domain, _ = normalize_url(url)
+    if not domain or action not in LEARNED_ACTIONS:
+        return DEFAULT_THRESHOLD
+    with Session(engine) as session:
+        rows = _rows(session, domain, action, model or "")
+    return learn(rows, vision_ms, failure_ms)[0]
+
+
+def explore(confidence, current):
+    """Accept an answer one bucket below the threshold every now and then."""
+    if EXPLORE_RATE <= 0 or confidence >= current:
+        return False
+    if confidence < max(MIN_THRESHOLD, current - BUCKET / 100):
+        return False
+    return random.random() < EXPLORE_RATE
+
+
+def _update(domain, action, model, confidence, **counts):
+    bucket = bucket_of(confidence)
+    model = model or ""
+    with Session(engine) as session:
+        row = session.exec(
+            select(RouterOutcome)
+            .where(RouterOutcome.domain == domain)
+            .where(RouterOutcome.action == action)
+            .where(RouterOutcome.model == model)
+            .where(RouterOutcome.bucket == bucket)
+        ).first()
+        if row is None:
+            row = RouterOutcome(domain=domain, action=action, model=model, bucket=bucket)
+        for field, n in counts.items():
+            setattr(row, field, getattr(row, field) + n)
+        row.updated_at = datetime.utcnow()
+        session.add(row)
+        session.commit()
+
+
+def record_seen(url, action, model, confidence):
+    """Count an L1 answer of `model`, accepted or not (how often each bucket comes up)."""
+    domain, _ = normalize_url(url)
+    if domain and action in LEARNED_ACTIONS:
+        _update(domain, action, model, confidence, seen=1)
+
+
+def record_outcome(url, action, model, confidence, success):
+    """Count whether an accepted L1 action answered by `model` succeeded."""
+    domain, _ = normalize_url(url)
+    if domain and action in LEARNED_ACTIONS:
+        _update(domain, action, model, confidence, **{"success_count" if success else "failure_count": 1})
+
+
+def list_thresholds(vision_ms, failure_ms, domain=None):
+    """Learned threshold and per-bucket counts for every domain/action/model with data."""
+    with Session(engine) as session:
+        query = select(RouterOutcome)
+        if domain:
+            query = query.where(RouterOutcome.domain == domain)
+        rows = session.exec(query.order_by(
+            RouterOutcome.domain, RouterOutcome.action, RouterOutcome.model, RouterOutcome.bucket
+        )).all()
+
+    grouped = {}
+    for row in rows:
+        grouped.setdefault((row.domain, row.action, row.model), []).append(row)
+    result = []
+    for (row_domain, action, model), group in grouped.items():
+        value, executed = learn(group, vision_ms, failure_ms)
+        result.append({
+            "domain": row_domain,
+            "action": action,
+            "model": model,
+            "threshold": value,
+            "learned": executed >= MIN_SAMPLES,
+            "samples": executed,
+            "buckets": [
+                {"confidence": r.bucket / 100, "seen": r.seen, "succeeded": r.success_count, "failed": r.failure_count}
+                for r in group
+            ],
+        })
+    return result
+
+
+def reset(domain=None, action=None):
+    """Forget outcomes (all, one domain, or one domain/action); returns rows deleted."""
+    with Session(engine) as session:
+        query = select(RouterOutcome)
+        if domain:
+            query = query.where(RouterOutcome.domain == domain.lower())
+        if action:
+            query = query.where(RouterOutcome.action == action)
+        rows = session.exec(query).all()
+        for row in rows:
+            session.delete(row)
+        session.commit()
+    return len(rows)
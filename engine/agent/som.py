@@ -1,100 +1,434 @@
+import os
+import io
+import base64
 from playwright.async_api import Page
 
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:  # Pillow is optional; without it only the "dom" mode is available
+    Image = None
+
+# "overlay": measure boxes only and draw the labels onto a copy of one clean
+# screenshot (the page is never touched). "dom": render markers into the page.
+SOM_MODE = os.getenv("SOM_MODE", "overlay").lower()
+
+# In-page element registry. Installed once per document; a MutationObserver
+# tracks which interactive elements were added, removed or touched, so each
+# marking pass only re-measures / redraws what changed. IDs are never reused
+# within a document, and continue from `startId` after a navigation.
+REGISTRY_JS = """
+(startId) => {
+    if (window.__ddSom) return false;
+
+    const SELECTOR = "button, input, a, textarea, [role='button'], [role='link']";
+    const ids = new WeakMap();      // element -> id (kept after removal so a re-inserted node keeps its id)
+    const elements = new Map();     // id -> live element
+    const boxes = new Map();        // id -> last reported box
+    const markers = new Map();      // id -> marker node in the overlay layer
+    const dirty = new Set();        // elements to re-measure
+    const removed = new Set();      // ids dropped since the last pass
+    let nextId = startId;
+    const touched = new Set();      // containers whose children were added/removed
+    const shifted = new Set();      // mutated nodes: controls laid out after (or inside) them may have moved
+    let layoutChanged = true;       // viewport/document size changed: re-measure everything
+    let docSize = '';
+    let scanned = false;
+    let layer = null;
+    let version = 0;                // DOM mutations / input / layout moves outside the overlay, for change detection
+
+    // Size changes of marked elements (no DOM mutation needed, e.g. a late font)
+    // (the first notification per element only reports its initial size)
+    const sized = new WeakSet();
+    const resized = new ResizeObserver((entries) => {
+        let moved = false;
+        entries.forEach((entry) => {
+            if (!sized.has(entry.target)) { sized.add(entry.target); return; }
+            dirty.add(entry.target);
+            moved = true;
+        });
+        if (moved) version++;
+    });
+
+    const register = (el) => {
+        let id = ids.get(el);
+        if (id === undefined) {
+            id = nextId++;
+            ids.set(el, id);
+            resized.observe(el);
+        }
+        elements.set(id, el);
+        removed.delete(id);
+        dirty.add(el);
+    };
+
+    const scan = (node) => {
+        if (node.nodeType !== 1 || node === layer) return;
+        if (node.matches(SELECTOR)) register(node);
+        node.querySelectorAll(SELECTOR).forEach(register);
+    };
+
+    const forget = (node) => {
+        if (node.nodeType !== 1 || node === layer) return;
+        const drop = (el) => {
+            const id = ids.get(el);
+            if (id !== undefined && !el.isConnected && elements.get(id) === el) {
+                elements.delete(id);
+                removed.add(id);
+            }
+        };
+        drop(node);
+        node.querySelectorAll(SELECTOR).forEach(drop);
+    };
+
+    const observer = new MutationObserver((records) => {
+        for (const record of records) {
+            if (layer && layer.contains(record.target)) continue;
+            if (record.type === 'childList') {
+                if (record.addedNodes.length === 1 && record.addedNodes[0] === layer) continue;
+                record.removedNodes.forEach(forget);
+                record.addedNodes.forEach(scan);
+                touched.add(record.target);
+            } else {
+                const target = record.target;
+                if (target.matches(SELECTOR)) register(target);
+                // class/style/hidden on a container can hide or move its controls
+                target.querySelectorAll(SELECTOR).forEach((el) => dirty.add(el));
+            }
+        }
+    });
+    observer.observe(document.documentElement, {
+        childList: true,
+        subtree: true,
+        attributes: true,
+        attributeFilter: ['class', 'style', 'hidden', 'disabled', 'aria-hidden', 'role', 'href', 'type']
+    });
+    window.addEventListener('resize', () => { layoutChanged = true; });
+    // Moves without a mutation: scrolling an inner container shifts its controls,
+    // late fonts / decoded images can shift everything after them. A window scroll
+    // keeps document coordinates, except for fixed / sticky controls: re-measure all.
+    document.addEventListener('scroll', (event) => {
+        if (event.target === document) layoutChanged = true;
+        else touched.add(event.target);
+        version++;
+    }, { capture: true, passive: true });
+    document.addEventListener('load', (event) => {
+        if (event.target.tagName === 'IMG') { layoutChanged = true; version++; }
+    }, true);
+    if (document.fonts) document.fonts.addEventListener('loadingdone', () => { layoutChanged = true; version++; });
+
+    // Separate, unfiltered observer: any change the page shows (text included) bumps the version.
+    // Text, nodes or attributes changing size can move what follows without changing the
+    // document size, so the controls after the mutated node are re-measured too.
+    new MutationObserver((records) => {
+        let seen = false;
+        records.forEach((r) => {
+            if (layer && (r.target === layer || layer.contains(r.target))) return;
+            if (r.addedNodes.length === 1 && r.addedNodes[0] === layer) return;
+            seen = true;
+            const node = r.type === 'characterData' ? r.target.parentNode : r.target;
+            if (node) shifted.add(node);
+        });
+        if (seen) version++;
+    }).observe(document.documentElement, { childList: true, subtree: true, attributes: true, characterData: true });
+    document.addEventListener('input', () => { version++; }, true);
+
+    const measure = (el) => {
+        const rect = el.getBoundingClientRect();
+        if (rect.width === 0 || rect.height === 0) return null;
+        if (getComputedStyle(el).visibility === 'hidden') return null;
+        return {
+            x: Math.round(rect.left + window.scrollX),
+            y: Math.round(rect.top + window.scrollY),
+            w: Math.round(rect.width),
+            h: Math.round(rect.height)
+        };
+    };
+
+    const sameBox = (a, b) => a && b && a.x === b.x && a.y === b.y && a.w === b.w && a.h === b.h;
+
+    // Returns true when the layer had to be (re)created and needs a full redraw
+    const ensureLayer = () => {
+        if (layer && layer.isConnected) return false;
+        layer = document.createElement('div');
+        Object.assign(layer.style, {
+            position: 'absolute', left: '0px', top: '0px', width: '0px', height: '0px',
+            pointerEvents: 'none', zIndex: '2147483647'
+        });
+        document.documentElement.appendChild(layer);
+        markers.clear();
+        return true;
+    };
+
+    const drawMarker = (id, box) => {
+        let marker = markers.get(id);
+        if (!marker) {
+            marker = document.createElement('div');
+            Object.assign(marker.style, {
+                position: 'absolute', boxSizing: 'border-box',
+                outline: '1px solid rgba(239, 68, 68, 0.4)', outlineOffset: '-1px'
+            });
+            const label = document.createElement('span');
+            label.textContent = String(id);
+            Object.assign(label.style, {
+                position: 'absolute', left: '0px', top: '0px',
+                transform: 'translate(-50%, -50%)',
+                backgroundColor: 'rgba(239, 68, 68, 0.8)', color: 'white',
+                fontSize: '10px', fontWeight: 'bold', fontFamily: 'sans-serif', lineHeight: '1',
+                padding: '1px 3px', borderRadius: '3px',
+                border: '1px solid rgba(255, 255, 255, 0.8)',
+                boxShadow: '0 1px 3px rgba(0,0,0,0.3)'
+            });
+            marker.appendChild(label);
+            layer.appendChild(marker);
+            markers.set(id, marker);
+        }
+        marker.style.left = box.x + 'px';
+        marker.style.top = box.y + 'px';
+        marker.style.width = box.w + 'px';
+        marker.style.height = box.h + 'px';
+    };
+
+    const removeMarker = (id) => {
+        const marker = markers.get(id);
+        if (marker) {
+            marker.remove();
+            markers.delete(id);
+        }
+    };
+
+    window.__ddSom = {
+        // Returns only the changes since the previous call:
+        // { changed: [{id, visible, x, y, w, h}], removed: [id], nextId, viewport }
+        // With draw=false boxes are still tracked but nothing is rendered.
+        mark(draw) {
+            let redrawAll = false;
+            if (draw) {
+                redrawAll = ensureLayer();
+                layer.style.display = '';
+            }
+            if (!scanned) {
+                scan(document.body || document.documentElement);
+                scanned = true;
+            }
+            // Insertions that change the document size can shift everything after
+            // them; otherwise only controls inside the mutated containers can move.
+            const size = document.documentElement.scrollWidth + 'x' + document.documentElement.scrollHeight;
+            if (size !== docSize) {
+                docSize = size;
+                layoutChanged = true;
+            }
+            if (layoutChanged) {
+                // Reads only; markers are rewritten below just for boxes that moved
+                elements.forEach((el) => dirty.add(el));
+                layoutChanged = false;
+            } else {
+                touched.forEach((node) => {
+                    if (node.isConnected && node.querySelectorAll) node.querySelectorAll(SELECTOR).forEach((el) => dirty.add(el));
+                });
+                const after = Node.DOCUMENT_POSITION_FOLLOWING | Node.DOCUMENT_POSITION_CONTAINED_BY;
+                const origins = [...shifted].filter((node) => node.isConnected);
+                if (origins.length) {
+                    elements.forEach((el) => {
+                        if (origins.some((node) => node.compareDocumentPosition(el) & after)) dirty.add(el);
+                    });
+                }
+            }
+            touched.clear();
+            shifted.clear();
+
+            const changed = [];
+            dirty.forEach((el) => {
+                const id = ids.get(el);
+                if (id === undefined || elements.get(id) !== el) return;
+                const box = measure(el);
+                const prev = boxes.get(id);
+                if (box ? sameBox(box, prev) : !prev) return;
+                if (box) boxes.set(id, box); else boxes.delete(id);
+                changed.push(box ? { id, visible: true, ...box } : { id, visible: false });
+            });
+            dirty.clear();
+
+            const gone = [];
+            removed.forEach((id) => {
+                if (boxes.delete(id)) gone.push(id);
+            });
+            removed.clear();
+
+            if (redrawAll) {
+                boxes.forEach((box, id) => drawMarker(id, box));
+            } else if (draw) {
+                changed.forEach((c) => c.visible ? drawMarker(c.id, c) : removeMarker(c.id));
+                gone.forEach(removeMarker);
+            }
+            return {
+                changed, removed: gone, nextId,
+                viewport: { scrollX: window.scrollX, scrollY: window.scrollY, width: window.innerWidth, height: window.innerHeight }
+            };
+        },
+        hide() {
+            if (layer) layer.style.display = 'none';
+        },
+        get(id) {
+            return elements.get(id) || null;
+        },
+        version() {
+            return version;
+        }
+    };
+    return true;
+}
+"""
+
+MARK_JS = """
+(draw) => window.__ddSom.mark(draw)
+"""
+
+# Equal fingerprints: nothing the page shows changed (no navigation, mutation, input,
+# window or inner scroll, element resize, late font or image load)
+FINGERPRINT_JS = """
+() => [location.href, window.__ddSom ? window.__ddSom.version() : null,
+       window.scrollX, window.scrollY, window.innerWidth, window.innerHeight]
+"""
+
+# Selector engine resolving "ddsom=<id>" through the registry, so marker IDs are
+# used through Locators (re-resolved on every action) instead of ElementHandles
+# that pin DOM nodes until they are disposed. Runs in the page's main world.
+SELECTOR_ENGINE = "ddsom"
+SELECTOR_ENGINE_JS = """
+({
+    query(root, selector) {
+        const el = window.__ddSom && window.__ddSom.get(Number(selector));
+        return el && el.isConnected && (root === el || root.contains(el)) ? el : null;
+    },
+    queryAll(root, selector) {
+        const el = this.query(root, selector);
+        return el ? [el] : [];
+    }
+})
+"""
+
+
+MARKER_COLOR = (239, 68, 68)
+LABEL_FONT_SIZE = 10
+
+
 class SetOfMark:
-    def __init__(self, page: Page):
+    def __init__(self, page: Page, mode: str = None):
         self.page = page
+        mode = (mode or SOM_MODE).lower()
+        if mode == "overlay" and Image is None:
+            print("[SoM] Pillow not installed, falling back to DOM markers")
+            mode = "dom"
+        self.mode = mode
+        # id -> {"x", "y", "w", "h"} (document coordinates) for currently visible elements
         self.marked_elements = {}
+        # scroll offset and CSS viewport size at the last marking pass
+        self.viewport = None
+        self._next_id = 0
+        self._page_ref = None
 
-    async def inject_style(self):
-        """Inject CSS for SoM markers."""
-        css = """
-        .som-marker {
-            position: absolute;
-            background-color: rgba(239, 68, 68, 0.8); /* Red-500 with 80% opacity */
-            color: white;
-            font-size: 10px;
-            font-weight: bold;
-            padding: 1px 3px;
-            border-radius: 3px;
-            z-index: 2147483647;
-            pointer-events: none;
-            box-shadow: 0 1px 3px rgba(0,0,0,0.3);
-            border: 1px solid rgba(255, 255, 255, 0.8);
-            transform: translate(-50%, -50%); /* Pin center to the coordinate */
-            line-height: 1;
-        }
-        .som-element-highlight {
-            outline: 1px solid rgba(239, 68, 68, 0.4) !important;
-            outline-offset: -1px !important;
-        }
-        """
-        await self.page.add_style_tag(content=css)
+    @property
+    def draws_in_page(self):
+        return self.mode == "dom"
+
+    async def _ensure_registry(self):
+        """Install the registry in the current document; reset the local cache on a fresh document."""
+        if self._page_ref is not self.page:
+            self._page_ref = self.page
+            self.marked_elements = {}
+        installed = await self.page.evaluate(REGISTRY_JS, self._next_id)
+        if installed:
+            # New document (navigation/reload): previous ids no longer resolve
+            self.marked_elements = {}
 
     async def add_markers(self):
         """
-        Identify interactive elements and overlay markers.
-        Returns a dictionary mapping ID -> ElementHandle.
+        Sync the registry and, in "dom" mode, draw markers for interactive elements.
+        Only elements that changed since the last pass are re-measured and redrawn.
+        Returns a dictionary mapping ID -> box.
         """
-        await self.inject_style()
-        
-        # Identify interactive elements: buttons, inputs, links, textareas
-        selector = "button, input, a, textarea, [role='button'], [role='link']"
-        elements = await self.page.query_selector_all(selector)
-        
-        self.marked_elements = {}
-        marker_script = """
-        (el, id) => {
-            const rect = el.getBoundingClientRect();
-            if (rect.width === 0 || rect.height === 0 || getComputedStyle(el).visibility === 'hidden') return false;
-            
-            // Add subtle border to the element itself
-            el.classList.add('som-element-highlight');
-
-            const marker = document.createElement('div');
-            marker.className = 'som-marker';
-            marker.textContent = id;
-            // Position at top-left corner
-            marker.style.left = (rect.left + window.scrollX) + 'px';
-            marker.style.top = (rect.top + window.scrollY) + 'px';
-            document.body.appendChild(marker);
-            return true;
-        }
+        await self._ensure_registry()
+        result = await self.page.evaluate(MARK_JS, self.draws_in_page)
+        self.viewport = result.get("viewport")
+
+        for marker_id in result["removed"]:
+            self.marked_elements.pop(marker_id, None)
+        for change in result["changed"]:
+            if change["visible"]:
+                self.marked_elements[change["id"]] = {k: change[k] for k in ("x", "y", "w", "h")}
+            else:
+                self.marked_elements.pop(change["id"], None)
+        self._next_id = result["nextId"]
+
+        return self.marked_elements
+
+    async def fingerprint(self):
+        """
+        Cheap page-change signature (registry mutation counter, URL, scroll, viewport).
+        None when unknown, e.g. on a document that was never marked.
         """
+        try:
+            value = await self.page.evaluate(FINGERPRINT_JS)
+        except Exception:
+            return None
+        return value if value[1] is not None else None
 
-        # Cleanup old markers and highlights first
-        await self.page.evaluate("""() => {
-            document.querySelectorAll('.som-marker').forEach(el => el.remove());
-            document.querySelectorAll('.som-element-highlight').forEach(el => el.classList.remove('som-element-highlight'));
-        }""")
-
-        visible_count = 0
-        visible_count = 0
-        for i, el in enumerate(elements):
-            try:
-                # Check visibility and add marker
-                # Handle potential detached elements or JS errors gracefully
-                is_visible = await self.page.evaluate(f"""
-                ([el, id]) => {{
-                    if (!el || typeof el.getBoundingClientRect !== 'function') return false;
-                    return ({marker_script})(el, id);
-                }}
-                """, [el, i])
-                
-                if is_visible:
-                    self.marked_elements[i] = el
-                    visible_count += 1
-            except Exception as e:
-                # Element likely detached or stale; ignore
+    def locator(self, marker_id):
+        """Locator for a marker ID (needs the selector engine registered on the browser)."""
+        return self.page.locator(f"{SELECTOR_ENGINE}={int(marker_id)}")
+
+    def annotate(self, screenshot_base64: str) -> str:
+        """
+        Draw the current markers onto a copy of a clean viewport screenshot
+        (base64 JPEG in, base64 JPEG out). CPU-bound: run it off the event loop.
+        """
+        if not screenshot_base64 or Image is None or not self.viewport:
+            return screenshot_base64
+
+        image = Image.open(io.BytesIO(base64.b64decode(screenshot_base64))).convert("RGB")
+        # Screenshot pixels per CSS pixel (device scale factor)
+        scale = image.width / max(self.viewport["width"], 1)
+        scroll_x, scroll_y = self.viewport["scrollX"], self.viewport["scrollY"]
+        draw = ImageDraw.Draw(image)
+        font = _label_font(max(int(LABEL_FONT_SIZE * scale), 8))
+
+        for marker_id, box in self.marked_elements.items():
+            left = (box["x"] - scroll_x) * scale
+            top = (box["y"] - scroll_y) * scale
+            right = left + box["w"] * scale
+            bottom = top + box["h"] * scale
+            if right < 0 or bottom < 0 or left > image.width or top > image.height:
                 continue
-                
-        # Limit to top 50 elements to avoid cluttering specific views
-        # (Optimization: could prioritize by visibility or viewport location)
-        
-        return self.marked_elements
+            draw.rectangle([left, top, right, bottom], outline=MARKER_COLOR, width=1)
+
+            # Label centered on the top-left corner, like the DOM markers
+            label = str(marker_id)
+            tl, tt, tr, tb = draw.textbbox((0, 0), label, font=font)
+            pad = max(int(2 * scale), 1)
+            lw, lh = tr - tl + 2 * pad, tb - tt + 2 * pad
+            lx = min(max(left - lw / 2, 0), image.width - lw)
+            ly = min(max(top - lh / 2, 0), image.height - lh)
+            draw.rectangle([lx, ly, lx + lw, ly + lh], fill=MARKER_COLOR, outline=(255, 255, 255))
+            draw.text((lx + pad - tl, ly + pad - tt), label, fill=(255, 255, 255), font=font)
+
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=50)
+        return base64.b64encode(buffer.getvalue()).decode("utf-8")
 
     async def clear_markers(self):
-        await self.page.evaluate("""() => {
-            document.querySelectorAll('.som-marker').forEach(el => el.remove());
-            document.querySelectorAll('.som-element-highlight').forEach(el => el.classList.remove('som-element-highlight'));
-        }""")
-        self.marked_elements = {}
+        """Hide the overlay. Markers are kept so the next pass only redraws changes."""
+        if not self.page or not self.draws_in_page:
+            return
+        await self.page.evaluate("() => window.__ddSom && window.__ddSom.hide()")
+
+
+_fonts = {}
+
+
+def _label_font(size):
+    if size not in _fonts:
+        try:
+            _fonts[size] = ImageFont.load_default(size=size)
+        except TypeError:  # Pillow < 10.1 has a single fixed-size bitmap font
+            _fonts[size] = ImageFont.load_default()
+    return _fonts[size]
@@ -1,5 +1,65 @@
+import os
+import time
 from abc import ABC, abstractmethod
 from typing import Dict, Any, Optional
+from ..llm import JSONObjectStream
+
+# Stream model output and act as soon as the action fields are complete
+PERCEPTION_STREAMING = os.getenv("PERCEPTION_STREAMING", "1") != "0"
+
+# Actions that can be chained against one frame (they do not replace the page)
+BATCHABLE_ACTIONS = ("click", "type", "hover")
+MAX_BATCH_ACTIONS = 10
+
+
+def normalize_actions(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Accept an ordered batch `{"actions": [{action, target_id/selector, param}, ...]}`.
+    The batch is cut at the first non-element action and the top-level fields
+    mirror its first entry, so single-action consumers keep working.
+    """
+    actions = data.pop("actions", None)
+    if not isinstance(actions, list):
+        return data
+    actions = [a for a in actions if isinstance(a, dict) and a.get("action")]
+    if not actions:
+        return data
+
+    batch = []
+    for item in actions[:MAX_BATCH_ACTIONS]:
+        if item["action"] not in BATCHABLE_ACTIONS:
+            break
+        batch.append(item)
+    first = batch[0] if batch else actions[0]
+    for key in ("action", "target_id", "selector", "param"):
+        data[key] = first.get(key)
+    if len(batch) > 1:
+        data["actions"] = batch
+    return data
+
+def action_ready(fields: Dict[str, Any]) -> bool:
+    """
+    True once everything needed to act has arrived. The prompts ask for
+    action / target / param, then the optional actions batch, then confidence
+    and the thought last, so confidence closes everything needed to act and
+    the (long) thought can be cut off.
+    """
+    action = fields.get("action")
+    if "confidence" not in fields:
+        return False
+    # A batch precedes confidence and only appears here once the whole array is parsed
+    if isinstance(fields.get("actions"), list):
+        return True
+    if not action:
+        return False
+    if action in ("click", "hover"):
+        return "selector" in fields or "target_id" in fields
+    if action == "type":
+        return ("selector" in fields or "target_id" in fields) and "param" in fields
+    if action in ("navigate", "scroll"):
+        return "param" in fields or "target_id" in fields
+    return True
+
 
 class PerceptionStrategy(ABC):
     """
@@ -24,5 +84,25 @@ class PerceptionStrategy(ABC):
             - param: Optional[str]
             - thought: str
             - confidence: float (0.0 - 1.0)
+            - actions: Optional ordered batch of element actions (same keys) to run
+              against the same frame; see normalize_actions.
         """
         pass
+
+    async def _stream_action(self, deltas):
+        """
+        Read a model stream until action_ready(), then stop generation.
+        Returns (fields or None, full text so far, time_to_action_ms).
+        """
+        start = time.monotonic()
+        parser = JSONObjectStream()
+        content = ""
+        try:
+            async for delta in deltas:
+                content += delta
+                fields = parser.feed(delta)
+                if action_ready(fields):
+                    return dict(fields), content, int((time.monotonic() - start) * 1000)
+        finally:
+            await deltas.aclose()
+        return None, content, int((time.monotonic() - start) * 1000)
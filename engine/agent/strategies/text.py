@@ -1,96 +1,136 @@
 import asyncio
 import os
+import time
 import json
 from typing import Dict, Any
-from http import HTTPStatus
-import dashscope
-from .base import PerceptionStrategy
+from .base import PerceptionStrategy, normalize_actions, PERCEPTION_STREAMING
+from ..llm import stream_generation, complete
+from ..cascade import ModelCascade, L1_MODEL_CASCADE
+from ..retrieval import select_relevant
+from ..prompts import PromptBuilder
+
+# Identical on every call; the per-step context goes in the user message
+INSTRUCTIONS = """
+# Role
+You are a Web Automation Agent. Your task is to analyze the Accessibility Tree (Aria Snapshot) and determine the DOM Element to interact with.
+
+# Action Space
+- `click`: Click an element. Provide `selector` (Playwright locator or Regex name).
+- `type`: Input text. Provide `selector` and `param` (text).
+- `scroll`: "up", "down", "top", or "bottom". Use "bottom" to quickly reach the end of the page.
+- `navigate`: "url"
+- `done`: Task completed.
+- `fail`: Cannot find element or unsure.
+
+# Critical Rules
+1. **Prefer Role Selectors**: Use specific text locators like `role=button[name='Search']` or `text='Login'`.
+2. **Confident Only**: If the element is not clearly visible in the tree, return `fail`.
+3. **Confidence**: Rate your confidence 0.0-1.0: how sure you are that the action and selector are right for this step. Low-confidence answers are checked with Vision Mode, so do not inflate it.
+4. **Forms**: To fill several fields at once, return `"actions": [{"action": "type", "selector": "...", "param": "..."}, ...]` (click/type only, max 10, in order). They run on the current page, so only include elements present in the DOM tree you are given.
+
+# Output JSON
+Output only this JSON object, with the fields in this order: `action`, `selector`, `param`, then `actions` (only for a batch), then `confidence`, and `thought` last (one short sentence):
+{
+    "action": "click",
+    "selector": "role=button[name='Search']",
+    "param": null,
+    "confidence": 0.95,
+    "thought": "I see a 'Search' button in the banner."
+}
+
+The user message contains the goal, the current step, the history and the DOM tree.
+"""
+
+PROMPT = PromptBuilder("text", INSTRUCTIONS)
+
 
 class TextPerceptionStrategy(PerceptionStrategy):
     def __init__(self):
-        self.model = "qwen-max"
+        # Cheaper models first (L1_MODEL_CASCADE), escalating while `accept` says no
+        self.cascade = ModelCascade("l1", L1_MODEL_CASCADE)
 
-    def _call_api(self, messages):
-        return dashscope.Generation.call(
-            model=self.model,
-            messages=messages,
-            result_format='message',
-        )
+    def _call_api(self, model, messages, usage):
+        return complete(model, messages, usage=usage)
 
     async def perceive(self, step: str, goal: str, history_str: str, **kwargs) -> Dict[str, Any]:
+        """
+        kwargs: aria_snapshot, and optionally accept (async fn(result) -> bool)
+        judging each tier's answer. The returned result carries the `model`
+        that produced it and whether it was `accepted`.
+        """
         aria_snapshot = kwargs.get("aria_snapshot")
+        accept = kwargs.get("accept")
         if not aria_snapshot:
             return {"action": "pass", "thought": "No aria_snapshot provided", "confidence": 0.0}
 
-        prompt = f"""
-        # Role
-        You are a Web Automation Agent. Your task is to analyze the Accessibility Tree (Aria Snapshot) and determine the DOM Element to interact with.
-
-        # Context
-        - User Goal: {goal}
-        - Current Step: {step}
-        - History: {history_str}
-
-        # DOM Tree (Aria Snapshot)
-        {aria_snapshot}
-
-        # Action Space
-        - `click`: Click an element. Provide `selector` (Playwright locator or Regex name).
-        - `type`: Input text. Provide `selector` and `param` (text).
-        - `scroll`: "up", "down", "top", or "bottom". Use "bottom" to quickly reach the end of the page.
-        - `navigate`: "url"
-        - `done`: Task completed.
-        - `fail`: Cannot find element or unsure.
-
-        # Critical Rules
-        1. **Prefer Role Selectors**: Use specific text locators like `role=button[name='Search']` or `text='Login'`.
-        2. **Confident Only**: If the element is not clearly visible in the tree, return `fail`.
-        3. **Confidence**: Rate your confidence 0.0-1.0. If < 0.7, I will switch to Vision Mode.
-
-        # Output JSON
-        {{
-            "thought": "I see a 'Search' button in the banner.",
-            "action": "click",
-            "selector": "role=button[name='Search']", 
-            "param": null,
-            "confidence": 0.95
-        }}
-        """
+        # Large trees are cut down to the nodes relevant to this step
+        relevant_snapshot = select_relevant(aria_snapshot, step, goal)
+        tree_note = "" if relevant_snapshot is aria_snapshot else "(Filtered to the nodes most relevant to this step)\n"
 
+        prompt = PROMPT.build([
+            ("User Goal", goal),
+            ("Current Step", step),
+            ("History", history_str),
+            ("DOM Tree (Aria Snapshot)", tree_note + relevant_snapshot),
+        ])
+
+        # Static instructions first (system) so the provider can cache the prefix
         messages = [
-            {'role': 'system', 'content': 'You are a helpful web agent.'},
+            {'role': 'system', 'content': PROMPT.instructions},
             {'role': 'user', 'content': prompt}
         ]
 
+        for model in self.cascade.models:
+            started = time.monotonic()
+            usage = {}
+            data, content = await self._ask(model, messages, usage)
+            data["model"] = model
+            data["accepted"] = await accept(data) if accept else data.get("action") not in ("fail", "pass")
+            self.cascade.record(model, started, data["accepted"], usage=usage, messages=messages, output=content)
+            if data["accepted"]:
+                break
+            if not self.cascade.is_last(model):
+                print(f"[TextStrategy] {model} answer not accepted, escalating")
+        return data
+
+    async def _ask(self, model, messages, usage):
+        """One tier: returns (parsed action, raw text received)."""
+        content = ""
         try:
-            print("[TextStrategy] Calling Qwen-Max (Timeout: 30s)...")
-            response = await asyncio.wait_for(
-                asyncio.to_thread(self._call_api, messages),
+            if PERCEPTION_STREAMING:
+                print(f"[TextStrategy] Streaming {model} (Timeout: 30s)...")
+                fields, content, time_to_action_ms = await asyncio.wait_for(
+                    self._stream_action(stream_generation(model, messages, usage=usage)),
+                    timeout=30.0
+                )
+                data = self._normalize(fields) if fields else self._parse_json(content)
+                data["time_to_action_ms"] = time_to_action_ms
+                print(f"[TextStrategy] Action ready after {time_to_action_ms}ms{' (stopped early)' if fields else ''}")
+                return data, content
+
+            print(f"[TextStrategy] Calling {model} (Timeout: 30s)...")
+            content = await asyncio.wait_for(
+                asyncio.to_thread(self._call_api, model, messages, usage),
                 timeout=30.0
             )
-
-            if response.status_code == HTTPStatus.OK:
-                content = response.output.choices[0].message.content
-                return self._parse_json(content)
-            else:
-                print(f"[TextStrategy] API Error: {response.code} - {response.message}")
-                return {"action": "fail", "thought": f"API Error", "confidence": 0.0}
+            return self._parse_json(content), content
         
         except asyncio.TimeoutError:
              print("[TextStrategy] Timeout Error (30s)")
-             return {"action": "fail", "thought": "L1 Analysis Timeout", "confidence": 0.0}
+             return {"action": "fail", "thought": "L1 Analysis Timeout", "confidence": 0.0}, content
         except Exception as e:
             print(f"[TextStrategy] Exception: {e}")
-            return {"action": "fail", "thought": f"Exception: {str(e)}", "confidence": 0.0}
+            return {"action": "fail", "thought": f"Exception: {str(e)}", "confidence": 0.0}, content
 
     def _parse_json(self, content):
         try:
             content = content.replace("```json", "").replace("```", "").strip()
-            data = json.loads(content)
-            # Normalize
-            if "confidence" not in data:
-                data["confidence"] = 0.5
-            return data
+            return self._normalize(json.loads(content))
         except Exception as e:
             print(f"[TextStrategy] JSON Parse Failed: {content}")
             return {"action": "fail", "thought": "Parse Error", "confidence": 0.0}
+
+    def _normalize(self, data):
+        if "confidence" not in data:
+            data["confidence"] = 0.5
+        return normalize_actions(data)
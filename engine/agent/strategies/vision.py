@@ -3,11 +3,52 @@ import os
 import json
 import base64
 import tempfile
-from http import HTTPStatus
 from typing import Dict, Any
-import dashscope
-from dashscope import MultiModalConversation
-from .base import PerceptionStrategy
+from .base import PerceptionStrategy, normalize_actions, PERCEPTION_STREAMING
+from ..llm import stream_generation, complete
+from ..prompts import PromptBuilder
+
+# Identical on every call; goal / step / history go in the user message
+INSTRUCTIONS = """
+你是一个Web自动化测试代理。请根据截图和任务进行操作。
+
+# Role
+你是一个拥有视觉感知能力的 AI 网页测试代理。你的任务是根据用户的【目标】和【当前截图】，决定下一步的浏览器操作。
+
+# 核心规则 (Critical Rules)
+1. **SoM定位**: 截图中的可交互元素已被【红色数字 ID】标记。你 **必须且只能** 操作这些有标记的元素。严禁臆造不存在的 ID。
+2. **场景自适应**:
+   - **弹窗**: 如果遇到遮挡视线的弹窗（如广告、登录提示、Cookie条），**优先** 寻找 ID 点击关闭或跳过，除非任务明确要求登录。
+   - **长页面**: 如果目标元素不在当前视野内（例如搜索结果在下方），请使用 `scroll` "down" 或 "bottom"（如果目标在页尾）。
+   - **完成态**: 如果页面内容已经完全满足【目标】，请立即返回 `done`。
+3. **输入规范**: 对于 `type` 操作，`param`必须是完整的输入内容。
+4. **批量操作**: 表单等场景可一次返回多个操作：`"actions": [{"action": "type", "target_id": 3, "param": "..."}, ...]`（仅限 click/type/hover，最多 10 个，按顺序执行）。它们都在当前截图上执行，只能使用当前截图中的 ID。
+
+# 动作空间 (Action Space)
+- `click`: 点击元素。需提供 `target_id`。
+- `type`: 输入文本。需提供 `target_id` 和 `param`(文本内容)。
+- `scroll`: 滚动页面。`param` 为 "up", "down", "top" 或 "bottom"。无需 `target_id`。
+- `navigate`: 访问URL。`param`为网址。无需 `target_id`。
+- `back`: 浏览器后退。
+- `hover`: 鼠标悬停。需提供 `target_id`。
+- `done`: 任务完成。
+- `fail`: 无法继续或发生错误。
+
+# 输出格式 (JSON)
+只输出下面的 JSON 对象，字段按此顺序排列：`action`、`target_id`、`param`，批量操作时接着是 `actions`，然后是 `confidence`，`thought` 放在最后（简短说明即可）：
+{
+    "action": "click",
+    "target_id": 5,
+    "param": null,
+    "confidence": 1.0,
+    "thought": "观察：当前是百度首页... 策略：点击ID=5。"
+}
+
+用户消息中包含当前截图、用户目标、当前小步骤和历史操作。
+"""
+
+PROMPT = PromptBuilder("vision", INSTRUCTIONS)
+
 
 class VisionPerceptionStrategy(PerceptionStrategy):
     def __init__(self):
@@ -23,11 +64,7 @@ class VisionPerceptionStrategy(PerceptionStrategy):
         return temp_file.name
 
     def _call_api(self, messages):
-        return MultiModalConversation.call(
-            model=self.model,
-            messages=messages,
-            result_format='message'
-        )
+        return complete(self.model, messages, multimodal=True)
 
     async def perceive(self, step: str, goal: str, history_str: str, **kwargs) -> Dict[str, Any]:
         screenshot_base64 = kwargs.get("screenshot")
@@ -37,52 +74,35 @@ class VisionPerceptionStrategy(PerceptionStrategy):
         temp_img_path = self._save_base64_to_temp(screenshot_base64)
         img_uri = f"file://{temp_img_path}"
 
-        prompt = f"""
-        # Role
-        你是一个拥有视觉感知能力的 AI 网页测试代理。你的任务是根据用户的【目标】和【当前截图】，决定下一步的浏览器操作。
-
-        # 核心规则 (Critical Rules)
-        1. **SoM定位**: 截图中的可交互元素已被【红色数字 ID】标记。你 **必须且只能** 操作这些有标记的元素。严禁臆造不存在的 ID。
-        2. **场景自适应**: 
-           - **弹窗**: 如果遇到遮挡视线的弹窗（如广告、登录提示、Cookie条），**优先** 寻找 ID 点击关闭或跳过，除非任务明确要求登录。
-           - **长页面**: 如果目标元素不在当前视野内（例如搜索结果在下方），请使用 `scroll` "down" 或 "bottom"（如果目标在页尾）。
-           - **完成态**: 如果页面内容已经完全满足【目标】，请立即返回 `done`。
-        3. **输入规范**: 对于 `type` 操作，`param`必须是完整的输入内容。
-
-        # 当前上下文
-        - **用户目标**: {goal}
-        - **当前小步骤**: {step}
-        - **历史操作**: {history_str}
-
-        # 动作空间 (Action Space)
-        - `click`: 点击元素。需提供 `target_id`。
-        - `type`: 输入文本。需提供 `target_id` 和 `param`(文本内容)。
-        - `scroll`: 滚动页面。`param` 为 "up", "down", "top" 或 "bottom"。无需 `target_id`。
-        - `navigate`: 访问URL。`param`为网址。无需 `target_id`。
-        - `back`: 浏览器后退。
-        - `hover`: 鼠标悬停。需提供 `target_id`。
-        - `done`: 任务完成。
-        - `fail`: 无法继续或发生错误。
-
-        # 输出格式 (JSON)
-        请进行简短的【分析与思考】，然后输出 JSON：
-        {{
-            "thought": "观察：当前是百度首页... 策略：点击ID=5。",
-            "action": "click",
-            "target_id": 5,
-            "param": null,
-            "confidence": 1.0
-        }}
-        """
+        prompt = PROMPT.build([
+            ("用户目标", goal),
+            ("当前小步骤", step),
+            ("历史操作", history_str),
+        ])
 
+        # Static instructions first (system) so the provider can cache the prefix
         messages = [
-            {"role": "system", "content": [{"text": "你是一个Web自动化测试代理。请根据截图和任务进行操作。"}]},
+            {"role": "system", "content": [{"text": PROMPT.instructions}]},
             {"role": "user", "content": [{"image": img_uri}, {"text": prompt}]}
         ]
 
-        print(f"[VisionStrategy] Calling Qwen-VL-Max (Timeout: 60s)...")
         try:
-            response = await asyncio.wait_for(
+            if PERCEPTION_STREAMING:
+                print(f"[VisionStrategy] Streaming Qwen-VL-Max (Timeout: 60s)...")
+                fields, content, time_to_action_ms = await asyncio.wait_for(
+                    self._stream_action(stream_generation(self.model, messages, idle_timeout=60.0, multimodal=True)),
+                    timeout=60.0
+                )
+                if os.path.exists(temp_img_path):
+                    os.remove(temp_img_path)
+                data = normalize_actions(fields) if fields else self._parse_json(content)
+                data["confidence"] = data.get("confidence", 0.9) # VL usually confident
+                data["time_to_action_ms"] = time_to_action_ms
+                print(f"[VisionStrategy] Action ready after {time_to_action_ms}ms{' (stopped early)' if fields else ''}")
+                return data
+
+            print(f"[VisionStrategy] Calling Qwen-VL-Max (Timeout: 60s)...")
+            content = await asyncio.wait_for(
                 asyncio.to_thread(self._call_api, messages),
                 timeout=60.0
             )
@@ -91,14 +111,9 @@ class VisionPerceptionStrategy(PerceptionStrategy):
             if os.path.exists(temp_img_path):
                 os.remove(temp_img_path)
 
-            if response.status_code == HTTPStatus.OK:
-                content = response.output.choices[0].message.content[0]['text']
-                data = self._parse_json(content)
-                data["confidence"] = data.get("confidence", 0.9) # VL usually confident
-                return data
-            else:
-                print(f"[VisionStrategy] Error: {response.code} - {response.message}")
-                return {"action": "fail", "thought": f"API Error: {response.message}", "confidence": 0.0}
+            data = self._parse_json(content)
+            data["confidence"] = data.get("confidence", 0.9) # VL usually confident
+            return data
 
         except asyncio.TimeoutError:
              print("[VisionStrategy] Timeout Error (60s)")
@@ -114,7 +129,7 @@ class VisionPerceptionStrategy(PerceptionStrategy):
     def _parse_json(self, content):
         try:
             content = content.replace("```json", "").replace("```", "").strip()
-            return json.loads(content)
+            return normalize_actions(json.loads(content))
         except Exception as e:
             print(f"[VisionStrategy] JSON Parse Failed: {content}")
             return {"action": "fail", "thought": "Failed to parse model output", "confidence": 0.0}
@@ -0,0 +1,340 @@
+"""
+End-to-end benchmark: runs DiandianAgent.process_command against the local
+fixture pages in benchmarks/fixtures with scripted model responses, and
+reports per-phase latency, aria snapshot size, SoM marking time, screenshot
+bytes and memory for each scenario.
+
+    python benchmarks/run.py                      # all scenarios, compare with baseline.json
+    python benchmarks/run.py form table --repeat 3
+    python benchmarks/run.py --latency-ms 800     # model latency to simulate
+    python benchmarks/run.py --network-profile lean  # compare with a "full" run for load time saved
+    python benchmarks/run.py --update-baseline    # store this run as the new baseline
+    python benchmarks/run.py --fail-on-regression # exit 1 when a metric regressed (CI)
+
+baseline.json is machine-specific and has to be recorded with --update-baseline
+on the machine that compares against it (Chromium installed); with
+--fail-on-regression, a scenario without a baseline fails the run.
+
+Models never leave the process: every call is answered from scenarios.json
+through llm.use_chunk_source, so runs are repeatable and free. The database
+and reports go to a temporary directory.
+"""
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import threading
+import functools
+from collections import Counter
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ENGINE_DIR = os.path.dirname(BENCH_DIR)
+FIXTURES_DIR = os.path.join(BENCH_DIR, "fixtures")
+SCENARIOS_FILE = os.path.join(BENCH_DIR, "scenarios.json")
+BASELINE_FILE = os.path.join(BENCH_DIR, "baseline.json")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# A metric regresses when it is this much worse than the baseline ...
+REGRESSION_TOLERANCE = 0.2
+# ... and by more than this absolute amount (keyed by metric suffix)
+REGRESSION_FLOORS = {"_ms": 50, "_bytes": 20000, "_chars": 2000, "_mb": 5}
+
+_STEP_RE = re.compile(r"^# (?:Current Step|当前小步骤)\n(.*?)(?:\n\n# |\Z)", re.MULTILINE | re.DOTALL)
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_fixtures():
+    """Serve the fixture pages on a free localhost port. Returns (server, base_url)."""
+    handler = functools.partial(_QuietHandler, directory=FIXTURES_DIR)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+class ScriptedModel:
+    """
+    Chunk source that answers planner / text / vision calls for the active
+    scenario. Responses are streamed in small chunks after `latency_ms`.
+    """
+    def __init__(self, text_instructions, latency_ms=0, chunk_ms=0, chunk_size=16):
+        self.text_instructions = text_instructions
+        self.latency_ms = latency_ms
+        self.chunk_ms = chunk_ms
+        self.chunk_size = chunk_size
+        self.scenario = None
+        self.resolve_target = None # "$first" / "$last" -> marker id
+        self.calls = Counter()
+
+    def use(self, scenario, resolve_target):
+        self.scenario = scenario
+        self.resolve_target = resolve_target
+
+    def _kind(self, messages, multimodal):
+        if multimodal:
+            return "vision"
+        if messages and messages[0].get("content") == self.text_instructions:
+            return "text"
+        return "planner"
+
+    @staticmethod
+    def _user_text(messages):
+        content = messages[-1].get("content")
+        if isinstance(content, list):
+            return "\n".join(part.get("text", "") for part in content)
+        return content or ""
+
+    def _response(self, kind, messages):
+        if kind == "planner":
+            return {"steps": [s["step"] for s in self.scenario["steps"]]}
+        match = _STEP_RE.search(self._user_text(messages))
+        step = match.group(1).strip() if match else ""
+        for entry in self.scenario["steps"]:
+            if entry["step"] == step:
+                response = entry.get(kind)
+                break
+        else:
+            response = None
+        if response is None:
+            return {"action": "fail", "confidence": 0.0, "thought": f"No scripted {kind} response"}
+        if isinstance(response.get("target_id"), str) and response["target_id"].startswith("$"):
+            response = {**response, "target_id": self.resolve_target(response["target_id"])}
+        return response
+
+    def __call__(self, model, messages, multimodal, stream):
+        kind = self._kind(messages, multimodal)
+        self.calls[kind] += 1
+        text = json.dumps(self._response(kind, messages), ensure_ascii=False)
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] if stream else [text]
+        for i, chunk in enumerate(chunks):
+            if i and self.chunk_ms:
+                time.sleep(self.chunk_ms / 1000)
+            yield "delta", chunk
+        yield "usage", {"input_tokens": 0, "output_tokens": len(text)}
+
+
+def _peak_rss_mb():
+    # ru_maxrss is KB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+async def _js_heap_mb(page):
+    try:
+        used = await page.evaluate("() => performance.memory ? performance.memory.usedJSHeapSize : null")
+        return round(used / (1024 * 1024), 1) if used else None
+    except Exception:
+        return None
+
+
+async def run_scenario(agent, model, name, scenario, base_url):
+    from run_history import RunRecorder
+    from agent import retrieval
+
+    scenario = {
+        **scenario,
+        "steps": [{**s, "step": s["step"].format(base=base_url)} for s in scenario["steps"]],
+    }
+
+    def resolve_target(ref):
+        ids = sorted(agent.som.marked_elements)
+        if not ids:
+            return None
+        return ids[0] if ref == "$first" else ids[-1]
+
+    model.use(scenario, resolve_target)
+    agent.metrics.reset()
+    routes_before = Counter(agent.executor.route_counts)
+    calls_before = Counter(model.calls)
+    retrieval_before = Counter(retrieval.stats)
+    recorder = RunRecorder(task=scenario["task"])
+
+    start = time.perf_counter()
+    await agent.process_command(scenario["task"], recorder=recorder)
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    summary = agent.metrics.summary()
+    timings, sizes = summary["timings_ms"], summary["sizes"]
+
+    # Scenarios with "expect_filtered" (large trees) must get every L1 call a filtered tree
+    retrieval_counts = dict(Counter(retrieval.stats) - retrieval_before)
+    retrieval_ok = not scenario.get("expect_filtered") or (
+        retrieval_counts.get("filtered", 0) > 0 and not retrieval_counts.get("low_coverage")
+    )
+
+    def p50(source, key):
+        return source[key]["p50"] if key in source else None
+
+    def peak(source, key):
+        return source[key]["max"] if key in source else None
+
+    return {
+        "scenario": name,
+        "passed": bool(recorder.steps) and all(s["status"] == "PASS" for s in recorder.steps) and retrieval_ok,
+        "steps": [{k: s[k] for k in ("name", "status", "strategy", "attempts", "duration_ms")} for s in recorder.steps],
+        "routes": dict(Counter(agent.executor.route_counts) - routes_before),
+        "model_calls": dict(Counter(model.calls) - calls_before),
+        "retrieval": retrieval_counts,
+        "metrics": {
+            "wall_ms": round(wall_ms, 1),
+            "plan_first_step_ms": p50(timings, "plan_first_step"),
+            "step_p50_ms": p50(timings, "step"),
+            "perceive_p50_ms": p50(timings, "perceive"),
+            "som_mark_p50_ms": p50(timings, "som_mark"),
+            "som_overlay_p50_ms": p50(timings, "som_overlay"),
+            "screenshot_p50_ms": p50(timings, "screenshot"),
+            "aria_snapshot_p50_ms": p50(timings, "aria_snapshot"),
+            "action_p50_ms": p50(timings, "action"),
+            "aria_snapshot_max_chars": peak(sizes, "aria_snapshot_chars"),
+            "screenshot_max_bytes": peak(sizes, "screenshot_bytes"),
+            "js_heap_mb": await _js_heap_mb(agent.browser.page),
+            "python_peak_rss_mb": _peak_rss_mb(),
+        },
+        "network": agent.browser.network.summary(),
+        "phases": summary,
+    }
+
+
+def _merge_repeats(runs):
+    """Median of each metric over the repeats of one scenario."""
+    merged = dict(runs[0])
+    merged["passed"] = all(r["passed"] for r in runs)
+    merged["repeats"] = len(runs)
+    metrics = {}
+    for key in runs[0]["metrics"]:
+        values = sorted(r["metrics"][key] for r in runs if r["metrics"][key] is not None)
+        metrics[key] = values[len(values) // 2] if values else None
+    merged["metrics"] = metrics
+    return merged
+
+
+async def run_all(names, repeat, latency_ms, chunk_ms, headless, network_profile=None):
+    from agent import llm
+    from agent.core import DiandianAgent
+    from agent.strategies.text import PROMPT as TEXT_PROMPT
+    from database import create_db_and_tables
+
+    with open(SCENARIOS_FILE, "r", encoding="utf-8") as f:
+        scenarios = json.load(f)
+    unknown = [n for n in names if n not in scenarios]
+    if unknown:
+        raise SystemExit(f"Unknown scenario(s): {', '.join(unknown)} (have: {', '.join(scenarios)})")
+
+    create_db_and_tables()
+    server, base_url = serve_fixtures()
+    model = ScriptedModel(TEXT_PROMPT.instructions, latency_ms=latency_ms, chunk_ms=chunk_ms)
+    llm.use_chunk_source(model)
+
+    agent = DiandianAgent()
+    agent.update_env_config("BASE_URL", base_url)
+    await agent.browser.start(headless=headless)
+    await agent.browser.set_network_profile(network_profile)
+    results = []
+    try:
+        for name in names or list(scenarios):
+            runs = [await run_scenario(agent, model, name, scenarios[name], base_url) for _ in range(repeat)]
+            results.append(_merge_repeats(runs))
+    finally:
+        llm.use_chunk_source(None)
+        await agent.browser.stop()
+        server.shutdown()
+    return results
+
+
+def compare(results, baseline):
+    """Returns [(metric, baseline, current)] for metrics that regressed."""
+    regressions = []
+    for result in results:
+        base = baseline.get(result["scenario"], {})
+        for key, current in result["metrics"].items():
+            previous = base.get(key)
+            if current is None or previous is None:
+                continue
+            floor = next((v for suffix, v in REGRESSION_FLOORS.items() if key.endswith(suffix)), 0)
+            if current > previous * (1 + REGRESSION_TOLERANCE) and current - previous > floor:
+                regressions.append((f"{result['scenario']}.{key}", previous, current))
+    return regressions
+
+
+def print_table(results, baseline):
+    for result in results:
+        status = "PASS" if result["passed"] else "FAIL"
+        print(f"\n== {result['scenario']} [{status}] x{result['repeats']}  routes={result['routes']}  calls={result['model_calls']}")
+        if result["retrieval"]:
+            print(f"   aria retrieval: {result['retrieval']}")
+        network = result["network"]
+        if network["profile"] != "full":
+            print(f"   network: {network['profile']}, {network['requests_skipped']} skipped, ~{network['estimated_bytes_saved']} bytes saved")
+        base = baseline.get(result["scenario"], {})
+        for key, value in result["metrics"].items():
+            previous = base.get(key)
+            delta = ""
+            if value is not None and previous:
+                delta = f"  ({(value - previous) / previous:+.0%} vs {previous})"
+            print(f"   {key:<26} {value if value is not None else '-'}{delta}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DianDian end-to-end benchmark over local fixture pages")
+    parser.add_argument("scenarios", nargs="*", help="scenario names (default: all)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per scenario; metrics are the median")
+    parser.add_argument("--latency-ms", type=int, default=0, help="simulated model latency before the first chunk")
+    parser.add_argument("--chunk-ms", type=int, default=0, help="simulated delay between streamed chunks")
+    parser.add_argument("--headed", action="store_true", help="show the browser")
+    parser.add_argument("--network-profile", default=None, help="request interception profile (browser/network.py)")
+    parser.add_argument("--update-baseline", action="store_true", help="save this run as baseline.json")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit 1 when a metric regressed or a scenario has no baseline")
+    args = parser.parse_args()
+
+    # Keep benchmark runs out of the real database and reports folder
+    workdir = tempfile.mkdtemp(prefix="diandian-bench-")
+    os.environ["DIANDIAN_REPORTS_DIR"] = os.path.join(workdir, "reports")
+    os.chdir(workdir)
+    sys.path.insert(0, ENGINE_DIR)
+
+    results = asyncio.run(run_all(args.scenarios, max(1, args.repeat), args.latency_ms, args.chunk_ms, not args.headed, args.network_profile))
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    print_table(results, baseline)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(RESULTS_DIR, "latest.json"), "w", encoding="utf-8") as f:
+        json.dump({"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}, f, ensure_ascii=False, indent=1)
+
+    if args.update_baseline:
+        baseline.update({r["scenario"]: r["metrics"] for r in results})
+        with open(BASELINE_FILE, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=1)
+        print(f"\n[Bench] Baseline updated: {BASELINE_FILE}")
+        return
+
+    regressions = compare(results, baseline)
+    missing = [r["scenario"] for r in results if r["scenario"] not in baseline]
+    if missing:
+        print(f"\n[Bench] No baseline for: {', '.join(missing)}; run with --update-baseline to store one")
+    for metric, previous, current in regressions:
+        print(f"[Bench] REGRESSION {metric}: {previous} -> {current}")
+    failed = [r["scenario"] for r in results if not r["passed"]]
+    if failed:
+        print(f"[Bench] Scenarios with failed steps: {', '.join(failed)}")
+    if args.fail_on_regression and (regressions or failed or missing):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,15 @@
 from playwright.async_api import async_playwright
+import os
+import asyncio
 import base64
+from .network import RequestFilter
+from .http_cache import HttpCache, HTTP_CACHE_ENABLED
+from .memory import MemoryMonitor
+
+# Load BASE_URL in the background while the plan is being generated
+PREWARM_NAVIGATION = os.getenv("DIANDIAN_PREWARM", "on").lower() not in ("0", "off", "false")
+# How long a step waits for a pending prewarm before inspecting the page anyway
+PREWARM_WAIT_S = float(os.getenv("DIANDIAN_PREWARM_WAIT_S", "5"))
 
 # Device Presets
 DEVICE_PRESETS = {
@@ -41,6 +51,13 @@ class BrowserController:
         self.page: Page = None
         self._is_running = False
         self.current_config = DEVICE_PRESETS["desktop"]
+        self.network = RequestFilter() # request interception profile (browser/network.py)
+        self.storage_state = None # cookies/localStorage new contexts start from (browser/storage_state.py)
+        self.http_cache = HttpCache() if HTTP_CACHE_ENABLED else None
+        self._prewarm = None # (url, task) of a background navigation
+        self.prewarm_stats = {"started": 0, "used": 0}
+        self.memory = MemoryMonitor()
+        self.selector_engines = {} # name -> script, registered on every Playwright start
 
     async def start(self, headless=False):
         """Starts the browser instance."""
@@ -49,6 +66,9 @@ class BrowserController:
         
         print("Initializing Playwright...")
         self.playwright = await async_playwright().start()
+        # Must happen before the first context is created
+        for name, script in self.selector_engines.items():
+            await self.playwright.selectors.register(name, script=script)
         # Launch Chromium (can be configured)
         self.browser = await self.playwright.chromium.launch(headless=headless)
         
@@ -57,9 +77,13 @@ class BrowserController:
         self._is_running = True
         print("Browser started successfully.")
 
-    async def _create_context(self):
-        """Creates a new browser context with the current config."""
+    async def _create_context(self, storage_state=None):
+        """
+        Creates a new browser context with the current config, starting from
+        `storage_state` (default: the configured snapshot, if any).
+        """
         if self.context:
+            # Closing the context releases every handle and renderer it held
             await self.context.close()
 
         print(f"Creating context with config: {self.current_config['viewport']}")
@@ -68,9 +92,18 @@ class BrowserController:
             user_agent=self.current_config.get("user_agent"),
             device_scale_factor=self.current_config.get("device_scale_factor", 1),
             is_mobile=self.current_config.get("is_mobile", False),
-            has_touch=self.current_config.get("has_touch", False)
+            has_touch=self.current_config.get("has_touch", False),
+            storage_state=storage_state or self.storage_state
         )
+        self._prewarm = None
+        self.memory.reset_page()
+        # Handlers registered later run first: the request filter decides what
+        # to skip, then falls back to the shared disk cache
+        if self.http_cache:
+            await self.http_cache.attach(self.context)
+        await self.network.attach(self.context)
         self.page = await self.context.new_page()
+        self.network.watch(self.page)
 
     async def restart_with_config(self, preset_name: str):
         """Restarts the browser context with a new preset."""
@@ -85,6 +118,104 @@ class BrowserController:
             await self._create_context()
             print("Browser context re-initialized.")
 
+    async def recycle_if_needed(self):
+        """
+        Called between commands / cases (never mid-case: sessionStorage, page
+        state and open dialogs would be lost): replace the context when it
+        crossed a memory ceiling (browser/memory.py). Returns True if `page` changed.
+        """
+        if not self._is_running or not self.page:
+            return False
+        reason = await self.memory.over_ceiling(self.browser, self.context, self.page)
+        if not reason:
+            return False
+        await self.recycle_context(reason)
+        return True
+
+    async def recycle_context(self, reason=""):
+        """Fresh context with the current cookies/localStorage, back on the same URL."""
+        url = self.page.url if self.page else ""
+        print(f"[Browser] Recycling context ({reason})")
+        state = await self.context.storage_state()
+        await self._create_context(storage_state=state)
+        self.memory.recycled()
+        if url.startswith("http"):
+            try:
+                await self.page.goto(url, wait_until="domcontentloaded", timeout=30000)
+            except Exception as e:
+                print(f"[Browser] Reopening {url} after recycle failed: {e}")
+
+    async def use_storage_state(self, state):
+        """
+        Start a fresh context from `state` (None: empty context). Every context
+        created until it is reset again starts from it, so callers scope it.
+        """
+        self.storage_state = state
+        if self._is_running:
+            await self._create_context()
+        else:
+            await self.start()
+
+    async def export_storage_state(self):
+        """Cookies and localStorage of the current context."""
+        return await self.context.storage_state()
+
+    async def set_network_profile(self, name: str = None):
+        """Switch the request interception profile (None: DIANDIAN_NETWORK_PROFILE)."""
+        await self.network.set_profile(name)
+
+    def prewarm(self, url: str):
+        """
+        Start loading `url` on the blank page without waiting for it. A later
+        navigate() to the same URL reuses the load instead of starting over.
+        """
+        if not PREWARM_NAVIGATION or not url or not self.page or self.page.url != "about:blank":
+            return
+        if not url.startswith('http'):
+            url = 'https://' + url
+        print(f"[Browser] Prewarming: {url}")
+        task = asyncio.create_task(self.page.goto(url, wait_until="domcontentloaded", timeout=30000))
+        # Consume the exception of a prewarm nobody awaits (e.g. superseded by another goto)
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._prewarm = (url, task)
+        self.prewarm_stats["started"] += 1
+
+    async def wait_prewarm(self, timeout=PREWARM_WAIT_S):
+        """
+        Give a pending prewarm up to `timeout` seconds to finish before the page
+        is inspected. A slow load keeps going: navigate() can still take it over.
+        """
+        if not self._prewarm:
+            return
+        task = self._prewarm[1]
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            print(f"[Browser] Prewarm still loading after {timeout}s, not waiting for it")
+        except Exception:
+            if self._prewarm and self._prewarm[1] is task:
+                self._prewarm = None
+
+    def forget_prewarm(self):
+        """The page was interacted with: a later navigate() must load it again."""
+        self._prewarm = None
+
+    async def _take_prewarm(self, url):
+        """True if a prewarmed load of `url` is (or becomes) the current page."""
+        if not self._prewarm:
+            return False
+        prewarm_url, task = self._prewarm
+        self._prewarm = None
+        if prewarm_url.rstrip("/") != url.rstrip("/"):
+            return False
+        try:
+            await task
+        except Exception as e:
+            print(f"[Browser] Prewarm failed, navigating again: {e}")
+            return False
+        self.prewarm_stats["used"] += 1
+        return True
+
     async def navigate(self, url: str):
 
         """Navigates to the specified URL."""
@@ -94,10 +225,16 @@ class BrowserController:
         # Ensure URL has schema
         if not url.startswith('http'):
             url = 'https://' + url
+
+        if await self._take_prewarm(url):
+            print(f"Navigated to: {url} (prewarmed)")
+            await self.network.record_navigation(self.page)
+            return True
             
         print(f"Navigating to: {url}")
         try:
             await self.page.goto(url, wait_until="domcontentloaded", timeout=30000)
+            await self.network.record_navigation(self.page)
             return True
         except Exception as e:
             print(f"Navigation failed: {e}")
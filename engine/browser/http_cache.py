@@ -0,0 +1,230 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import tempfile
+from email.utils import parsedate_to_datetime
+
+# Shared across browser contexts and engine restarts
+HTTP_CACHE_ENABLED = os.getenv("DIANDIAN_HTTP_CACHE", "on").lower() not in ("0", "off", "false")
+CACHE_DIR = os.getenv(
+    "DIANDIAN_HTTP_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "http_cache")
+)
+MAX_CACHE_MB = int(os.getenv("DIANDIAN_HTTP_CACHE_MB", "300"))
+
+# Only static subresources; documents and XHR always go to the network
+CACHEABLE_TYPES = ("script", "stylesheet", "image", "font")
+# The body is stored decoded, so these no longer describe it
+_DROP_HEADERS = ("content-encoding", "content-length", "transfer-encoding", "connection")
+# Responses to these are per user: never served from or written to the shared cache
+_CREDENTIAL_HEADERS = ("cookie", "authorization")
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+def _freshness(headers):
+    """
+    (storable, ttl seconds) from the response headers. Responses with only a
+    validator (ETag / Last-Modified) are stored with ttl 0 and revalidated.
+    """
+    cache_control = headers.get("cache-control", "").lower()
+    if "no-store" in cache_control or "private" in cache_control or headers.get("vary", "") == "*":
+        return False, 0
+    if headers.get("set-cookie"):
+        return False, 0
+    if "no-cache" in cache_control:
+        ttl = 0
+    elif match := _MAX_AGE_RE.search(cache_control):
+        ttl = int(match.group(1))
+    elif headers.get("expires"):
+        try:
+            ttl = max(0, int(parsedate_to_datetime(headers["expires"]).timestamp() - time.time()))
+        except (TypeError, ValueError):
+            ttl = 0
+    else:
+        ttl = 0
+    storable = ttl > 0 or bool(headers.get("etag") or headers.get("last-modified"))
+    return storable, ttl
+
+
+class HttpCache:
+    """
+    On-disk cache for static subresources, applied through context routing.
+    Playwright contexts are incognito-like, so Chromium's own disk cache never
+    survives a context; this one is shared by every context and run, so requests
+    with credentials bypass it and entries are keyed on their Vary headers.
+    """
+    def __init__(self, root=None, max_mb=None):
+        self.root = root or CACHE_DIR
+        self.max_bytes = (max_mb or MAX_CACHE_MB) * 1024 * 1024
+        self._size = None # bytes on disk, computed on first store
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.bytes_served = 0
+
+    async def attach(self, context):
+        await context.route("**/*", self._handle)
+
+    def _base(self, material):
+        digest = hashlib.sha256(material.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _paths(self, key):
+        base = self._base(key)
+        return base + ".json", base + ".body"
+
+    def _key(self, url, request_headers, vary=None):
+        """
+        Entry key: the URL plus the request headers its response varies on.
+        Without `vary`, the Vary names last stored for the URL are used.
+        """
+        if vary is None:
+            try:
+                with open(self._base(url) + ".vary", "r", encoding="utf-8") as f:
+                    vary = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                vary = []
+        return url + "".join(f"\n{name}: {request_headers.get(name, '')}" for name in vary)
+
+    def _load(self, key):
+        meta_path, body_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                return meta, f.read()
+        except (OSError, json.JSONDecodeError):
+            return None, None
+
+    def _store(self, url, request_headers, status, headers, body, ttl):
+        vary_header = next((v for k, v in headers.items() if k.lower() == "vary"), "")
+        vary = sorted({name.strip().lower() for name in vary_header.split(",") if name.strip()})
+        vary_path = self._base(url) + ".vary"
+        os.makedirs(os.path.dirname(vary_path), exist_ok=True)
+        with open(vary_path, "w", encoding="utf-8") as f:
+            json.dump(vary, f)
+        meta_path, body_path = self._paths(self._key(url, request_headers, vary))
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        meta = {
+            "url": url,
+            "status": status,
+            "headers": {k: v for k, v in headers.items() if k.lower() not in _DROP_HEADERS},
+            "stored_at": time.time(),
+            "ttl": ttl,
+        }
+        for path, data, mode in ((body_path, body, "wb"), (meta_path, json.dumps(meta).encode("utf-8"), "wb")):
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, mode) as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        if self._size is None:
+            self._size = self._disk_usage()
+        else:
+            self._size += len(body)
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _touch(self, key, ttl):
+        """A 304 renews the stored entry."""
+        meta, _ = self._load(key)
+        if meta is None:
+            return
+        meta["stored_at"], meta["ttl"] = time.time(), ttl
+        meta_path, _ = self._paths(key)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+    def _bodies(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".body"):
+                    path = os.path.join(dirpath, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, stat.st_size, stat.st_mtime
+
+    def _disk_usage(self):
+        return sum(size for _, size, _ in self._bodies())
+
+    def _evict(self):
+        """Drop least recently stored entries until the cache is at 80% of its limit."""
+        entries = sorted(self._bodies(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.8
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            for victim in (path, path[:-len(".body")] + ".json"):
+                try:
+                    os.remove(victim)
+                except OSError:
+                    pass
+            total -= size
+        self._size = total
+
+    async def _handle(self, route):
+        request = route.request
+        if request.method != "GET" or request.resource_type not in CACHEABLE_TYPES or not request.url.startswith("http"):
+            await route.fallback()
+            return
+
+        url = request.url
+        request_headers = await request.all_headers()
+        if any(request_headers.get(name) for name in _CREDENTIAL_HEADERS):
+            await route.fallback()
+            return
+        key = await asyncio.to_thread(self._key, url, request_headers)
+        meta, body = await asyncio.to_thread(self._load, key)
+        if meta is not None and time.time() - meta["stored_at"] < meta["ttl"]:
+            self.hits += 1
+            self.bytes_served += len(body)
+            await route.fulfill(status=meta["status"], headers=meta["headers"], body=body)
+            return
+
+        headers = dict(request.headers)
+        if meta is not None:
+            stored = {k.lower(): v for k, v in meta["headers"].items()}
+            if stored.get("etag"):
+                headers["if-none-match"] = stored["etag"]
+            if stored.get("last-modified"):
+                headers["if-modified-since"] = stored["last-modified"]
+        try:
+            response = await route.fetch(headers=headers)
+        except Exception:
+            await route.fallback()
+            return
+
+        if response.status == 304 and meta is not None:
+            self.revalidated += 1
+            self.bytes_served += len(body)
+            _, ttl = _freshness(response.headers)
+            await asyncio.to_thread(self._touch, key, ttl)
+            await route.fulfill(status=meta["status"], headers=meta["headers"], body=body)
+            return
+
+        self.misses += 1
+        body = await response.body()
+        storable, ttl = _freshness(response.headers)
+        if response.status == 200 and storable:
+            try:
+                await asyncio.to_thread(self._store, url, request_headers, response.status, response.headers, body, ttl)
+            except OSError as e:
+                print(f"[HttpCache] Store failed: {e}")
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in _DROP_HEADERS}
+        await route.fulfill(status=response.status, headers=headers, body=body)
+
+    def stats(self):
+        requests = self.hits + self.revalidated + self.misses
+        return {
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.revalidated) / requests, 3) if requests else None,
+            "bytes_served": self.bytes_served,
+            "disk_bytes": self._size,
+        }
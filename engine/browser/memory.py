@@ -0,0 +1,133 @@
+import os
+import sys
+import time
+
+try:
+    import psutil
+except ImportError:  # optional: /proc is read directly on Linux
+    psutil = None
+
+MB = 1024 * 1024
+
+# A context above either ceiling is recycled before the next command or case (0 disables)
+HEAP_CEILING_MB = float(os.getenv("DIANDIAN_CONTEXT_HEAP_CEILING_MB", "768"))
+RSS_CEILING_MB = float(os.getenv("DIANDIAN_CONTEXT_RSS_CEILING_MB", "2048"))
+# Minimum time between two samples
+CHECK_INTERVAL_S = float(os.getenv("DIANDIAN_MEMORY_CHECK_INTERVAL_S", "30"))
+# Minimum time between two recycles (a page that is big right after loading would
+# otherwise be recycled before every command)
+MIN_RECYCLE_INTERVAL_S = float(os.getenv("DIANDIAN_MIN_RECYCLE_INTERVAL_S", "300"))
+
+
+def process_rss_mb(pid):
+    """Resident memory of a process in MB, None when it cannot be read."""
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss / MB
+        except psutil.Error:
+            return None
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        return None
+    return None
+
+
+class MemoryMonitor:
+    """
+    Samples the JS heap of the active page (CDP Performance.getMetrics) and the
+    RSS of Chromium's renderer processes (CDP SystemInfo + /proc or psutil).
+    Every context has a single page here, so the renderers belong to it.
+    """
+    def __init__(self):
+        self._page = None
+        self._page_cdp = None
+        self._browser_cdp = None
+        self._last_check = 0.0
+        self._last_recycle = None
+        self.last = None
+        self.peak = {"js_heap_mb": 0.0, "renderer_rss_mb": 0.0}
+        self.samples = 0
+        self.recycles = 0
+
+    async def _js_heap_mb(self, context, page):
+        try:
+            if self._page is not page:
+                self._page_cdp = await context.new_cdp_session(page)
+                await self._page_cdp.send("Performance.enable")
+                self._page = page
+            result = await self._page_cdp.send("Performance.getMetrics")
+        except Exception:
+            self._page = None  # not Chromium, or the page is gone
+            return None
+        for metric in result.get("metrics", []):
+            if metric["name"] == "JSHeapUsedSize":
+                return metric["value"] / MB
+        return None
+
+    async def _renderer_rss_mb(self, browser):
+        try:
+            if self._browser_cdp is None:
+                self._browser_cdp = await browser.new_browser_cdp_session()
+            info = await self._browser_cdp.send("SystemInfo.getProcessInfo")
+        except Exception:
+            self._browser_cdp = None
+            return None
+        pids = [p["id"] for p in info.get("processInfo", []) if p.get("type") == "renderer"]
+        values = [v for v in (process_rss_mb(pid) for pid in pids) if v is not None]
+        return sum(values) if values else None
+
+    async def sample(self, browser, context, page):
+        js_heap = await self._js_heap_mb(context, page)
+        renderer_rss = await self._renderer_rss_mb(browser)
+        self.samples += 1
+        self.last = {
+            "js_heap_mb": round(js_heap, 1) if js_heap is not None else None,
+            "renderer_rss_mb": round(renderer_rss, 1) if renderer_rss is not None else None,
+            "at": time.time(),
+        }
+        for key in self.peak:
+            if self.last[key] is not None:
+                self.peak[key] = max(self.peak[key], self.last[key])
+        return self.last
+
+    async def over_ceiling(self, browser, context, page):
+        """
+        Sample (at most every CHECK_INTERVAL_S, and not within MIN_RECYCLE_INTERVAL_S
+        of the last recycle); returns why the context is too big, or None.
+        """
+        now = time.monotonic()
+        if now - self._last_check < CHECK_INTERVAL_S:
+            return None
+        if self._last_recycle is not None and now - self._last_recycle < MIN_RECYCLE_INTERVAL_S:
+            return None
+        self._last_check = now
+        sample = await self.sample(browser, context, page)
+        if HEAP_CEILING_MB and (sample["js_heap_mb"] or 0) > HEAP_CEILING_MB:
+            return f"JS heap {sample['js_heap_mb']}MB > {HEAP_CEILING_MB:g}MB"
+        if RSS_CEILING_MB and (sample["renderer_rss_mb"] or 0) > RSS_CEILING_MB:
+            return f"renderer RSS {sample['renderer_rss_mb']}MB > {RSS_CEILING_MB:g}MB"
+        return None
+
+    def reset_page(self):
+        """A new context/page: the CDP sessions of the old one are gone."""
+        self._page = None
+        self._page_cdp = None
+
+    def recycled(self):
+        self.recycles += 1
+        self._last_recycle = time.monotonic()
+
+    def stats(self):
+        return {
+            "last": self.last,
+            "peak": self.peak,
+            "samples": self.samples,
+            "recycles": self.recycles,
+            "ceilings_mb": {"js_heap": HEAP_CEILING_MB, "renderer_rss": RSS_CEILING_MB},
+        }
@@ -0,0 +1,200 @@
+import os
+import base64
+from collections import Counter
+from urllib.parse import urlsplit
+
+# Third-party analytics / ad hosts, blocked by every profile except "full"
+TRACKER_DOMAINS = (
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com",
+    "facebook.net", "connect.facebook.net", "hotjar.com", "segment.io", "mixpanel.com",
+    "hm.baidu.com", "cnzz.com", "growingio.com", "sensorsdata.cn", "clarity.ms",
+)
+
+# block: aborted; stub: answered locally with an empty body of the right type.
+# Images are stubbed rather than blocked so onload handlers and layout code still run.
+NETWORK_PROFILES = {
+    # Everything loads (no routing at all)
+    "full": {"block": (), "stub": (), "block_domains": (), "vision_full_fidelity": False},
+    # Text perception only needs the DOM: drop media, fonts and trackers, stub images
+    "lean": {"block": ("media", "font"), "stub": ("image",), "block_domains": TRACKER_DOMAINS, "vision_full_fidelity": True},
+    # Also drop images outright and skip reloading them for vision
+    "minimal": {"block": ("media", "font", "image"), "stub": (), "block_domains": TRACKER_DOMAINS, "vision_full_fidelity": False},
+}
+DEFAULT_NETWORK_PROFILE = os.getenv("DIANDIAN_NETWORK_PROFILE", "full")
+
+# Rough transfer size per skipped request, for the "bytes saved" estimate
+ESTIMATED_BYTES = {"image": 40_000, "media": 500_000, "font": 35_000, "script": 25_000, "stylesheet": 15_000}
+ESTIMATED_BYTES_OTHER = 5_000
+
+VISUAL_TYPES = ("image", "media", "font")
+
+_PIXEL_GIF = base64.b64decode("R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7")
+
+# Re-request images that were stubbed or blocked, wait (bounded) for them to load
+_RELOAD_IMAGES_JS = """
+(timeout) => {
+    const pending = [];
+    for (const img of document.images) {
+        const src = img.currentSrc || img.src;
+        if (!src || (img.complete && img.naturalWidth > 1)) continue;
+        pending.push(new Promise((resolve) => {
+            img.addEventListener("load", resolve, { once: true });
+            img.addEventListener("error", resolve, { once: true });
+        }));
+        img.src = "";
+        img.src = src;
+    }
+    return Promise.race([
+        Promise.all(pending),
+        new Promise((resolve) => setTimeout(resolve, timeout)),
+    ]).then(() => pending.length);
+}
+"""
+
+_NAVIGATION_TIMING_JS = """
+() => {
+    const nav = performance.getEntriesByType("navigation")[0];
+    if (!nav) return null;
+    return {
+        dom_content_loaded_ms: Math.round(nav.domContentLoadedEventEnd - nav.startTime),
+        transferred_bytes: nav.transferSize + performance.getEntriesByType("resource")
+            .reduce((sum, r) => sum + (r.transferSize || 0), 0),
+    };
+}
+"""
+
+
+def _host_matches(host, domains):
+    return any(host == d or host.endswith("." + d) for d in domains)
+
+
+class RequestFilter:
+    """
+    Applies a network profile to a browser context through Playwright routing
+    and counts what it skipped. `full_fidelity` lets everything through
+    (set while a step is handled by vision on a profile that allows it).
+    """
+    def __init__(self, profile=None):
+        self.profile_name = self._resolve(profile or DEFAULT_NETWORK_PROFILE)
+        self.full_fidelity = False
+        self._context = None
+        self._routed = False
+        self.visual_skipped = 0 # on the current document
+        self.reset_run()
+
+    @staticmethod
+    def _resolve(name):
+        if name not in NETWORK_PROFILES:
+            print(f"[Network] Unknown profile: {name}, falling back to full.")
+            return "full"
+        return name
+
+    @property
+    def profile(self):
+        return NETWORK_PROFILES[self.profile_name]
+
+    def reset_run(self):
+        self.blocked = Counter()  # resource type -> count
+        self.stubbed = Counter()
+        self.bytes_saved = 0
+        self.navigations = []     # [{"url", "dom_content_loaded_ms", "transferred_bytes"}]
+        self.vision_reloads = 0
+
+    async def attach(self, context):
+        """Route requests of a (new) context according to the current profile."""
+        self._context = context
+        self._routed = False
+        await self._sync_route()
+
+    async def set_profile(self, name):
+        self.profile_name = self._resolve(name or DEFAULT_NETWORK_PROFILE)
+        self.full_fidelity = False
+        print(f"[Network] Profile: {self.profile_name}")
+        await self._sync_route()
+
+    async def _sync_route(self):
+        if self._context is None:
+            return
+        wants_route = self.profile_name != "full"
+        if wants_route and not self._routed:
+            await self._context.route("**/*", self._handle)
+        elif not wants_route and self._routed:
+            await self._context.unroute("**/*", self._handle)
+        self._routed = wants_route
+
+    def watch(self, page):
+        """Reset the per-document counters whenever the main frame navigates."""
+        def on_navigated(frame):
+            if frame == page.main_frame:
+                self.visual_skipped = 0
+        page.on("framenavigated", on_navigated)
+
+    async def _handle(self, route):
+        request = route.request
+        profile = self.profile
+        # fallback(): hand over to the next route handler (the HTTP cache), else the network
+        if self.full_fidelity or request.resource_type == "document":
+            await route.fallback()
+            return
+
+        kind = request.resource_type
+        host = urlsplit(request.url).hostname or ""
+        if _host_matches(host, profile["block_domains"]) or kind in profile["block"]:
+            self._skipped(kind, self.blocked)
+            await route.abort("blockedbyclient")
+        elif kind in profile["stub"]:
+            self._skipped(kind, self.stubbed)
+            await route.fulfill(status=200, content_type="image/gif", body=_PIXEL_GIF)
+        else:
+            await route.fallback()
+
+    def _skipped(self, kind, counter):
+        counter[kind] += 1
+        self.bytes_saved += ESTIMATED_BYTES.get(kind, ESTIMATED_BYTES_OTHER)
+        if kind in VISUAL_TYPES:
+            self.visual_skipped += 1
+
+    async def restore_for_vision(self, page):
+        """
+        Before a vision call: if the profile allows it and this document had images
+        skipped, let everything through for the rest of the step and reload them.
+        Returns True when the page changed (the caller should recapture).
+        """
+        if self.full_fidelity or not self.profile["vision_full_fidelity"] or not self.visual_skipped:
+            return False
+        self.full_fidelity = True
+        try:
+            reloaded = await page.evaluate(_RELOAD_IMAGES_JS, 3000)
+        except Exception as e:
+            print(f"[Network] Image reload failed: {e}")
+            return False
+        self.visual_skipped = 0
+        self.vision_reloads += 1
+        print(f"[Network] Full fidelity for vision: reloaded {reloaded} images")
+        return bool(reloaded)
+
+    def end_step(self):
+        self.full_fidelity = False
+
+    async def record_navigation(self, page):
+        try:
+            timing = await page.evaluate(_NAVIGATION_TIMING_JS)
+        except Exception:
+            timing = None
+        if timing:
+            self.navigations.append({"url": page.url, **timing})
+
+    def summary(self):
+        """Per-run totals, reported with the run."""
+        loads = [n["dom_content_loaded_ms"] for n in self.navigations if n.get("dom_content_loaded_ms")]
+        return {
+            "profile": self.profile_name,
+            "blocked": dict(self.blocked),
+            "stubbed": dict(self.stubbed),
+            "requests_skipped": sum(self.blocked.values()) + sum(self.stubbed.values()),
+            "estimated_bytes_saved": self.bytes_saved,
+            "transferred_bytes": sum(n.get("transferred_bytes") or 0 for n in self.navigations),
+            "navigations": len(self.navigations),
+            "avg_dom_content_loaded_ms": int(sum(loads) / len(loads)) if loads else None,
+            "vision_reloads": self.vision_reloads,
+        }
@@ -0,0 +1,213 @@
+import os
+import re
+import json
+import time
+import tempfile
+from urllib.parse import urlparse
+
+# Named storage-state snapshots (cookies + localStorage), one JSON file each
+STATE_DIR = os.getenv(
+    "DIANDIAN_STORAGE_STATE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "storage_states")
+)
+# Snapshots older than this are refreshed even if no cookie says so
+MAX_AGE_HOURS = float(os.getenv("DIANDIAN_STORAGE_STATE_MAX_AGE_HOURS", "12"))
+# Treat a cookie as expired this long before its actual expiry
+EXPIRY_MARGIN_S = 300
+# Cookies living shorter than this after capture (analytics throttles like _gat)
+# say nothing about the login and are ignored for the snapshot's expiry
+SHORT_LIVED_S = 900
+
+_NAME_RE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+def state_path(name, root=None):
+    return os.path.join(root or STATE_DIR, _NAME_RE.sub("_", name) + ".json")
+
+
+def load(name, root=None):
+    path = state_path(name, root)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"[StorageState] Unreadable snapshot {name}: {e}")
+        return None
+
+
+def save(name, state, setup_case_id=None, login_check=None, root=None):
+    """
+    state: Playwright storage_state() dict ({"cookies": [...], "origins": [...]}).
+    login_check: optional {"url", "logged_out_pattern", "session_cookie"} used to
+    validate the snapshot; its url host (or session_cookie) selects the cookies
+    whose expiry counts.
+    """
+    path = state_path(name, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    created_at = time.time()
+    record = {
+        "name": name,
+        "setup_case_id": setup_case_id,
+        "login_check": login_check,
+        "created_at": created_at,
+        "expires_at": cookie_expiry(state, login_check, now=created_at),
+        "state": state,
+    }
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    print(f"[StorageState] Saved '{name}' ({len(state.get('cookies', []))} cookies, {len(state.get('origins', []))} origins)")
+    return record
+
+
+def delete(name, root=None):
+    path = state_path(name, root)
+    if os.path.exists(path):
+        os.remove(path)
+        return True
+    return False
+
+
+def list_states(root=None):
+    """Snapshot metadata without the cookies themselves."""
+    root = root or STATE_DIR
+    if not os.path.isdir(root):
+        return []
+    states = []
+    for filename in sorted(os.listdir(root)):
+        if not filename.endswith(".json"):
+            continue
+        record = load(filename[:-5], root)
+        if record:
+            states.append({
+                "name": record["name"],
+                "setup_case_id": record.get("setup_case_id"),
+                "created_at": record.get("created_at"),
+                "expires_at": record.get("expires_at"),
+                "expired": is_expired(record),
+            })
+    return states
+
+
+def _login_cookies(cookies, login_check):
+    """The configured session cookie, else the cookies sent to the login_check host, else all."""
+    check = login_check or {}
+    if check.get("session_cookie"):
+        return [c for c in cookies if c.get("name") == check["session_cookie"]]
+    host = urlparse(check.get("url") or "").hostname
+    if not host:
+        return cookies
+    def sent_to_host(cookie):
+        domain = cookie.get("domain", "").lstrip(".")
+        return host == domain or host.endswith("." + domain)
+    return [c for c in cookies if sent_to_host(c)]
+
+
+def cookie_expiry(state, login_check=None, now=None):
+    """
+    Earliest expiry (epoch seconds) among the persistent login cookies, None if
+    they are all session cookies. Cookies that expire within SHORT_LIVED_S of
+    capture are ignored: they are renewed by the site and do not carry the login.
+    """
+    now = now or time.time()
+    expiries = [
+        c["expires"] for c in _login_cookies(state.get("cookies", []), login_check)
+        if c.get("expires", -1) > now + SHORT_LIVED_S
+    ]
+    return min(expiries) if expiries else None
+
+
+def is_expired(record, now=None):
+    now = now or time.time()
+    if now - record.get("created_at", 0) > MAX_AGE_HOURS * 3600:
+        return True
+    expires_at = record.get("expires_at")
+    return expires_at is not None and now >= expires_at - EXPIRY_MARGIN_S
+
+
+class StorageStates:
+    """
+    Attaches named snapshots to the browser context, refreshing them by
+    replaying their setup case when they are missing, expired or rejected
+    by the site (login_check).
+
+    run_setup_case: async fn(case) -> bool, replays a case on the current context.
+    find_setup_case: fn(name) -> case dict or None (blocking; run off the loop).
+    get_case: fn(case_id) -> case dict or None (blocking).
+    """
+    def __init__(self, browser, run_setup_case, find_setup_case, get_case, run_blocking):
+        self.browser = browser
+        self.run_setup_case = run_setup_case
+        self.find_setup_case = find_setup_case
+        self.get_case = get_case
+        self.run_blocking = run_blocking
+        self.stats = {"reused": 0, "refreshed": 0, "failed": 0}
+
+    async def _setup_case_for(self, name, record):
+        case_id = (record or {}).get("setup_case_id")
+        case = await self.run_blocking(self.get_case, case_id) if case_id else None
+        return case or await self.run_blocking(self.find_setup_case, name)
+
+    async def apply(self, name):
+        """
+        Start the context from snapshot `name`. Returns the setup case whose
+        login the snapshot stands for (its prompts can be skipped), or None on failure.
+        """
+        record = load(name)
+        setup_case = await self._setup_case_for(name, record)
+        if record is not None and not is_expired(record):
+            await self.browser.use_storage_state(record["state"])
+            if await self._still_valid(record):
+                self.stats["reused"] += 1
+                print(f"[StorageState] Reusing '{name}'")
+                return setup_case or {"prompts": []}
+            print(f"[StorageState] '{name}' was rejected by the site")
+        elif record is not None:
+            print(f"[StorageState] '{name}' expired")
+
+        if await self.refresh(name, setup_case) is None:
+            return None
+        return setup_case
+
+    async def refresh(self, name, setup_case):
+        """Replay the setup case on an empty context and snapshot the result."""
+        if not setup_case:
+            print(f"[StorageState] No setup case provides '{name}'")
+            self.stats["failed"] += 1
+            return None
+        print(f"[StorageState] Refreshing '{name}' via case {setup_case['id']} ({setup_case['name']})")
+        await self.browser.use_storage_state(None)
+        if not await self.run_setup_case(setup_case):
+            print(f"[StorageState] Setup case {setup_case['id']} failed; '{name}' not saved")
+            self.stats["failed"] += 1
+            return None
+        self.stats["refreshed"] += 1
+        return await self.capture(name, setup_case)
+
+    async def capture(self, name, setup_case):
+        """Snapshot the current context under `name` (after its setup case passed)."""
+        state = await self.browser.export_storage_state()
+        config = setup_case.get("config") or {}
+        return await self.run_blocking(
+            save, name, state, setup_case_id=setup_case.get("id"), login_check=config.get("login_check")
+        )
+
+    async def _still_valid(self, record):
+        """Open login_check.url: landing on a logged-out URL means the session is gone."""
+        check = record.get("login_check") or {}
+        if not check.get("url") or not check.get("logged_out_pattern"):
+            return True
+        if not await self.browser.navigate(check["url"]):
+            return False
+        return not re.search(check["logged_out_pattern"], self.browser.page.url)
+
+
+def strip_setup_prompts(prompts, setup_case):
+    """Drop the leading prompts that repeat the setup case's login flow."""
+    setup_prompts = (setup_case or {}).get("prompts") or []
+    if setup_prompts and prompts[:len(setup_prompts)] == setup_prompts:
+        return prompts[len(setup_prompts):]
+    return prompts
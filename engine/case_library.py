@@ -0,0 +1,185 @@
+import json
+import sqlite3
+from datetime import datetime
+from sqlalchemy import text
+from sqlmodel import Session
+from database import engine, TestCase, encode_cursor, decode_cursor
+
+MAX_PAGE_SIZE = 200
+
+# List views only need these; prompts/config stay in the DB until a case is opened
+_SUMMARY_COLUMNS = """
+    c.id, c.name, c.description, c.created_at,
+    json_array_length(c.prompts) AS prompt_count,
+    json_extract(c.config, '$.tags') AS tags
+"""
+_FULL_COLUMNS = "c.id, c.name, c.description, c.created_at, c.prompts, c.config"
+
+# FTS5 mirror of name / description / prompts. Prompts are stored as JSON, so
+# the triggers index the decoded strings rather than the escaped JSON text.
+_FTS_ROW = """
+    (SELECT group_concat(value, ' ') FROM json_each({row}.prompts))
+"""
+_FTS_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS testcase_fts_ai AFTER INSERT ON testcase BEGIN
+        INSERT INTO testcase_fts(rowid, name, description, prompts)
+        VALUES (new.id, new.name, coalesce(new.description, ''), {_FTS_ROW.format(row="new")});
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS testcase_fts_ad AFTER DELETE ON testcase BEGIN
+        DELETE FROM testcase_fts WHERE rowid = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS testcase_fts_au AFTER UPDATE ON testcase BEGIN
+        DELETE FROM testcase_fts WHERE rowid = old.id;
+        INSERT INTO testcase_fts(rowid, name, description, prompts)
+        VALUES (new.id, new.name, coalesce(new.description, ''), {_FTS_ROW.format(row="new")});
+    END
+    """,
+]
+
+# The trigram tokenizer gives substring matches, which CJK text needs
+# (unicode61 would treat a whole Chinese sentence as one token).
+_TRIGRAM_MIN_QUERY = 3
+_fts_tokenizer = None
+
+
+def setup_case_search():
+    """Create the FTS5 index and its sync triggers, populating it on first run."""
+    global _fts_tokenizer
+    tokenizer = "trigram" if sqlite3.sqlite_version_info >= (3, 34, 0) else "unicode61"
+    with engine.begin() as conn:
+        exists = conn.execute(text(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'testcase_fts'"
+        )).first()
+        if not exists:
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE testcase_fts USING fts5(name, description, prompts, tokenize='{tokenizer}')"
+            ))
+            conn.execute(text(f"""
+                INSERT INTO testcase_fts(rowid, name, description, prompts)
+                SELECT c.id, c.name, coalesce(c.description, ''), {_FTS_ROW.format(row="c")}
+                FROM testcase c
+            """))
+        else:
+            tokenizer = "trigram" if "trigram" in exists[0] else "unicode61"
+        for trigger in _FTS_TRIGGERS:
+            conn.execute(text(trigger))
+    _fts_tokenizer = tokenizer
+
+
+def _match_clause(query: str, params: dict) -> str:
+    """Build the search predicate for `query` (AND of whitespace-separated terms)."""
+    terms = [t for t in query.split() if t]
+    clauses = []
+    for i, term in enumerate(terms):
+        key = f"q{i}"
+        if _fts_tokenizer == "trigram" and len(term) < _TRIGRAM_MIN_QUERY:
+            # Too short for a trigram MATCH; LIKE still runs against the FTS table
+            params[key] = f"%{term}%"
+            clauses.append(
+                f"c.id IN (SELECT rowid FROM testcase_fts WHERE name LIKE :{key} "
+                f"OR description LIKE :{key} OR prompts LIKE :{key})"
+            )
+        else:
+            # Quote as an FTS5 string so user input is never parsed as query syntax
+            params[key] = '"' + term.replace('"', '""') + '"'
+            clauses.append(f"c.id IN (SELECT rowid FROM testcase_fts WHERE testcase_fts MATCH :{key})")
+    return " AND ".join(clauses)
+
+
+def _row_to_dict(row, full: bool) -> dict:
+    data = dict(row)
+    if data.get("created_at") is not None:
+        data["created_at"] = datetime.fromisoformat(str(data["created_at"])).isoformat()
+    if full:
+        data["prompts"] = json.loads(data["prompts"]) if data.get("prompts") else []
+        data["config"] = json.loads(data["config"]) if data.get("config") else {}
+    else:
+        data["tags"] = json.loads(data["tags"]) if data.get("tags") else []
+    return data
+
+
+def serialize_case(case: TestCase) -> dict:
+    data = case.model_dump()
+    if data.get('created_at'):
+        data['created_at'] = data['created_at'].isoformat()
+    return data
+
+
+def create_case(name, description="", prompts=None, config=None) -> dict:
+    case = TestCase(
+        name=name,
+        description=description,
+        prompts=prompts or [],
+        config=config or {}
+    )
+    with Session(engine) as session:
+        session.add(case)
+        session.commit()
+        session.refresh(case)
+        return serialize_case(case)
+
+
+def list_cases(limit: int = 50, cursor: str = None, query: str = None, tags=None, fields: str = "summary"):
+    """
+    Keyset-paginated case listing, newest first.
+    query: full-text search over name, description and prompts.
+    tags: only cases whose config["tags"] contains every given tag.
+    fields: "summary" (no prompts/config, adds prompt_count + tags) or "full".
+    Returns (cases, next_cursor).
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    full = fields == "full"
+    params = {"limit": limit + 1}
+    where = []
+
+    if query and query.strip():
+        where.append(_match_clause(query.strip(), params))
+    for i, tag in enumerate(tags or []):
+        params[f"tag{i}"] = tag
+        where.append(f"EXISTS (SELECT 1 FROM json_each(c.config, '$.tags') WHERE value = :tag{i})")
+    if cursor:
+        position = decode_cursor(cursor)
+        if position:
+            # Same text format SQLAlchemy uses for SQLite DATETIME columns
+            params["cursor_at"] = position[0].strftime("%Y-%m-%d %H:%M:%S.%f")
+            params["cursor_id"] = position[1]
+            where.append("(c.created_at < :cursor_at OR (c.created_at = :cursor_at AND c.id < :cursor_id))")
+
+    sql = f"SELECT {_FULL_COLUMNS if full else _SUMMARY_COLUMNS} FROM testcase c"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY c.created_at DESC, c.id DESC LIMIT :limit"
+
+    with Session(engine) as session:
+        rows = session.execute(text(sql), params).mappings().all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(datetime.fromisoformat(str(last["created_at"])), last["id"])
+    return [_row_to_dict(r, full) for r in rows], next_cursor
+
+
+def get_case(case_id) -> dict:
+    """Returns the serialized case, or None if it does not exist."""
+    with Session(engine) as session:
+        case = session.get(TestCase, case_id)
+        return serialize_case(case) if case else None
+
+
+def find_setup_case(state_name) -> dict:
+    """The newest case whose config declares {"provides_storage_state": state_name}, or None."""
+    sql = (
+        f"SELECT {_FULL_COLUMNS} FROM testcase c "
+        "WHERE json_extract(c.config, '$.provides_storage_state') = :name "
+        "ORDER BY c.created_at DESC, c.id DESC LIMIT 1"
+    )
+    with Session(engine) as session:
+        row = session.execute(text(sql), {"name": state_name}).mappings().first()
+    return _row_to_dict(row, full=True) if row else None
@@ -1,13 +1,51 @@
 from sqlmodel import SQLModel, Field, JSON, create_engine, Session
+from sqlalchemy import Index, event, inspect, insert, text
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import List, Optional, Dict
 from datetime import datetime
-import os
+import asyncio
+import base64
 
 # Define database file path
 SQLITE_FILE_NAME = "diandian.db"
 DATABASE_URL = f"sqlite:///{SQLITE_FILE_NAME}"
 
-engine = create_engine(DATABASE_URL)
+# Pooled connections are shared across the DB worker threads below
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False, "timeout": 30},
+    pool_size=5,
+    max_overflow=5,
+)
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL lets readers run alongside a writer, so parallel runs no longer block
+    each other. synchronous=NORMAL is durable across app crashes in WAL mode.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-16000") # ~16MB page cache per connection
+    cursor.execute("PRAGMA mmap_size=134217728")
+    cursor.close()
+
+# Blocking DB work is pushed here so Socket.IO handlers never stall the event loop
+_DB_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="diandian-db")
+
+async def run_db(fn, *args, **kwargs):
+    """Run a synchronous DB function on the DB thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_DB_EXECUTOR, partial(fn, *args, **kwargs))
+
+def bulk_insert(session: Session, model, rows: List[Dict]):
+    """Insert many rows with a single executemany (no per-row ORM objects)."""
+    if rows:
+        session.execute(insert(model), rows)
 
 class TestCase(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -17,19 +55,156 @@ class TestCase(SQLModel, table=True):
     prompts: List[str] = Field(default=[], sa_type=JSON) 
     # Use JSON column to store config dict
     config: Dict = Field(default={}, sa_type=JSON)
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
 
 class TestRun(SQLModel, table=True):
+    __table_args__ = (
+        # Per-case history queries filter on case and walk by time
+        Index("ix_testrun_case_created", "case_id", "created_at"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    case_id: Optional[int] = Field(default=None, foreign_key="testcase.id")
-    status: str # "PASS", "FAIL"
+    case_id: Optional[int] = Field(default=None, foreign_key="testcase.id", index=True)
+    task: str = Field(default="")
+    status: str # "PASS", "FAIL", "CANCELLED"
     logs: str = Field(default="") # Simple text logs or JSON string
     duration: int = Field(default=0) # Duration in seconds
+    duration_ms: int = Field(default=0)
+    step_count: int = Field(default=0)
+    retry_ms: int = Field(default=0) # time spent on step attempts that had to be retried
     report_path: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+class TestRunStep(SQLModel, table=True):
+    """Per-step timing and outcome for a TestRun."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    run_id: int = Field(foreign_key="testrun.id", index=True)
+    idx: int # 1-based position within the run
+    name: str
+    action: str = Field(default="")
+    strategy: str = Field(default="") # "text", "vision", ...
+    status: str # "PASS", "FAIL"
+    attempts: int = Field(default=1)
+    duration_ms: int = Field(default=0)
+    time_to_action_ms: Optional[int] = None # perception start -> action dispatched (last attempt)
+    retry_ms: int = Field(default=0) # step start -> start of the last attempt
+
+class ReportEntry(SQLModel, table=True):
+    """Catalog row for a generated report (one per Reporter run)."""
+    __table_args__ = (
+        # Keyset pagination walks (created_at, id) newest first
+        Index("ix_reportentry_created_id", "created_at", "id"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    run_id: str = Field(index=True, unique=True)
+    case_id: Optional[int] = Field(default=None, index=True)
+    run_group: Optional[str] = Field(default=None, index=True) # RunRecorder.group; a case replay writes one report per prompt
+    task: str = Field(default="")
+    status: str = Field(default="completed", index=True) # "completed", "cancelled", "error", ...
+    duration_ms: int = Field(default=0)
+    step_count: int = Field(default=0)
+    failed_steps: int = Field(default=0)
+    path: str # URL under the /reports mount
+    created_at: datetime = Field(default_factory=datetime.now)
+
+class ReportBlob(SQLModel, table=True):
+    """A report's reference to a screenshot in the shared blob store."""
+    __table_args__ = (
+        Index("ix_reportblob_run_digest", "run_id", "digest", unique=True),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    run_id: str
+    digest: str = Field(index=True) # sha256 of the image bytes
+    size: int = Field(default=0)
+    refs: int = Field(default=1) # How many times the run uses this image
+
+class LocatorMemory(SQLModel, table=True):
+    """A selector that worked for a step intent on a page (learned from L1 or Point & Teach)."""
+    __table_args__ = (
+        Index("ix_locatormemory_key", "domain", "url_pattern", "intent", "selector", unique=True),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    domain: str
+    url_pattern: str # path with ids replaced by '*'
+    intent: str # normalized step text
+    action: str # "click", "type", "hover"
+    selector: str
+    param: Optional[str] = None
+    source: str = Field(default="text") # "text" (L1) or "teach"
+    success_count: int = Field(default=0)
+    failure_count: int = Field(default=0)
+    last_used_at: datetime = Field(default_factory=datetime.utcnow)
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class RouterOutcome(SQLModel, table=True):
+    """How often L1 answers in one confidence bucket were seen / executed / right, per domain, action and model."""
+    __table_args__ = (
+        Index("ix_routeroutcome_model_key", "domain", "action", "model", "bucket", unique=True),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    domain: str
+    action: str # L1 action: "click", "type", ...
+    model: str = Field(default="") # cascade tier that answered; each model is calibrated differently
+    bucket: int # lower edge of the confidence bucket, in hundredths (0.65 -> 65)
+    seen: int = Field(default=0) # L1 answers in this bucket, accepted or not
+    success_count: int = Field(default=0) # accepted and the action succeeded
+    failure_count: int = Field(default=0)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Opaque keyset cursor for (created_at, id) pagination."""
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str):
+    """Inverse of encode_cursor. Returns (created_at, id) or None if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_at, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        return None
+
+# Unique indexes whose key has since been widened (they would reject the new rows)
+_RETIRED_INDEXES = ("ix_routeroutcome_key",)
+
+def _migrate_existing_tables():
+    """
+    create_all() only creates missing tables. Add columns and indexes that were
+    introduced after a table was first created (SQLite, additive changes only).
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_cols = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_cols:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                if isinstance(default, (int, float)):
+                    ddl += f" DEFAULT {default}"
+                elif isinstance(default, str):
+                    ddl += " DEFAULT '" + default.replace("'", "''") + "'"
+                conn.execute(text(ddl))
+    with engine.begin() as conn:
+        for name in _RETIRED_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name in existing_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    _migrate_existing_tables()
 
 def get_session():
     with Session(engine) as session:
@@ -0,0 +1,74 @@
+"""
+Local stand-in for DashScope that replays recorded cassettes.
+
+    python model_stub.py --cassettes ./cassettes --latency-ms 800 --chunk-ms 20
+
+Point the engine at it with DIANDIAN_MODEL_MODE=replay and
+DIANDIAN_MODEL_STUB_URL=http://127.0.0.1:8765. Latency is injected here, so
+benchmarks can model a slow or fast provider without touching the engine.
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from agent import cassette
+
+
+class ReplayRequest(BaseModel):
+    key: str
+    stream: bool = True
+
+
+def create_app(cassette_dir=None, latency_ms=None, chunk_ms=0):
+    """
+    latency_ms: delay before the first chunk; None replays the latency measured
+                when the cassette was recorded.
+    chunk_ms: delay between streamed chunks.
+    """
+    app = FastAPI(title="DianDian model stub")
+    stats = {"hits": 0, "misses": 0}
+
+    @app.post("/v1/replay")
+    async def replay(request: ReplayRequest):
+        data = cassette.load(request.key, root=cassette_dir)
+        if data is None:
+            stats["misses"] += 1
+            raise HTTPException(status_code=404, detail="cassette not found")
+        stats["hits"] += 1
+
+        first_delay = (data.get("latency_ms", 0) if latency_ms is None else latency_ms) / 1000
+        chunks = data["chunks"] if request.stream else ["".join(data["chunks"])]
+
+        async def body():
+            await asyncio.sleep(first_delay)
+            for i, chunk in enumerate(chunks):
+                if i and chunk_ms:
+                    await asyncio.sleep(chunk_ms / 1000)
+                yield json.dumps({"delta": chunk}, ensure_ascii=False) + "\n"
+            yield json.dumps({"usage": data.get("usage")}) + "\n"
+
+        return StreamingResponse(body(), media_type="application/x-ndjson")
+
+    @app.get("/v1/stats")
+    def get_stats():
+        return stats
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded model cassettes over HTTP")
+    parser.add_argument("--cassettes", default=cassette.CASSETTE_DIR)
+    parser.add_argument("--latency-ms", type=int, default=None, help="first-chunk delay (default: as recorded)")
+    parser.add_argument("--chunk-ms", type=int, default=0, help="delay between streamed chunks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.cassettes, args.latency_ms, args.chunk_ms), host=args.host, port=args.port)
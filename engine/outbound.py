@@ -0,0 +1,136 @@
+import os
+import asyncio
+from collections import deque, Counter
+
+# Events waiting for one client before the oldest droppable ones are shed
+MAX_PENDING = int(os.getenv("DIANDIAN_OUTBOUND_MAX_PENDING", "100"))
+# A send that takes longer is abandoned (slow or half-disconnected client)
+SEND_TIMEOUT_S = 10.0
+
+# Only the newest pending one matters
+LATEST_ONLY_EVENTS = ("browser_snapshot",)
+# Consecutive pending ones are merged into a single update
+MERGEABLE_EVENTS = ("agent_thought",)
+# Never shed when the queue is full
+CRITICAL_EVENTS = ("processing_state", "response", "report_generated", "replay_step_start", "error")
+
+
+class ClientQueue:
+    """
+    Outbound events for one client, sent by a background task so the agent
+    never waits on the socket. Coalesces while the client is behind.
+    """
+    def __init__(self, sid, send, max_pending=MAX_PENDING):
+        self.sid = sid
+        self.send = send
+        self.max_pending = max_pending
+        self.pending = deque() # [event, payload]
+        self.stats = Counter() # queued / sent / merged / replaced / dropped / failed
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self._task = asyncio.create_task(self._drain())
+
+    def put(self, event, payload):
+        if self._closed:
+            self.stats["dropped"] += 1
+            return
+        self.stats["queued"] += 1
+        if event in LATEST_ONLY_EVENTS:
+            for i, (pending_event, _) in enumerate(self.pending):
+                if pending_event == event:
+                    del self.pending[i]
+                    self.stats["replaced"] += 1
+                    break
+        elif event in MERGEABLE_EVENTS and self._merge(event, payload):
+            self.stats["merged"] += 1
+            return
+
+        self.pending.append([event, payload])
+        if len(self.pending) > self.max_pending:
+            self._shed()
+        self._wakeup.set()
+
+    def _merge(self, event, payload):
+        """
+        Fold a thought into the previous pending one of the same step and strategy
+        (pending snapshots in between do not count, they only keep their latest).
+        """
+        last = next((item for item in reversed(self.pending) if item[0] not in LATEST_ONLY_EVENTS), None)
+        if last is None:
+            return False
+        previous = last[1]
+        if last[0] != event or not isinstance(previous, dict) or not isinstance(payload, dict):
+            return False
+        if previous.get("step") != payload.get("step") or previous.get("strategy") != payload.get("strategy"):
+            return False
+        last[1] = {**previous, "detail": f"{previous.get('detail', '')}\n{payload.get('detail', '')}"}
+        return True
+
+    def _shed(self):
+        """
+        Drop the oldest non-critical event, keeping the latest snapshot as long as
+        anything else can go (critical events may overflow the limit).
+        """
+        for keep in (CRITICAL_EVENTS + LATEST_ONLY_EVENTS, CRITICAL_EVENTS):
+            for i, (event, _) in enumerate(self.pending):
+                if event not in keep:
+                    del self.pending[i]
+                    self.stats["dropped"] += 1
+                    return
+
+    async def _drain(self):
+        while True:
+            await self._wakeup.wait()
+            while self.pending:
+                event, payload = self.pending.popleft()
+                try:
+                    await asyncio.wait_for(self.send(event, payload, room=self.sid), SEND_TIMEOUT_S)
+                    self.stats["sent"] += 1
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    print(f"[Outbound] Send {event} to {self.sid} failed: {e}")
+            self._wakeup.clear()
+
+    def close(self):
+        self._closed = True
+        self.stats["dropped"] += len(self.pending)
+        self.pending.clear()
+        self._task.cancel()
+
+
+class OutboundHub:
+    """Per-client outbound queues. send: async fn(event, payload, room=sid)."""
+    def __init__(self, send, max_pending=MAX_PENDING):
+        self.send = send
+        self.max_pending = max_pending
+        self.clients = {}
+        self.closed_stats = Counter() # totals of disconnected clients
+
+    def open(self, sid):
+        if sid not in self.clients:
+            self.clients[sid] = ClientQueue(sid, self.send, self.max_pending)
+
+    def close(self, sid):
+        queue = self.clients.pop(sid, None)
+        if queue:
+            queue.close()
+            self.closed_stats.update(queue.stats)
+
+    async def emit(self, sid, event, payload):
+        """Enqueue and return immediately (same signature style as emit_func)."""
+        queue = self.clients.get(sid)
+        if queue is None:
+            # Client already gone
+            self.closed_stats["dropped"] += 1
+            return
+        queue.put(event, payload)
+
+    def stats(self):
+        totals = Counter(self.closed_stats)
+        clients = {}
+        for sid, queue in self.clients.items():
+            totals.update(queue.stats)
+            clients[sid] = {"pending": len(queue.pending), **queue.stats}
+        return {"totals": dict(totals), "clients": clients, "max_pending": self.max_pending}
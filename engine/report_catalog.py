@@ -0,0 +1,209 @@
+import os
+import re
+import json
+from datetime import datetime
+from sqlmodel import Session, select, or_, and_, col
+from database import engine, ReportEntry, ReportBlob, bulk_insert, encode_cursor, decode_cursor
+from report_storage import BLOB_DIR_NAME
+
+MAX_PAGE_SIZE = 200
+
+# Legacy reports (before meta.json) only have the rendered HTML to go on
+_LEGACY_STATUS_RE = re.compile(r">\s*(COMPLETED|CANCELLED|ERROR|RUNNING|PENDING)\s*<")
+_LEGACY_DURATION_RE = re.compile(r"Duration:\s*(\d+)s")
+
+
+def report_url(run_id: str) -> str:
+    return f"/reports/{run_id}/index.html"
+
+
+def _replace_blob_refs(session: Session, run_id: str, blobs: dict):
+    """blobs: digest -> {"size": int, "refs": int}"""
+    session.execute(ReportBlob.__table__.delete().where(ReportBlob.run_id == run_id))
+    bulk_insert(session, ReportBlob, [
+        {"run_id": run_id, "digest": digest, "size": info["size"], "refs": info["refs"]}
+        for digest, info in blobs.items()
+    ])
+
+
+def record_report(meta: dict, blobs: dict = None):
+    """
+    Upsert the catalog row for a finished run.
+    meta: Reporter.meta plus run_id / step_count / duration_ms / case_id.
+    blobs: digest -> {"size", "refs"} for the screenshots the run references.
+    """
+    run_id = meta["run_id"]
+    with Session(engine) as session:
+        entry = session.exec(select(ReportEntry).where(ReportEntry.run_id == run_id)).first()
+        if not entry:
+            entry = ReportEntry(run_id=run_id, path=report_url(run_id))
+        entry.case_id = meta.get("case_id")
+        entry.run_group = meta.get("run_group")
+        entry.task = meta.get("task", "") or ""
+        entry.status = meta.get("status", "completed")
+        entry.duration_ms = int(meta.get("duration_ms", 0) or 0)
+        entry.step_count = int(meta.get("step_count", 0) or 0)
+        entry.failed_steps = int(meta.get("failed_steps", 0) or 0)
+        if meta.get("start_time"):
+            entry.created_at = datetime.fromisoformat(meta["start_time"])
+        session.add(entry)
+        if blobs is not None:
+            _replace_blob_refs(session, run_id, blobs)
+        session.commit()
+
+
+def list_reports(limit: int = 50, cursor: str = None, status: str = None, case_id: int = None):
+    """
+    Keyset-paginated catalog listing, newest first.
+    Returns (rows, next_cursor).
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    statement = select(ReportEntry)
+    if status:
+        statement = statement.where(ReportEntry.status == status)
+    if case_id is not None:
+        statement = statement.where(ReportEntry.case_id == case_id)
+    if cursor:
+        position = decode_cursor(cursor)
+        if position:
+            created_at, row_id = position
+            statement = statement.where(or_(
+                ReportEntry.created_at < created_at,
+                and_(ReportEntry.created_at == created_at, ReportEntry.id < row_id)
+            ))
+    statement = statement.order_by(col(ReportEntry.created_at).desc(), col(ReportEntry.id).desc()).limit(limit + 1)
+
+    with Session(engine) as session:
+        rows = session.exec(statement).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return rows, next_cursor
+
+
+def serialize_report(entry: ReportEntry) -> dict:
+    return {
+        "id": entry.run_id,
+        "date": entry.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        "path": entry.path,
+        "status": entry.status,
+        "case_id": entry.case_id,
+        "task": entry.task,
+        "duration_ms": entry.duration_ms,
+        "step_count": entry.step_count,
+        "failed_steps": entry.failed_steps,
+    }
+
+
+def _read_step_log(folder: str, meta: dict) -> dict:
+    """Blob references and failure count from steps.jsonl (covers runs that never finished)."""
+    blobs = {}
+    log_path = os.path.join(folder, "steps.jsonl")
+    if not os.path.exists(log_path):
+        return blobs
+    steps, failed = 0, 0
+    with open(log_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                step = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            steps += 1
+            failed += step.get("status") != "success"
+            for key in ("img_before", "img_after"):
+                ref = step.get(key) or ""
+                if f"{BLOB_DIR_NAME}/" not in ref:
+                    continue
+                digest = os.path.basename(ref).split(".", 1)[0]
+                blob_path = os.path.join(os.path.dirname(folder), BLOB_DIR_NAME, digest[:2], os.path.basename(ref))
+                info = blobs.setdefault(digest, {"size": 0, "refs": 0})
+                info["refs"] += 1
+                if not info["size"] and os.path.exists(blob_path):
+                    info["size"] = os.path.getsize(blob_path)
+    meta.setdefault("step_count", steps)
+    meta.setdefault("failed_steps", failed)
+    return blobs
+
+
+def _read_folder_meta(run_id: str, folder: str) -> dict:
+    """Build catalog metadata for an existing report folder."""
+    meta_path = os.path.join(folder, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        meta["run_id"] = run_id
+        if "duration_ms" not in meta:
+            match = re.match(r"(\d+)s", str(meta.get("duration", "")))
+            meta["duration_ms"] = int(match.group(1)) * 1000 if match else 0
+        return meta
+
+    # Legacy report: the folder name is the start timestamp, the rest lives in the HTML
+    try:
+        start_time = datetime.strptime(run_id, "%Y%m%d_%H%M%S")
+    except ValueError:
+        start_time = datetime.fromtimestamp(os.path.getctime(folder))
+    meta = {"run_id": run_id, "start_time": start_time.isoformat(), "status": "unknown"}
+
+    html_path = os.path.join(folder, "index.html")
+    if os.path.exists(html_path):
+        with open(html_path, "r", encoding="utf-8", errors="ignore") as f:
+            html = f.read()
+        status = _LEGACY_STATUS_RE.search(html)
+        duration = _LEGACY_DURATION_RE.search(html)
+        title = re.search(r"<title>DianDian Test Report - (.*?)</title>", html)
+        if status:
+            meta["status"] = status.group(1).lower()
+        if duration:
+            meta["duration_ms"] = int(duration.group(1)) * 1000
+        if title:
+            meta["task"] = title.group(1)
+        meta["step_count"] = html.count("step-card bg-white")
+    return meta
+
+
+def backfill_reports(reports_dir: str, only_if_empty: bool = True) -> int:
+    """
+    Index report folders that are not in the catalog yet.
+    With only_if_empty, this is a one-time migration that is skipped once the catalog has rows.
+    Returns the number of rows added.
+    """
+    if not os.path.isdir(reports_dir):
+        return 0
+
+    with Session(engine) as session:
+        if only_if_empty and session.exec(select(ReportEntry.id).limit(1)).first() is not None:
+            return 0
+        known = set(session.exec(select(ReportEntry.run_id)).all())
+
+    added = 0
+    with Session(engine) as session:
+        for run_id in sorted(os.listdir(reports_dir)):
+            folder = os.path.join(reports_dir, run_id)
+            if run_id in known or run_id.startswith((".", "_")) or not os.path.isdir(folder):
+                continue
+            try:
+                meta = _read_folder_meta(run_id, folder)
+                blobs = _read_step_log(folder, meta)
+                session.add(ReportEntry(
+                    run_id=run_id,
+                    case_id=meta.get("case_id"),
+                    run_group=meta.get("run_group"),
+                    task=meta.get("task", "") or "",
+                    status=meta.get("status", "unknown"),
+                    duration_ms=int(meta.get("duration_ms", 0) or 0),
+                    step_count=int(meta.get("step_count", 0) or 0),
+                    failed_steps=int(meta.get("failed_steps", 0) or 0),
+                    path=report_url(run_id),
+                    created_at=datetime.fromisoformat(meta["start_time"]),
+                ))
+                _replace_blob_refs(session, run_id, blobs)
+                added += 1
+            except Exception as e:
+                print(f"[ReportCatalog] Failed to index {run_id}: {e}")
+        session.commit()
+
+    if added:
+        print(f"[ReportCatalog] Backfilled {added} reports from {reports_dir}")
+    return added
@@ -0,0 +1,208 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from sqlmodel import Session
+from database import engine
+
+BLOB_DIR_NAME = "_blobs"
+
+# Blobs younger than this are never collected, even if no report lists them yet
+# (a step's images are stored just before its log line is written).
+GC_GRACE_SECONDS = 3600
+
+
+class BlobStore:
+    """
+    Content-addressed file store for report images.
+    Each distinct image is written once as <root>/<aa>/<sha256>.<ext>.
+    """
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, digest, ext="jpg"):
+        return os.path.join(self.root, digest[:2], f"{digest}.{ext}")
+
+    def put(self, data: bytes, ext="jpg"):
+        """Store `data` and return (digest, relative path from the store root)."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest, ext)
+        if os.path.exists(path):
+            # Refresh mtime so a concurrent GC treats the blob as recently used
+            os.utime(path, None)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest, f"{digest[:2]}/{digest}.{ext}"
+
+    def iter_blobs(self):
+        """Yield (digest, path, size, mtime) for every stored blob."""
+        if not os.path.isdir(self.root):
+            return
+        for shard in os.listdir(self.root):
+            shard_dir = os.path.join(self.root, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(shard_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield name.split(".", 1)[0], path, stat.st_size, stat.st_mtime
+
+
+# A case replay writes one report per prompt; reports of one run share run_group
+# (older rows without it count as a run each)
+_EXPIRED_RUNS_SQL = """
+WITH runs AS (
+    SELECT COALESCE(run_group, run_id) AS grp,
+           -- Ad-hoc commands (no case) are grouped by their task text
+           CASE WHEN case_id IS NOT NULL THEN 'case:' || case_id ELSE 'task:' || task END AS owner,
+           MAX(created_at) AS created_at,
+           MAX(id) AS last_id,
+           MAX(CASE WHEN status != 'completed' OR failed_steps > 0 THEN 1 ELSE 0 END) AS failed,
+           MAX(CASE WHEN status = 'running' THEN 1 ELSE 0 END) AS running
+    FROM reportentry
+    GROUP BY grp, owner
+), ranked AS (
+    SELECT grp, created_at, failed, running,
+           ROW_NUMBER() OVER (PARTITION BY owner ORDER BY created_at DESC, last_id DESC) AS rn
+    FROM runs
+)
+SELECT e.run_id FROM reportentry e
+JOIN ranked r ON r.grp = COALESCE(e.run_group, e.run_id)
+WHERE r.rn > :keep_last
+  AND r.running = 0
+  AND NOT (r.failed = 1 AND r.created_at >= :failed_since)
+"""
+
+
+def apply_retention(reports_dir, keep_last=20, keep_failed_days=30):
+    """
+    Delete the reports of runs beyond the newest `keep_last` runs per case.
+    Failed runs are kept for `keep_failed_days` regardless of their rank.
+    Returns the list of deleted run ids.
+    """
+    params = {
+        "keep_last": keep_last,
+        "failed_since": datetime.now() - timedelta(days=keep_failed_days),
+    }
+    with Session(engine) as session:
+        run_ids = [r[0] for r in session.execute(text(_EXPIRED_RUNS_SQL), params).all()]
+
+    deleted = []
+    for run_id in run_ids:
+        # run_id is a folder name; refuse anything that could escape reports_dir
+        if os.path.basename(run_id) != run_id or run_id.startswith((".", "_")):
+            continue
+        folder = os.path.join(reports_dir, run_id)
+        try:
+            if os.path.isdir(folder):
+                shutil.rmtree(folder)
+            deleted.append(run_id)
+        except Exception as e:
+            print(f"[Storage] Failed to delete report {run_id}: {e}")
+
+    if deleted:
+        with engine.begin() as conn:
+            for i in range(0, len(deleted), 500):
+                chunk = {f"r{j}": run_id for j, run_id in enumerate(deleted[i:i + 500])}
+                placeholders = ", ".join(f":{k}" for k in chunk)
+                conn.execute(text(f"DELETE FROM reportblob WHERE run_id IN ({placeholders})"), chunk)
+                conn.execute(text(f"DELETE FROM reportentry WHERE run_id IN ({placeholders})"), chunk)
+        print(f"[Storage] Retention removed {len(deleted)} reports")
+    return deleted
+
+
+def _unindexed_refs(reports_dir, indexed):
+    """Digests used by report folders whose refs are not in the catalog yet (running or crashed runs)."""
+    from report_catalog import _read_step_log
+
+    digests = set()
+    if not reports_dir or not os.path.isdir(reports_dir):
+        return digests
+    for run_id in os.listdir(reports_dir):
+        folder = os.path.join(reports_dir, run_id)
+        if run_id in indexed or run_id.startswith((".", "_")) or not os.path.isdir(folder):
+            continue
+        try:
+            digests.update(_read_step_log(folder, {}))
+        except Exception as e:
+            print(f"[Storage] Failed to read step log of {run_id}: {e}")
+    return digests
+
+
+def collect_garbage(store: BlobStore, grace_seconds=GC_GRACE_SECONDS, reports_dir=None):
+    """
+    Delete blobs no report references any more. Returns (count, bytes) freed.
+    Blob refs are catalogued when a report finishes; with `reports_dir`, the step
+    logs of reports that have not finished keep their blobs as well.
+    """
+    with Session(engine) as session:
+        referenced = {r[0] for r in session.execute(text("SELECT DISTINCT digest FROM reportblob")).all()}
+        indexed = {r[0] for r in session.execute(text("SELECT run_id FROM reportentry WHERE status != 'running'")).all()}
+    referenced |= _unindexed_refs(reports_dir, indexed)
+
+    cutoff = time.time() - grace_seconds
+    freed_count, freed_bytes = 0, 0
+    for digest, path, size, mtime in store.iter_blobs():
+        if digest in referenced or mtime > cutoff:
+            continue
+        try:
+            os.remove(path)
+            freed_count += 1
+            freed_bytes += size
+        except FileNotFoundError:
+            pass
+    if freed_count:
+        print(f"[Storage] GC freed {freed_count} blobs ({freed_bytes} bytes)")
+    return freed_count, freed_bytes
+
+
+def run_retention(reports_dir, store: BlobStore, keep_last=20, keep_failed_days=30):
+    deleted = apply_retention(reports_dir, keep_last=keep_last, keep_failed_days=keep_failed_days)
+    freed_count, freed_bytes = collect_garbage(store, reports_dir=reports_dir)
+    return {"deleted_runs": len(deleted), "freed_blobs": freed_count, "freed_bytes": freed_bytes}
+
+
+def disk_usage(store: BlobStore = None):
+    """
+    Deduplication stats from the catalog: `logical_bytes` is what per-run image
+    copies would take, `stored_bytes` what the shared store actually holds.
+    With `store`, also walks the blob directory for the on-disk total.
+    """
+    with Session(engine) as session:
+        row = session.execute(text("""
+            SELECT COALESCE(SUM(size * refs), 0) AS logical_bytes,
+                   COALESCE(SUM(refs), 0) AS references_count,
+                   COUNT(DISTINCT run_id) AS runs
+            FROM reportblob
+        """)).mappings().one()
+        unique = session.execute(text("""
+            SELECT COUNT(*) AS blobs, COALESCE(SUM(size), 0) AS stored_bytes
+            FROM (SELECT digest, MAX(size) AS size FROM reportblob GROUP BY digest)
+        """)).mappings().one()
+
+    logical, stored = row["logical_bytes"], unique["stored_bytes"]
+    usage = {
+        "runs": row["runs"],
+        "references": row["references_count"],
+        "blobs": unique["blobs"],
+        "logical_bytes": logical,
+        "stored_bytes": stored,
+        "saved_bytes": logical - stored,
+        "dedup_ratio": round(logical / stored, 2) if stored else None,
+    }
+    if store is not None:
+        usage["disk_bytes"] = sum(size for _, _, size, _ in store.iter_blobs())
+    return usage
@@ -1,175 +1,342 @@
 import os
 import json
-import time
 import base64
 from datetime import datetime
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment
+from report_storage import BlobStore, BLOB_DIR_NAME
+
+# Shared with the server's /reports static mount
+REPORTS_DIR = os.getenv("DIANDIAN_REPORTS_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "reports"
+)
+
+# Self-contained viewer (no CDN). Steps are streamed from steps.jsonl when the
+# report is served over HTTP, or read from the embedded JSON block once the run
+# has finished (so the file also works when opened straight from disk).
+VIEWER_TEMPLATE = """<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>DianDian Test Report - {{ meta.task }}</title>
+<style>
+*{box-sizing:border-box}
+body{margin:0;background:#f9fafb;color:#1e293b;font-family:ui-sans-serif,system-ui,-apple-system,"Segoe UI",sans-serif;min-height:100vh}
+.wrap{max-width:64rem;margin:0 auto;padding:1.5rem}
+.card{background:#fff;border:1px solid #f3f4f6;box-shadow:0 1px 2px rgba(0,0,0,.05)}
+header.card{border-radius:1rem;padding:2rem;margin-bottom:2rem;display:flex;justify-content:space-between;align-items:flex-start;gap:1rem}
+h1{font-size:1.875rem;font-weight:700;color:#4f46e5;margin:0 0 .5rem}
+.task{font-size:1.25rem;color:#374151;font-weight:500;margin:0}
+.right{text-align:right}
+.muted{font-size:.875rem;color:#6b7280}
+.badge{display:inline-block;padding:.25rem .75rem;border-radius:9999px;font-size:.875rem;font-weight:600;margin-bottom:.5rem}
+.ok{background:#dcfce7;color:#15803d}
+.bad{background:#fee2e2;color:#b91c1c}
+.run{background:#e0e7ff;color:#4338ca}
+.step{border-radius:.75rem;padding:1.5rem;margin-bottom:1.5rem;transition:all .2s}
+.step:hover{transform:translateY(-2px);box-shadow:0 10px 15px -3px rgba(0,0,0,.1)}
+.step-head{display:flex;align-items:center;justify-content:space-between;border-bottom:1px solid #f9fafb;padding-bottom:1rem;margin-bottom:1rem}
+.step-title{display:flex;align-items:center;gap:.75rem}
+.num{display:flex;height:2rem;width:2rem;align-items:center;justify-content:center;border-radius:9999px;background:#e0e7ff;color:#4f46e5;font-weight:700;font-size:.875rem}
+.num.failed{background:#fee2e2;color:#b91c1c}
+h3{font-weight:600;font-size:1.125rem;margin:0}
+.time{font-size:.75rem;font-family:ui-monospace,monospace;color:#9ca3af}
+.grid{display:grid;grid-template-columns:1fr;gap:1.5rem}
+@media(min-width:768px){.grid{grid-template-columns:1fr 1fr}}
+.thought{background:#f8fafc;padding:1rem;border-radius:.5rem}
+.label{font-size:.75rem;text-transform:uppercase;letter-spacing:.05em;color:#9ca3af;margin-bottom:.25rem}
+.thought p{font-size:.875rem;color:#4b5563;line-height:1.6;margin:0}
+.action{display:flex;align-items:center;gap:.5rem;margin-top:1rem}
+code{padding:.25rem .5rem;background:#f3f4f6;border-radius:.25rem;font-size:.875rem;color:#db2777;word-break:break-all}
+.shots{display:grid;grid-template-columns:1fr 1fr;gap:.5rem}
+.shots .label{font-size:10px;text-align:center}
+.shots img{width:100%;border-radius:.25rem;border:1px solid #e5e7eb;cursor:pointer;background:#f3f4f6;min-height:4rem}
+#sentinel,footer{text-align:center;color:#9ca3af;font-size:.875rem;margin:3rem 0 1.5rem}
+</style>
+</head>
+<body>
+<div class="wrap">
+  <header class="card">
+    <div>
+      <h1>DianDian Automation Report</h1>
+      <p class="task">{{ meta.task }}</p>
+    </div>
+    <div class="right">
+      <div id="status" class="badge"></div>
+      <div class="muted">{{ meta.start_time }}</div>
+      <div class="muted">Duration: {{ meta.duration }}</div>
+      {% if meta.network and meta.network.profile != "full" %}
+      <div class="muted">Network: {{ meta.network.profile }} · {{ meta.network.requests_skipped }} requests skipped · ~{{ (meta.network.estimated_bytes_saved / 1024) | round | int }} KB saved{% if meta.network.avg_dom_content_loaded_ms %} · {{ meta.network.avg_dom_content_loaded_ms }}ms avg load{% endif %}</div>
+      {% endif %}
+      {% if meta.retries and meta.retries.retried_steps %}
+      <div class="muted">Retries: {{ meta.retries.retried_steps }} steps · {{ meta.retries.lost_ms }}ms lost{% for kind in ["vision", "remark", "recapture"] %}{% if meta.retries[kind] %} · {{ meta.retries[kind] }} {{ kind }}{% endif %}{% endfor %}</div>
+      {% endif %}
+      <div class="muted" id="count"></div>
+    </div>
+  </header>
+  <div id="steps"></div>
+  <div id="sentinel"></div>
+  <footer>Generated by DianDian AI Agent</footer>
+</div>
+<script type="application/json" id="report-meta">{{ meta | tojson }}</script>
+<script type="application/json" id="report-steps">{{ steps | tojson }}</script>
+<script>
+(function () {
+  var PAGE_SIZE = 20;
+  var meta = JSON.parse(document.getElementById('report-meta').textContent);
+  var embedded = JSON.parse(document.getElementById('report-steps').textContent);
+  var steps = [];
+  var rendered = 0;
+  var list = document.getElementById('steps');
+  var sentinel = document.getElementById('sentinel');
+
+  var status = document.getElementById('status');
+  status.textContent = String(meta.status || '').toUpperCase();
+  status.className = 'badge ' + (meta.status === 'completed' ? 'ok' : meta.status === 'running' ? 'run' : 'bad');
+
+  function el(tag, cls, text) {
+    var node = document.createElement(tag);
+    if (cls) node.className = cls;
+    if (text !== undefined && text !== null) node.textContent = text;
+    return node;
+  }
+
+  function shot(label, src) {
+    var box = el('div');
+    box.appendChild(el('div', 'label', label));
+    var img = el('img');
+    img.loading = 'lazy';
+    img.decoding = 'async';
+    img.src = src;
+    img.onclick = function () { window.open(this.src); };
+    box.appendChild(img);
+    return box;
+  }
+
+  function renderStep(step) {
+    var card = el('div', 'step card');
+    var head = el('div', 'step-head');
+    var title = el('div', 'step-title');
+    title.appendChild(el('span', step.status === 'success' ? 'num' : 'num failed', step.id));
+    title.appendChild(el('h3', null, step.name));
+    head.appendChild(title);
+    var time = step.timestamp;
+    if (step.time_to_action_ms != null) time += ' · ' + (step.time_to_action_ms / 1000).toFixed(1) + 's to action';
+    head.appendChild(el('span', 'time', time));
+    card.appendChild(head);
+
+    var grid = el('div', 'grid');
+    var info = el('div');
+    var thought = el('div', 'thought');
+    thought.appendChild(el('div', 'label', 'Thought'));
+    thought.appendChild(el('p', null, step.thought));
+    info.appendChild(thought);
+    var action = el('div', 'action');
+    action.appendChild(el('div', 'label', 'Action:'));
+    action.appendChild(el('code', null, step.action));
+    info.appendChild(action);
+    grid.appendChild(info);
+
+    var shots = el('div', 'shots');
+    if (step.img_before) shots.appendChild(shot('Before', step.img_before));
+    if (step.img_after) shots.appendChild(shot('After', step.img_after));
+    grid.appendChild(shots);
+    card.appendChild(grid);
+    return card;
+  }
+
+  function renderPage() {
+    var end = Math.min(rendered + PAGE_SIZE, steps.length);
+    var frag = document.createDocumentFragment();
+    for (; rendered < end; rendered++) frag.appendChild(renderStep(steps[rendered]));
+    list.appendChild(frag);
+    document.getElementById('count').textContent = rendered + ' / ' + steps.length + ' steps';
+    sentinel.textContent = rendered < steps.length ? 'Loading more steps...' : '';
+  }
+
+  function start(data) {
+    steps = data;
+    renderPage();
+    if ('IntersectionObserver' in window) {
+      new IntersectionObserver(function (entries) {
+        if (entries[0].isIntersecting && rendered < steps.length) renderPage();
+      }, { rootMargin: '800px' }).observe(sentinel);
+    } else {
+      while (rendered < steps.length) renderPage();
+    }
+  }
+
+  if (embedded.length || meta.status !== 'running') {
+    start(embedded);
+  } else {
+    // Run still in progress (or crashed): read the step log directly.
+    fetch('steps.jsonl', { cache: 'no-store' })
+      .then(function (res) { return res.text(); })
+      .then(function (text) {
+        start(text.split('\\n').filter(Boolean).map(function (line) {
+          try { return JSON.parse(line); } catch (e) { return null; }
+        }).filter(Boolean));
+      })
+      .catch(function () { start([]); });
+  }
+})();
+</script>
+</body>
+</html>
+"""
+
 
 class Reporter:
-    def __init__(self, output_dir="reports"):
+    _viewer = None  # Compiled once per process, shared by all reports
+
+    def __init__(self, output_dir=REPORTS_DIR, case_id=None, run_group=None):
         self.start_time = datetime.now()
         self.run_id = self.start_time.strftime("%Y%m%d_%H%M%S")
         self.report_dir = os.path.join(output_dir, self.run_id)
-        self.images_dir = os.path.join(self.report_dir, "images")
-        
+        self.log_path = os.path.join(self.report_dir, "steps.jsonl")
+
         # Ensure directories exist
-        os.makedirs(self.images_dir, exist_ok=True)
-        
-        self.steps = []
+        os.makedirs(self.report_dir, exist_ok=True)
+
+        # Screenshots are shared across runs, stored once by content hash
+        self.blob_store = BlobStore(os.path.join(output_dir, BLOB_DIR_NAME))
+        self.blobs = {} # digest -> {"size", "refs"}
+
+        self.step_count = 0
+        self.failed_steps = 0
         self.meta = {
             "task": "",
+            "case_id": case_id,
+            "run_group": run_group,
             "start_time": self.start_time.isoformat(),
             "duration": 0,
-            "status": "pending"
+            "duration_ms": 0,
+            "status": "running"
         }
-        
-        # Setup Jinja
-        self.env = Environment(loader=FileSystemLoader(os.path.dirname(__file__)))
-        # We will assume a 'report_template.html' exists in the same folder
+
+        # Steps are appended as they happen so a crashed run still leaves a log
+        self._log = open(self.log_path, "a", encoding="utf-8")
+        self._write_meta()
+        self.generate_html()
+
+    @classmethod
+    def _get_viewer(cls):
+        if cls._viewer is None:
+            cls._viewer = Environment(autoescape=True).from_string(VIEWER_TEMPLATE)
+        return cls._viewer
 
     def set_task(self, task_description):
         self.meta["task"] = task_description
+        self._write_meta()
+
+    def set_network(self, stats):
+        """Request interception totals for the run (browser/network.py)."""
+        self.meta["network"] = stats
+
+    def set_retries(self, stats):
+        """Retried steps, retries by kind and the time they cost (agent/core.py)."""
+        self.meta["retries"] = stats
+
+    def _summary(self):
+        return {**self.meta, "run_id": self.run_id, "step_count": self.step_count, "failed_steps": self.failed_steps}
+
+    def _write_meta(self):
+        try:
+            with open(os.path.join(self.report_dir, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(self._summary(), f, ensure_ascii=False)
+        except Exception as e:
+            print(f"[Reporter] Failed to write meta: {e}")
 
-    def _save_image(self, b64_str, prefix="step"):
+    def _save_image(self, b64_str):
         if not b64_str:
             return None
-        
+
         # Clean header if present
         if "base64," in b64_str:
             b64_str = b64_str.split("base64,")[1]
-            
-        filename = f"{prefix}_{int(time.time()*1000)}.jpg"
-        filepath = os.path.join(self.images_dir, filename)
-        
+
         try:
-            with open(filepath, "wb") as f:
-                f.write(base64.b64decode(b64_str))
-            return os.path.join("images", filename) # Return relative path for HTML
+            data = base64.b64decode(b64_str)
+            digest, rel_path = self.blob_store.put(data)
+            info = self.blobs.setdefault(digest, {"size": len(data), "refs": 0})
+            info["refs"] += 1
+            return f"../{BLOB_DIR_NAME}/{rel_path}" # Relative URL for HTML
         except Exception as e:
             print(f"[Reporter] Failed to save image: {e}")
             return None
 
-    def log_step(self, step_name, thought, action, param, status, screenshot_before=None, screenshot_after=None):
+    def log_step(self, step_name, thought, action, param, status, screenshot_before=None, screenshot_after=None, time_to_action_ms=None):
         """
-        Log a single execution step.
+        Log a single execution step (appended to steps.jsonl immediately).
+        time_to_action_ms: from the start of perception until the action was dispatched.
         """
+        self.step_count += 1
+        if not status:
+            self.failed_steps += 1
         step_data = {
-            "id": len(self.steps) + 1,
+            "id": self.step_count,
             "name": step_name,
             "timestamp": datetime.now().strftime("%H:%M:%S"),
             "thought": thought,
             "action": f"{action} {param if param else ''}",
             "status": "success" if status else "failed",
-            "img_before": self._save_image(screenshot_before, prefix="pre"),
-            "img_after": self._save_image(screenshot_after, prefix="post")
+            "img_before": self._save_image(screenshot_before),
+            "img_after": self._save_image(screenshot_after),
+            "time_to_action_ms": time_to_action_ms
         }
-        self.steps.append(step_data)
+        if self._log.closed:
+            return
+        self._log.write(json.dumps(step_data, ensure_ascii=False) + "\n")
+        self._log.flush()
+
+    def _read_steps(self):
+        steps = []
+        try:
+            with open(self.log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        steps.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Torn last line from an interrupted write
+                        continue
+        except FileNotFoundError:
+            pass
+        return steps
 
     def finish(self, status="completed"):
         self.meta["status"] = status
         duration = datetime.now() - self.start_time
         self.meta["duration"] = f"{duration.seconds}s"
-        
-        return self.generate_html()
+        self.meta["duration_ms"] = int(duration.total_seconds() * 1000)
+        if not self._log.closed:
+            self._log.close()
+        self._write_meta()
 
-    def generate_html(self):
-        # Define a simple embedded template if file doesn't exist, or specific one
-        template_content = """
-<!DOCTYPE html>
-<html lang="zh-CN">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>DianDian Test Report - {{ meta.task }}</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <style>
-        .step-card:hover { transform: translateY(-2px); box-shadow: 0 10px 15px -3px rgba(0, 0, 0, 0.1); }
-    </style>
-</head>
-<body class="bg-gray-50 min-h-screen text-slate-800 font-sans">
-    <div class="max-w-5xl mx-auto p-6">
-        <!-- Header -->
-        <header class="bg-white rounded-2xl shadow-sm p-8 mb-8 border border-gray-100">
-            <div class="flex justify-between items-start">
-                <div>
-                    <h1 class="text-3xl font-bold text-indigo-600 mb-2">DianDian Automation Report</h1>
-                    <p class="text-xl text-gray-700 font-medium">{{ meta.task }}</p>
-                </div>
-                <div class="text-right">
-                    <div class="inline-flex items-center px-3 py-1 rounded-full text-sm font-semibold 
-                        {{ 'bg-green-100 text-green-700' if meta.status == 'completed' else 'bg-red-100 text-red-700' }}">
-                        {{ meta.status | upper }}
-                    </div>
-                    <div class="text-sm text-gray-500 mt-2">{{ meta.start_time }}</div>
-                    <div class="text-sm text-gray-500">Duration: {{ meta.duration }}</div>
-                </div>
-            </div>
-        </header>
-
-        <!-- Timeline -->
-        <div class="space-y-6">
-            {% for step in steps %}
-            <div class="step-card bg-white rounded-xl p-6 shadow-sm border border-gray-100 transition-all duration-200">
-                <div class="flex items-center justify-between mb-4 border-b border-gray-50 pb-4">
-                    <div class="flex items-center gap-3">
-                        <span class="flex h-8 w-8 items-center justify-center rounded-full bg-indigo-100 text-indigo-600 font-bold text-sm">
-                            {{ step.id }}
-                        </span>
-                        <h3 class="font-semibold text-lg">{{ step.name }}</h3>
-                    </div>
-                    <span class="text-xs font-mono text-gray-400">{{ step.timestamp }}</span>
-                </div>
-
-                <div class="grid grid-cols-1 md:grid-cols-2 gap-6">
-                    <!-- Text Info -->
-                    <div class="space-y-4">
-                        <div class="bg-slate-50 p-4 rounded-lg">
-                            <div class="text-xs uppercase tracking-wider text-gray-400 mb-1">Thought</div>
-                            <p class="text-sm text-gray-600 leading-relaxed">{{ step.thought }}</p>
-                        </div>
-                        <div class="flex items-center gap-2">
-                             <div class="text-xs uppercase tracking-wider text-gray-400">Action:</div>
-                             <code class="px-2 py-1 bg-gray-100 rounded text-sm font-mono text-pink-600">{{ step.action }}</code>
-                        </div>
-                    </div>
-
-                    <!-- Screenshots -->
-                    <div class="grid grid-cols-2 gap-2">
-                        {% if step.img_before %}
-                        <div class="space-y-1">
-                            <div class="text-[10px] text-center text-gray-400 uppercase">Before</div>
-                            <img src="{{ step.img_before }}" class="w-full rounded border cursor-pointer hover:opacity-90" onclick="window.open(this.src)">
-                        </div>
-                        {% endif %}
-                        {% if step.img_after %}
-                        <div class="space-y-1">
-                            <div class="text-[10px] text-center text-gray-400 uppercase">After</div>
-                            <img src="{{ step.img_after }}" class="w-full rounded border cursor-pointer hover:opacity-90" onclick="window.open(this.src)">
-                        </div>
-                        {% endif %}
-                    </div>
-                </div>
-            </div>
-            {% endfor %}
-        </div>
-        
-        <footer class="text-center text-gray-400 text-sm mt-12 mb-6">
-            Generated by DianDian AI Agent
-        </footer>
-    </div>
-</body>
-</html>
-"""
+        report_path = self.generate_html(steps=self._read_steps())
+        self._index()
+        return report_path
+
+    def _index(self):
+        """Register the finished run in the report catalog."""
+        try:
+            from report_catalog import record_report
+            record_report(self._summary(), blobs=self.blobs)
+        except Exception as e:
+            print(f"[Reporter] Failed to index report: {e}")
+
+    def generate_html(self, steps=None):
         try:
             report_path = os.path.join(self.report_dir, "index.html")
-            template = self.env.from_string(template_content)
-            rendered = template.render(meta=self.meta, steps=self.steps)
-            
+            rendered = self._get_viewer().render(meta=self.meta, steps=steps or [])
+
             with open(report_path, "w", encoding="utf-8") as f:
                 f.write(rendered)
-                
+
             return os.path.abspath(report_path)
-            
+
         except Exception as e:
             print(f"[Reporter] Failed to generate HTML: {e}")
             return None
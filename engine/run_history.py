@@ -0,0 +1,212 @@
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from sqlmodel import Session
+from database import engine, TestRun, TestRunStep, bulk_insert
+
+
+class RunRecorder:
+    """
+    Collects step outcomes for one command or one case replay and writes a
+    TestRun row (plus TestRunStep children) when the run finishes.
+    """
+    def __init__(self, case_id=None, task=""):
+        self.case_id = case_id
+        self.task = task
+        self.created_at = datetime.utcnow()
+        self._start = time.monotonic()
+        self.steps = []
+        self.report_paths = []
+        self.run_id = None
+        self.group = uuid.uuid4().hex # ties the run's reports together in the catalog (retention)
+        self.failed = False # a command failed outside any step (e.g. no plan)
+
+    def record_step(self, name, action, strategy, success, attempts, duration_ms, time_to_action_ms=None, retry_ms=0):
+        self.steps.append({
+            "idx": len(self.steps) + 1,
+            "name": name,
+            "action": action or "",
+            "strategy": strategy or "",
+            "status": "PASS" if success else "FAIL",
+            "attempts": attempts,
+            "duration_ms": int(duration_ms),
+            "time_to_action_ms": int(time_to_action_ms) if time_to_action_ms is not None else None,
+            "retry_ms": int(retry_ms),
+        })
+
+    def mark_failed(self):
+        """A command of this run failed without recording a step; the run cannot pass."""
+        self.failed = True
+
+    @property
+    def passed(self):
+        """True when nothing was marked failed, at least one step ran and every step passed."""
+        return not self.failed and bool(self.steps) and all(s["status"] == "PASS" for s in self.steps)
+
+    def add_report(self, report_path):
+        if report_path:
+            self.report_paths.append(report_path)
+
+    def finish(self, status=None):
+        """
+        Persist the run. status defaults to PASS when every step passed, FAIL otherwise.
+        Returns the TestRun id.
+        """
+        if self.run_id is not None:
+            return self.run_id
+        if status is None:
+            status = "PASS" if self.passed else "FAIL"
+
+        duration_ms = int((time.monotonic() - self._start) * 1000)
+        retry_ms = sum(s["retry_ms"] for s in self.steps)
+        run = TestRun(
+            case_id=self.case_id,
+            task=self.task,
+            status=status,
+            logs="\n".join(self.report_paths),
+            duration=duration_ms // 1000,
+            duration_ms=duration_ms,
+            step_count=len(self.steps),
+            retry_ms=retry_ms,
+            report_path=self.report_paths[-1] if self.report_paths else None,
+            created_at=self.created_at,
+        )
+        with Session(engine) as session:
+            session.add(run)
+            session.flush()
+            bulk_insert(session, TestRunStep, [{"run_id": run.id, **s} for s in self.steps])
+            session.commit()
+            self.run_id = run.id
+        print(f"[RunHistory] Recorded run {self.run_id}: {status} ({duration_ms}ms, {len(self.steps)} steps, {retry_ms}ms retrying)")
+        return self.run_id
+
+
+# Only decided runs count towards durations and flakiness
+_FILTER = "status IN ('PASS', 'FAIL') AND created_at >= :since AND (:case_id IS NULL OR case_id = :case_id)"
+
+_CASE_SUMMARY_SQL = f"""
+WITH runs AS (
+    SELECT id, case_id, status, duration_ms, created_at
+    FROM testrun
+    WHERE case_id IS NOT NULL AND {_FILTER}
+),
+ranked AS (
+    SELECT case_id, duration_ms,
+           ROW_NUMBER() OVER (PARTITION BY case_id ORDER BY duration_ms) AS rn,
+           COUNT(*) OVER (PARTITION BY case_id) AS n
+    FROM runs
+),
+pct AS (
+    -- Nearest-rank percentiles
+    SELECT case_id,
+           MIN(CASE WHEN rn >= 0.50 * n THEN duration_ms END) AS p50_ms,
+           MIN(CASE WHEN rn >= 0.95 * n THEN duration_ms END) AS p95_ms
+    FROM ranked
+    GROUP BY case_id
+),
+seq AS (
+    SELECT case_id, status,
+           LAG(status) OVER (PARTITION BY case_id ORDER BY created_at, id) AS prev_status
+    FROM runs
+),
+flake AS (
+    -- A flip is a PASS<->FAIL change between consecutive runs of the same case
+    SELECT case_id,
+           SUM(CASE WHEN prev_status IS NOT NULL AND prev_status != status THEN 1 ELSE 0 END) AS flips,
+           SUM(CASE WHEN prev_status IS NOT NULL THEN 1 ELSE 0 END) AS transitions
+    FROM seq
+    GROUP BY case_id
+),
+totals AS (
+    SELECT case_id,
+           COUNT(*) AS runs,
+           SUM(CASE WHEN status = 'PASS' THEN 1 ELSE 0 END) AS passes,
+           AVG(duration_ms) AS avg_ms,
+           AVG(CASE WHEN created_at >= :recent THEN duration_ms END) AS recent_avg_ms,
+           AVG(CASE WHEN created_at < :recent THEN duration_ms END) AS prior_avg_ms,
+           AVG(CASE WHEN created_at >= :recent THEN (status = 'PASS') END) AS recent_pass_rate,
+           AVG(CASE WHEN created_at < :recent THEN (status = 'PASS') END) AS prior_pass_rate,
+           MAX(created_at) AS last_run_at
+    FROM runs
+    GROUP BY case_id
+)
+SELECT t.case_id, c.name, t.runs, t.passes, t.avg_ms, p.p50_ms, p.p95_ms,
+       f.flips, f.transitions, t.recent_avg_ms, t.prior_avg_ms,
+       t.recent_pass_rate, t.prior_pass_rate, t.last_run_at
+FROM totals t
+JOIN pct p ON p.case_id = t.case_id
+JOIN flake f ON f.case_id = t.case_id
+LEFT JOIN testcase c ON c.id = t.case_id
+ORDER BY t.runs DESC, t.case_id
+"""
+
+_CASE_TREND_SQL = f"""
+SELECT date(created_at) AS day,
+       COUNT(*) AS runs,
+       SUM(CASE WHEN status = 'PASS' THEN 1 ELSE 0 END) AS passes,
+       AVG(duration_ms) AS avg_ms,
+       MAX(duration_ms) AS max_ms
+FROM testrun
+WHERE {_FILTER}
+GROUP BY day
+ORDER BY day
+"""
+
+
+def _ratio(numerator, denominator):
+    return round(numerator / denominator, 4) if denominator else None
+
+
+def _round(value):
+    return round(value, 4) if value is not None else None
+
+
+def case_analytics(days: int = 30, case_id: int = None, recent_days: int = 7):
+    """
+    Per-case duration percentiles, pass/flake rates and recent-vs-prior trend,
+    computed in SQL over the last `days` days.
+    """
+    now = datetime.utcnow()
+    params = {
+        "since": now - timedelta(days=days),
+        "recent": now - timedelta(days=recent_days),
+        "case_id": case_id,
+    }
+    with Session(engine) as session:
+        rows = session.execute(text(_CASE_SUMMARY_SQL), params).mappings().all()
+
+    results = []
+    for r in rows:
+        results.append({
+            "case_id": r["case_id"],
+            "name": r["name"],
+            "runs": r["runs"],
+            "pass_rate": _ratio(r["passes"], r["runs"]),
+            "flake_rate": _ratio(r["flips"], r["transitions"]),
+            "avg_ms": int(r["avg_ms"] or 0),
+            "p50_ms": r["p50_ms"],
+            "p95_ms": r["p95_ms"],
+            "trend": {
+                "recent_days": recent_days,
+                "duration_change": _ratio((r["recent_avg_ms"] or 0) - (r["prior_avg_ms"] or 0), r["prior_avg_ms"]) if r["recent_avg_ms"] is not None else None,
+                "recent_pass_rate": _round(r["recent_pass_rate"]),
+                "prior_pass_rate": _round(r["prior_pass_rate"]),
+            },
+            "last_run_at": str(r["last_run_at"]) if r["last_run_at"] else None,
+        })
+    return results
+
+
+def case_trend(case_id: int, days: int = 30):
+    """Daily run count, pass rate and durations for one case."""
+    params = {"since": datetime.utcnow() - timedelta(days=days), "case_id": case_id}
+    with Session(engine) as session:
+        rows = session.execute(text(_CASE_TREND_SQL), params).mappings().all()
+    return [{
+        "day": r["day"],
+        "runs": r["runs"],
+        "pass_rate": _ratio(r["passes"], r["runs"]),
+        "avg_ms": int(r["avg_ms"] or 0),
+        "max_ms": r["max_ms"],
+    } for r in rows]
@@ -7,10 +7,17 @@ import sys
 import asyncio
 from browser.driver import BrowserController
 from agent.core import DiandianAgent
-from database import create_db_and_tables, TestCase, get_session, engine
-from sqlmodel import Session, select
+from agent import router_thresholds
+from database import create_db_and_tables, run_db
+from case_library import create_case, list_cases, get_case, setup_case_search, find_setup_case
+from reporter import REPORTS_DIR
+from report_catalog import list_reports, serialize_report, backfill_reports
+from run_history import RunRecorder, case_analytics, case_trend
+from report_storage import BlobStore, BLOB_DIR_NAME, run_retention, disk_usage
+from browser import storage_state
+from outbound import OutboundHub
+from typing import Optional
 import os
-from datetime import datetime
 
 # Initialize DB with lifespan
 from contextlib import asynccontextmanager
@@ -18,7 +25,13 @@ from contextlib import asynccontextmanager
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    create_db_and_tables()
+    await run_db(create_db_and_tables)
+    await run_db(setup_case_search)
+    # One-time migration of report folders created before the catalog existed
+    await run_db(backfill_reports, REPORTS_DIR)
+    # Retention only runs automatically when a policy is configured
+    if os.getenv("REPORT_KEEP_LAST"):
+        await run_db(run_retention, REPORTS_DIR, blob_store, **retention_policy())
     yield
     # Shutdown (if needed)
 
@@ -36,10 +49,16 @@ app.add_middleware(
 )
 
 # Mount Reports Directory
-REPORTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "reports")
 if not os.path.exists(REPORTS_DIR):
     os.makedirs(REPORTS_DIR)
 app.mount("/reports", StaticFiles(directory=REPORTS_DIR), name="reports")
+blob_store = BlobStore(os.path.join(REPORTS_DIR, BLOB_DIR_NAME))
+
+def retention_policy():
+    return {
+        "keep_last": int(os.getenv("REPORT_KEEP_LAST", "20")),
+        "keep_failed_days": int(os.getenv("REPORT_KEEP_FAILED_DAYS", "30"))
+    }
 
 
 
@@ -48,37 +67,130 @@ socket_app = socketio.ASGIApp(sio, app)
 
 # Global Components
 agent = DiandianAgent()
+# Agent events go through a bounded per-client queue so a slow client never blocks the step loop
+outbound = OutboundHub(sio.emit)
+
+
+async def run_setup_case(case):
+    """Replay a login/setup case on the current context (recorded as its own run). Returns True if it passed."""
+    recorder = RunRecorder(case_id=case["id"], task=case["name"])
+    try:
+        for prompt in case["prompts"]:
+            await agent.process_command(prompt, case_id=case["id"], recorder=recorder)
+    except asyncio.CancelledError:
+        await run_db(recorder.finish, status="CANCELLED")
+        raise
+    except Exception as e:
+        print(f"Setup Case Error: {e}")
+        await run_db(recorder.finish, status="FAIL")
+        return False
+    await run_db(recorder.finish)
+    return recorder.passed
+
+storage_states = storage_state.StorageStates(agent.browser, run_setup_case, find_setup_case, get_case, run_db)
 
 @app.get("/")
 def read_root():
     return {"message": "DianDian Python Engine is Running"}
 
 @app.get("/api/reports")
-def get_reports():
-    """List all generated reports."""
-    reports = []
-    if os.path.exists(REPORTS_DIR):
-        # List subdirectories (each report is a folder)
-        for item in os.listdir(REPORTS_DIR):
-            item_path = os.path.join(REPORTS_DIR, item)
-            if os.path.isdir(item_path):
-                # Try to find an index.html or just link the folder
-                # Our report format: task_id_timestamp/
-                try:
-                    # Simple parsing: assume folder name has timestamp or just use creating time
-                    timestamp = os.path.getctime(item_path)
-                    date_str = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
-                    reports.append({
-                        "id": item,
-                        "date": date_str,
-                        "path": f"/reports/{item}/index.html" # Assuming index.html exists
-                    })
-                except Exception as e:
-                    print(f"Error parsing report {item}: {e}")
-    
-    # Sort by date desc
-    reports.sort(key=lambda x: x['date'], reverse=True)
-    return {"reports": reports}
+def get_reports(limit: int = 50, cursor: Optional[str] = None, status: Optional[str] = None, case_id: Optional[int] = None):
+    """
+    List generated reports from the catalog, newest first.
+    Pass the returned next_cursor back as `cursor` to fetch the next page.
+    """
+    rows, next_cursor = list_reports(limit=limit, cursor=cursor, status=status, case_id=case_id)
+    return {"reports": [serialize_report(r) for r in rows], "next_cursor": next_cursor}
+
+@app.post("/api/reports/reindex")
+def reindex_reports():
+    """Index report folders missing from the catalog (e.g. copied in by hand)."""
+    added = backfill_reports(REPORTS_DIR, only_if_empty=False)
+    return {"added": added}
+
+@app.get("/api/storage/usage")
+def get_storage_usage(scan: bool = False):
+    """Screenshot store size and deduplication savings. scan=true also walks the blob directory."""
+    return disk_usage(blob_store if scan else None)
+
+@app.post("/api/storage/gc")
+def storage_gc(keep_last: Optional[int] = None, keep_failed_days: Optional[int] = None):
+    """Apply the retention policy, then delete screenshots no report references."""
+    policy = retention_policy()
+    if keep_last is not None:
+        policy["keep_last"] = keep_last
+    if keep_failed_days is not None:
+        policy["keep_failed_days"] = keep_failed_days
+    result = run_retention(REPORTS_DIR, blob_store, **policy)
+    return {**result, "policy": policy, "usage": disk_usage()}
+
+@app.get("/api/analytics/cases")
+def get_case_analytics(days: int = 30):
+    """Per-case p50/p95 duration, pass rate, flake rate and trend over the last `days` days."""
+    return {"days": days, "cases": case_analytics(days=days)}
+
+@app.get("/api/analytics/cases/{case_id}")
+def get_case_detail_analytics(case_id: int, days: int = 30):
+    """Summary plus daily series for a single case."""
+    summary = case_analytics(days=days, case_id=case_id)
+    return {
+        "days": days,
+        "summary": summary[0] if summary else None,
+        "daily": case_trend(case_id, days=days)
+    }
+
+@app.get("/api/storage-states")
+def get_storage_states():
+    """Saved login snapshots (no cookie values) and reuse / refresh counters."""
+    return {"states": storage_state.list_states(), "stats": storage_states.stats}
+
+@app.delete("/api/storage-states/{name}")
+def delete_storage_state(name: str):
+    """Forget a snapshot; the next case that needs it replays its setup case."""
+    return {"deleted": storage_state.delete(name)}
+
+@app.get("/api/executor/stats")
+def get_executor_stats():
+    """Decision routes since startup, including fast-path hit rate and model calls saved."""
+    return agent.executor.stats()
+
+@app.get("/api/models/cascade")
+def get_model_cascade_stats():
+    """Per model tier of L1 and the planner: calls, acceptance / escalation, latency, tokens and cost."""
+    return {
+        "l1": agent.executor.text_strategy.cascade.stats(),
+        "planner": agent.planner.cascade.stats(),
+    }
+
+@app.get("/api/router/thresholds")
+def get_router_thresholds(domain: Optional[str] = None):
+    """L1 acceptance threshold learned per domain, action and model tier, with the outcome counts behind it."""
+    return {
+        "default": router_thresholds.DEFAULT_THRESHOLD,
+        "bounds": [router_thresholds.MIN_THRESHOLD, router_thresholds.MAX_THRESHOLD],
+        "min_samples": router_thresholds.MIN_SAMPLES,
+        "thresholds": router_thresholds.list_thresholds(*agent.executor.route_costs(), domain=domain),
+    }
+
+@app.delete("/api/router/thresholds")
+def reset_router_thresholds(domain: Optional[str] = None, action: Optional[str] = None):
+    """Forget learned outcomes (all, one domain, or one domain/action); back to the default threshold."""
+    return {"deleted": router_thresholds.reset(domain=domain, action=action)}
+
+@app.get("/api/outbound/stats")
+def get_outbound_stats():
+    """Per-client outbound queue depth plus sent / merged / replaced / dropped counts."""
+    return outbound.stats()
+
+@app.get("/api/browser/stats")
+def get_browser_stats():
+    """Shared HTTP cache hit rate, BASE_URL prewarm usage and context memory / recycles."""
+    cache = agent.browser.http_cache
+    return {
+        "http_cache": cache.stats() if cache else None,
+        "prewarm": agent.browser.prewarm_stats,
+        "memory": agent.browser.memory.stats(),
+    }
 
 
 # Task Management
@@ -87,6 +199,7 @@ current_task = None
 @sio.event
 async def connect(sid, environ):
     print(f"Client connected: {sid}")
+    outbound.open(sid)
     await sio.emit('message', {'data': 'Connected to Python Engine'})
     # Reset state on new connection? Or sync?
     # For now assume single user
@@ -98,6 +211,7 @@ async def connect(sid, environ):
 @sio.event
 async def disconnect(sid):
     print(f"Client disconnected: {sid}")
+    outbound.close(sid)
 
 @sio.event
 async def message(sid, data):
@@ -111,23 +225,23 @@ async def message(sid, data):
 
     # Define a helper to emit back to this specific client
     async def emit_to_client(event, payload):
-        await sio.emit(event, payload, room=sid)
+        await outbound.emit(sid, event, payload)
 
     async def handle_agent_task(text, sid):
          global current_task
          try:
-             await sio.emit('processing_state', {'status': 'running'}, room=sid)
+             await outbound.emit(sid, 'processing_state', {'status': 'running'})
              await agent.process_command(text, emit_func=emit_to_client)
-             await sio.emit('response', {'data': f"Agent finished: {text}"}, room=sid)
+             await outbound.emit(sid, 'response', {'data': f"Agent finished: {text}"})
          except asyncio.CancelledError:
              print("Agent task cancelled")
-             await sio.emit('response', {'data': "🛑 Task stopped by user."}, room=sid)
+             await outbound.emit(sid, 'response', {'data': "🛑 Task stopped by user."})
          except Exception as e:
              print(f"Agent Task Error: {e}")
-             await sio.emit('response', {'data': f"Error: {str(e)}"}, room=sid)
+             await outbound.emit(sid, 'response', {'data': f"Error: {str(e)}"})
          finally:
              current_task = None
-             await sio.emit('processing_state', {'status': 'idle'}, room=sid)
+             await outbound.emit(sid, 'processing_state', {'status': 'idle'})
 
     # Hand off to Agent (Non-blocking)
     user_text = data.get('data', '')
@@ -168,43 +282,57 @@ async def save_case(sid, data):
     """
     print(f"Saving case: {data}")
     try:
-        case = TestCase(
+        case = await run_db(
+            create_case,
             name=data.get("name"),
             description=data.get("description", ""),
             prompts=data.get("prompts", []),
             config=data.get("config", {})
         )
-        with Session(engine) as session:
-            session.add(case)
-            session.commit()
-            session.refresh(case)
         
-        await sio.emit('save_case_success', {'id': case.id, 'name': case.name}, room=sid)
+        await sio.emit('save_case_success', {'id': case['id'], 'name': case['name']}, room=sid)
     except Exception as e:
         print(f"Save Case Error: {e}")
         await sio.emit('error', {'message': f"Failed to save case: {str(e)}"}, room=sid)
 
 @sio.event
 async def load_cases(sid, data):
-    """List all saved test cases."""
+    """
+    List saved test cases, one page at a time.
+    data: { limit?: int, cursor?: str, query?: str, tags?: List[str], fields?: "summary" | "full" }
+    List views get summaries (prompt_count/tags, no prompts); use get_case for details.
+    """
+    data = data or {}
     try:
-        with Session(engine) as session:
-            statement = select(TestCase).order_by(TestCase.created_at.desc())
-            results = session.exec(statement).all()
-            # Serialize
-            cases = [c.model_dump() for c in results]
-            
-            # Helper for datetime serialization if needed, but model_dump usually handles it well or returns datetime obj
-            # We might need to convert datetime to str for json
-            for c in cases:
-                if c.get('created_at'):
-                   c['created_at'] = c['created_at'].isoformat()
-
-        await sio.emit('cases_list', cases, room=sid)
+        cases, next_cursor = await run_db(
+            list_cases,
+            limit=data.get("limit", 50),
+            cursor=data.get("cursor"),
+            query=data.get("query"),
+            tags=data.get("tags"),
+            fields=data.get("fields", "summary")
+        )
+        await sio.emit('cases_list', {
+            'cases': cases,
+            'next_cursor': next_cursor,
+            'cursor': data.get("cursor")
+        }, room=sid)
     except Exception as e:
         print(f"Load Cases Error: {e}")
         await sio.emit('error', {'message': f"Failed to load cases: {str(e)}"}, room=sid)
 
+@sio.event
+async def get_case_detail(sid, data):
+    """
+    Fetch a single case with its prompts and config.
+    data: { case_id: int }
+    """
+    case = await run_db(get_case, (data or {}).get("case_id"))
+    if not case:
+        await sio.emit('error', {'message': "Case not found."}, room=sid)
+        return
+    await sio.emit('case_detail', case, room=sid)
+
 @sio.event
 async def replay_case(sid, data):
     """
@@ -220,9 +348,7 @@ async def replay_case(sid, data):
         return
 
     # Fetch Case
-    case = None
-    with Session(engine) as session:
-        case = session.get(TestCase, case_id)
+    case = await run_db(get_case, case_id)
     
     if not case:
         await sio.emit('error', {'message': "Case not found."}, room=sid)
@@ -233,27 +359,63 @@ async def replay_case(sid, data):
     # Ideally, we create a wrapper task that executes them sequentially.
     
     async def emit_to_client(event, payload):
-        await sio.emit(event, payload, room=sid)
+        await outbound.emit(sid, event, payload)
 
     async def execute_replay_flow(prompts, sid):
         global current_task
+        # One TestRun for the whole replay, steps from every prompt
+        recorder = RunRecorder(case_id=case_id, task=case["name"])
+        # The profile chosen in the UI (update_config) applies again after the case
+        previous_profile = agent.browser.network.profile_name
         try:
-             await sio.emit('processing_state', {'status': 'running', 'mode': 'replay'}, room=sid)
+             # Contexts past the memory ceiling are recycled between cases, never mid-case
+             await agent.browser.recycle_if_needed()
+             # Per-case request interception, e.g. config {"network_profile": "lean"}
+             case_profile = (case.get("config") or {}).get("network_profile")
+             if case_profile:
+                 await agent.browser.set_network_profile(case_profile)
+             await outbound.emit(sid, 'processing_state', {'status': 'running', 'mode': 'replay'})
+             config = case.get("config") or {}
+             # Cases with config {"storage_state": "<name>"} start logged in and skip
+             # the setup case's prompts; without a usable snapshot they run in full
+             state_name = config.get("storage_state")
+             if state_name:
+                 setup_case = await storage_states.apply(state_name)
+                 if setup_case is not None:
+                     remaining = storage_state.strip_setup_prompts(prompts, setup_case)
+                     await outbound.emit(sid, 'response', {'data': f"🔑 Using login state '{state_name}' (skipped {len(prompts) - len(remaining)} prompts)"})
+                     prompts = remaining
              for prompt in prompts:
                  print(f"Replay Step: {prompt}")
-                 await sio.emit('replay_step_start', {'prompt': prompt}, room=sid)
-                 await agent.process_command(prompt, emit_func=emit_to_client)
+                 await outbound.emit(sid, 'replay_step_start', {'prompt': prompt})
+                 await agent.process_command(prompt, emit_func=emit_to_client, case_id=case_id, recorder=recorder)
                  await asyncio.sleep(1) # Breath
              
-             await sio.emit('response', {'data': "✅ Replay Completed successfully."}, room=sid)
+             await run_db(recorder.finish)
+             # A setup case refreshes the snapshot it provides whenever it passes
+             if config.get("provides_storage_state") and recorder.passed:
+                 await storage_states.capture(config["provides_storage_state"], case)
+             await outbound.emit(sid, 'response', {'data': "✅ Replay Completed successfully."})
+        except asyncio.CancelledError:
+             await run_db(recorder.finish, status="CANCELLED")
+             raise
         except Exception as e:
              print(f"Replay Error: {e}")
-             await sio.emit('response', {'data': f"Replay Failed: {str(e)}"}, room=sid)
+             await run_db(recorder.finish, status="FAIL")
+             await outbound.emit(sid, 'response', {'data': f"Replay Failed: {str(e)}"})
         finally:
              current_task = None
-             await sio.emit('processing_state', {'status': 'idle'}, room=sid)
+             if agent.browser.network.profile_name != previous_profile:
+                 await agent.browser.set_network_profile(previous_profile)
+             # The snapshot belongs to this replay: later (or recycled) contexts start empty
+             if agent.browser.storage_state is not None:
+                 try:
+                     await agent.browser.use_storage_state(None)
+                 except Exception as e:
+                     print(f"Resetting storage state failed: {e}")
+             await outbound.emit(sid, 'processing_state', {'status': 'idle'})
 
-    current_task = asyncio.create_task(execute_replay_flow(case.prompts, sid))
+    current_task = asyncio.create_task(execute_replay_flow(case["prompts"], sid))
 
 
 
@@ -261,8 +423,10 @@ async def replay_case(sid, data):
 async def update_config(sid, data):
     """
     Update browser configuration (e.g. device emulation).
-    data: { preset: str }
+    data: { preset: str, network_profile?: str }
     """
+    if "network_profile" in data:
+        await agent.browser.set_network_profile(data["network_profile"])
     preset = data.get("preset", "desktop")
     print(f"Updating config to: {preset}")
     # Restart browser with new config
@@ -294,7 +458,7 @@ async def navigate(sid, url):
     print(f"Direct navigate request: {url}")
     
     async def emit_to_client(event, payload):
-        await sio.emit(event, payload, room=sid)
+        await outbound.emit(sid, event, payload)
         
     await agent.process_command(url, emit_func=emit_to_client)
 
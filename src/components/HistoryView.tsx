@@ -5,23 +5,37 @@ interface Report {
     id: string;
     date: string;
     path: string;
+    status: string;
+    task: string;
+    duration_ms: number;
+    step_count: number;
 }
 
+const PAGE_SIZE = 30;
+
 const HistoryView = () => {
     const [reports, setReports] = useState<Report[]>([]);
     const [loading, setLoading] = useState(true);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
 
-    useEffect(() => {
-        fetch('http://localhost:8000/api/reports')
+    const loadPage = (cursor: string | null) => {
+        const params = new URLSearchParams({ limit: String(PAGE_SIZE) });
+        if (cursor) params.set('cursor', cursor);
+        fetch(`http://localhost:8000/api/reports?${params}`)
             .then(res => res.json())
             .then(data => {
-                setReports(data.reports);
+                setReports(prev => cursor ? [...prev, ...data.reports] : data.reports);
+                setNextCursor(data.next_cursor);
                 setLoading(false);
             })
             .catch(err => {
                 console.error("Failed to load reports", err);
                 setLoading(false);
             });
+    };
+
+    useEffect(() => {
+        loadPage(null);
     }, []);
 
     const openReport = (path: string) => {
@@ -54,19 +68,29 @@ const HistoryView = () => {
                                 <ExternalLink className="w-4 h-4 text-muted-foreground opacity-0 group-hover:opacity-100 transition-opacity" />
                             </div>
 
-                            <h3 className="font-semibold text-white mb-1 truncate">Task {report.id}</h3>
+                            <h3 className="font-semibold text-white mb-1 truncate">{report.task || `Task ${report.id}`}</h3>
                             <div className="flex items-center gap-2 text-xs text-muted-foreground font-mono">
                                 <Clock className="w-3 h-3" />
                                 {report.date}
                             </div>
 
-                            <div className="mt-4 pt-3 border-t border-white/5 flex gap-2">
-                                <span className="text-[10px] uppercase tracking-wider bg-green-500/10 text-green-400 px-2 py-0.5 rounded">Completed</span>
+                            <div className="mt-4 pt-3 border-t border-white/5 flex gap-2 items-center">
+                                <span className={`text-[10px] uppercase tracking-wider px-2 py-0.5 rounded ${report.status === 'completed' ? 'bg-green-500/10 text-green-400' : 'bg-red-500/10 text-red-400'}`}>{report.status}</span>
+                                <span className="text-[10px] text-muted-foreground font-mono">{report.step_count} steps · {Math.round(report.duration_ms / 1000)}s</span>
                             </div>
                         </div>
                     ))}
                 </div>
             )}
+
+            {nextCursor && (
+                <button
+                    onClick={() => loadPage(nextCursor)}
+                    className="mt-6 w-full py-3 rounded-lg bg-white/5 hover:bg-white/10 border border-white/10 text-sm text-muted-foreground transition-colors"
+                >
+                    Load more
+                </button>
+            )}
         </div>
     );
 };
@@ -1,5 +1,5 @@
-import { useEffect, useState } from 'react'
-import { Play, FileJson, Clock } from 'lucide-react'
+import { useEffect, useRef, useState } from 'react'
+import { Play, FileJson, Clock, Search } from 'lucide-react'
 import { Socket } from 'socket.io-client'
 import CaseDetailModal from './CaseDetailModal'
 
@@ -11,32 +11,77 @@ interface TestCase {
     created_at: string
 }
 
+interface TestCaseSummary {
+    id: number
+    name: string
+    description: string
+    prompt_count: number
+    tags: string[]
+    created_at: string
+}
+
+interface CasesPage {
+    cases: TestCaseSummary[]
+    next_cursor: string | null
+    cursor: string | null
+}
+
+const PAGE_SIZE = 30
+
 interface LibraryViewProps {
     socket: Socket | null
     connected: boolean
 }
 
 export default function LibraryView({ socket, connected }: LibraryViewProps) {
-    const [cases, setCases] = useState<TestCase[]>([])
+    const [cases, setCases] = useState<TestCaseSummary[]>([])
     const [isLoading, setIsLoading] = useState(false)
     const [selectedCase, setSelectedCase] = useState<TestCase | null>(null)
+    const [query, setQuery] = useState('')
+    const [nextCursor, setNextCursor] = useState<string | null>(null)
+    const queryRef = useRef('')
 
-    useEffect(() => {
+    const loadPage = (cursor: string | null) => {
         if (!socket) return
+        setIsLoading(true)
+        socket.emit('load_cases', { limit: PAGE_SIZE, cursor, query: queryRef.current })
+    }
 
-        // Request list on mount
-        socket.emit('load_cases', {})
+    useEffect(() => {
+        if (!socket) return
 
-        socket.on('cases_list', (data: TestCase[]) => {
-            setCases(data)
+        socket.on('cases_list', (data: CasesPage) => {
+            setCases(prev => data.cursor ? [...prev, ...data.cases] : data.cases)
+            setNextCursor(data.next_cursor)
             setIsLoading(false)
         })
 
+        socket.on('case_detail', (data: TestCase) => {
+            setSelectedCase(data)
+        })
+
+        // Request first page on mount
+        loadPage(null)
+
         return () => {
             socket.off('cases_list')
+            socket.off('case_detail')
         }
     }, [socket])
 
+    // Debounced search
+    useEffect(() => {
+        if (queryRef.current === query) return
+        queryRef.current = query
+        const timer = setTimeout(() => loadPage(null), 250)
+        return () => clearTimeout(timer)
+    }, [query])
+
+    const openCase = (caseId: number) => {
+        if (!socket) return
+        socket.emit('get_case_detail', { case_id: caseId })
+    }
+
     const handleReplay = (caseId: number) => {
         if (!socket || !connected) return
         socket.emit('replay_case', { case_id: caseId })
@@ -49,9 +94,18 @@ export default function LibraryView({ socket, connected }: LibraryViewProps) {
                 <div>
                     <h1 className="text-2xl font-light text-white tracking-wide">测试用例库</h1>
                     <p className="text-xs text-muted-foreground mt-1 font-mono">
-                        {cases.length} 个已保存的工作流可供回放
+                        {cases.length}{nextCursor ? '+' : ''} 个已保存的工作流可供回放
                     </p>
                 </div>
+                <div className="relative w-72">
+                    <Search className="w-4 h-4 absolute left-3 top-1/2 -translate-y-1/2 text-slate-500" />
+                    <input
+                        value={query}
+                        onChange={(e) => setQuery(e.target.value)}
+                        placeholder="搜索名称、描述或步骤..."
+                        className="w-full pl-9 pr-3 py-2 rounded-lg bg-black/30 border border-white/10 text-sm text-slate-200 placeholder:text-slate-600 focus:outline-none focus:border-primary/50"
+                    />
+                </div>
             </header>
 
             {/* List */}
@@ -59,7 +113,7 @@ export default function LibraryView({ socket, connected }: LibraryViewProps) {
                 {cases.map((testCase) => (
                     <div
                         key={testCase.id}
-                        onClick={() => setSelectedCase(testCase)}
+                        onClick={() => openCase(testCase.id)}
                         className="group bg-card border border-white/5 hover:border-primary/50 rounded-xl p-5 transition-all hover:shadow-2xl hover:bg-white/[0.02] flex flex-col gap-4 relative overflow-hidden cursor-pointer active:scale-[0.98]"
                     >
                         <div className="absolute top-0 right-0 p-4 opacity-0 group-hover:opacity-100 transition-opacity">
@@ -84,20 +138,17 @@ export default function LibraryView({ socket, connected }: LibraryViewProps) {
                                 {new Date(testCase.created_at).toLocaleString()}
                             </div>
 
-                            <div className="p-3 rounded-lg bg-black/40 border border-white/5 text-xs font-mono text-slate-400 space-y-1">
-                                <div className="text-[10px] uppercase tracking-widest text-slate-600 mb-1">步骤 (STEPS)</div>
-                                {testCase.prompts.slice(0, 3).map((prompt, idx) => (
-                                    <div key={idx} className="truncate flex gap-2">
-                                        <span className="text-primary/50">{idx + 1}.</span>
-                                        {prompt}
-                                    </div>
-                                ))}
-                                {testCase.prompts.length > 3 && (
-                                    <div className="text-center opacity-50 text-[10px] pt-1">
-                                        + 还有 {testCase.prompts.length - 3} 个步骤
-                                    </div>
-                                )}
+                            <div className="p-3 rounded-lg bg-black/40 border border-white/5 text-xs font-mono text-slate-400 flex items-center justify-between">
+                                <span className="text-[10px] uppercase tracking-widest text-slate-600">步骤 (STEPS)</span>
+                                <span className="text-primary/70">{testCase.prompt_count}</span>
                             </div>
+                            {testCase.tags.length > 0 && (
+                                <div className="flex flex-wrap gap-1">
+                                    {testCase.tags.map(tag => (
+                                        <span key={tag} className="text-[10px] px-2 py-0.5 rounded bg-primary/10 text-primary/80">{tag}</span>
+                                    ))}
+                                </div>
+                            )}
                         </div>
 
                         <button
@@ -114,6 +165,16 @@ export default function LibraryView({ socket, connected }: LibraryViewProps) {
                     </div>
                 ))}
 
+                {nextCursor && (
+                    <button
+                        onClick={() => loadPage(nextCursor)}
+                        disabled={isLoading}
+                        className="col-span-full py-3 rounded-lg bg-white/5 hover:bg-white/10 border border-white/10 text-sm text-muted-foreground transition-colors disabled:opacity-50"
+                    >
+                        加载更多
+                    </button>
+                )}
+
                 {cases.length === 0 && !isLoading && (
                     <div className="col-span-full flex flex-col items-center justify-center py-20 text-muted-foreground opacity-50">
                         <FileJson className="w-16 h-16 mb-4 stroke-1" />